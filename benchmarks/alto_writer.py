@@ -0,0 +1,75 @@
+#!/bin/env python
+
+import click
+import os
+import random
+import time
+import tracemalloc
+from typing import Callable, List, Tuple
+from lp_labelstudio.alto_generator import create_alto_xml_dom, write_alto_xml
+
+
+def synthetic_results(blocks: int) -> List[Tuple[List[float], Tuple[str, float]]]:
+    """OCR results shaped like the ones of a dense newspaper page"""
+    rng = random.Random(0)
+    words = "la masca giornale settimanale di Genova cronaca sport cultura".split()
+    results = []
+    for _ in range(blocks):
+        x, y = rng.uniform(0, 3000), rng.uniform(0, 4500)
+        text = " ".join(rng.choices(words, k=rng.randint(1, 8)))
+        results.append(
+            (
+                [x, y, x + rng.uniform(50, 800), y + rng.uniform(20, 60)],
+                (text, rng.random()),
+            )
+        )
+    return results
+
+
+def measure(function: Callable[[], None]) -> Tuple[float, int]:
+    """Return seconds taken and peak memory allocated by `function`"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+@click.command()
+@click.option(
+    "--blocks",
+    type=click.IntRange(min=1),
+    multiple=True,
+    default=[100, 1000, 10000],
+    show_default=True,
+    help="Number of text blocks per page. Can be repeated",
+)
+def alto_writer(blocks: Tuple[int, ...]):
+    """
+    Compare the streaming ALTO writer against the ElementTree + minidom implementation.
+    """
+    for count in blocks:
+        results = synthetic_results(count)
+
+        # Write to /dev/null, so that only memory used while generating is measured
+        def dom():
+            with open(os.devnull, "w", encoding="utf-8") as f:
+                f.write(create_alto_xml_dom(3000, 4500, results))
+
+        def streaming():
+            with open(os.devnull, "w", encoding="utf-8") as f:
+                write_alto_xml(f, 3000, 4500, iter(results))
+
+        dom_time, dom_peak = measure(dom)
+        stream_time, stream_peak = measure(streaming)
+        click.echo(
+            f"{count} blocks: minidom {dom_time:.3f}s {dom_peak / 2**20:.1f}MiB, "
+            f"streaming {stream_time:.3f}s {stream_peak / 2**20:.1f}MiB "
+            f"({dom_time / stream_time:.1f}x faster)"
+        )
+
+
+if __name__ == "__main__":
+    alto_writer()
@@ -0,0 +1,68 @@
+#!/bin/env python
+
+import click
+import random
+import time
+from typing import Tuple
+from lp_labelstudio.article_reconstruction import ArticleReconstructor
+
+LABELS = ["Headline", "SubHeadline", "Text", "Photograph", "Author"]
+
+
+def synthetic_page(zones: int, seed: int = 0) -> ArticleReconstructor:
+    """A reconstructor with `zones` random zones, in percentages of the page like real ones"""
+    rng = random.Random(seed)
+    reconstructor = ArticleReconstructor()
+    for i in range(zones):
+        reconstructor.add_zone(
+            {
+                "id": f"zone{i}",
+                "value": {
+                    "x": rng.uniform(0, 95),
+                    "y": rng.uniform(0, 95),
+                    "width": rng.uniform(1, 30),
+                    "height": rng.uniform(1, 10),
+                    "labels": [rng.choice(LABELS)],
+                },
+            }
+        )
+    return reconstructor
+
+
+@click.command()
+@click.option(
+    "--zones",
+    type=click.IntRange(min=1),
+    multiple=True,
+    default=[50, 500, 5000],
+    show_default=True,
+    help="Number of zones per page. Can be repeated",
+)
+def article_reconstruction(zones: Tuple[int, ...]):
+    """
+    Compare the scalar and the vectorized construction of the article reconstruction graph.
+    """
+    for count in zones:
+        timings = {}
+        graphs = {}
+        for name, options in (
+            ("scalar", dict(vectorized=False)),
+            ("vectorized", dict(vectorized=True, debug=False)),
+            ("vectorized+debug", dict(vectorized=True)),
+        ):
+            reconstructor = synthetic_page(count)
+            start = time.perf_counter()
+            reconstructor.build_graph(**options)
+            timings[name] = time.perf_counter() - start
+            graphs[name] = dict(reconstructor.graph)
+        edges = sum(len(edges) for edges in graphs["scalar"].values())
+        assert all(graph == graphs["scalar"] for graph in graphs.values())
+        click.echo(
+            f"{count} zones, {edges} edges: "
+            + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in timings.items())
+            + f" ({timings['scalar'] / timings['vectorized']:.1f}x faster)"
+        )
+
+
+if __name__ == "__main__":
+    article_reconstruction()
@@ -0,0 +1,120 @@
+#!/bin/env python
+
+import click
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, List, Tuple
+from lp_labelstudio.collect_coco import collect_coco_dict, write_coco
+
+LABELS = ["Headline", "SubHeadline", "Text", "Photograph", "Author", "Advertisement"]
+
+
+def synthetic_corpus(
+    folder: Path, pages: int, pages_per_issue: int, annotations: int
+) -> List[str]:
+    """Write manifests of annotated issues totalling `pages` pages, return their paths"""
+    rng = random.Random(0)
+    manifests = []
+    for issue in range(0, pages, pages_per_issue):
+        manifest = []
+        for page in range(min(pages_per_issue, pages - issue)):
+            results = []
+            for i in range(annotations):
+                results.append(
+                    {
+                        "id": f"zone{i}",
+                        "original_width": 3000,
+                        "original_height": 4500,
+                        "value": {
+                            "x": rng.uniform(0, 95),
+                            "y": rng.uniform(0, 95),
+                            "width": rng.uniform(1, 30),
+                            "height": rng.uniform(1, 10),
+                            "labels": [rng.choice(LABELS)],
+                        },
+                    }
+                )
+            manifest.append(
+                {
+                    "data": {
+                        "ocr": f"https://example.com/issue-{issue}/page_{page + 1:02d}.jpeg",
+                        "pageNumber": page + 1,
+                    },
+                    "annotations": [{"result": results}],
+                }
+            )
+        path = folder / f"issue-{issue}" / "manifest.json"
+        path.parent.mkdir()
+        path.write_text(json.dumps(manifest))
+        manifests.append(str(path))
+    return manifests
+
+
+def measure(function: Callable[[], None]) -> Tuple[float, int]:
+    """Return seconds taken and peak memory allocated by `function`"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+@click.command()
+@click.option("--pages", type=click.IntRange(min=1), default=100000, show_default=True)
+@click.option(
+    "--pages-per-issue", type=click.IntRange(min=1), default=12, show_default=True
+)
+@click.option(
+    "--annotations",
+    type=click.IntRange(min=1),
+    default=20,
+    show_default=True,
+    help="Number of annotations per page",
+)
+@click.option(
+    "--skip-in-memory",
+    is_flag=True,
+    help="Only measure the streaming writer, the in-memory one needs several GiB",
+)
+def collect_coco(
+    pages: int, pages_per_issue: int, annotations: int, skip_in_memory: bool
+):
+    """
+    Compare the streaming COCO writer against collecting the whole dataset in memory
+    and dumping it with indentation, on a synthetic corpus.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        manifests = synthetic_corpus(Path(folder), pages, pages_per_issue, annotations)
+
+        # Write to /dev/null, so that only memory used while collecting is measured
+        def in_memory():
+            with open(os.devnull, "w", encoding="utf-8") as f:
+                json.dump(collect_coco_dict(manifests), f, indent=2)
+
+        def streaming():
+            with open(os.devnull, "w", encoding="utf-8") as f:
+                write_coco(manifests, f)
+
+        stream_time, stream_peak = measure(streaming)
+        summary = (
+            f"{pages} pages in {len(manifests)} manifests: "
+            f"streaming {stream_time:.3f}s {stream_peak / 2**20:.1f}MiB"
+        )
+        if not skip_in_memory:
+            memory_time, memory_peak = measure(in_memory)
+            summary += (
+                f", in memory {memory_time:.3f}s {memory_peak / 2**20:.1f}MiB "
+                f"({memory_time / stream_time:.1f}x slower)"
+            )
+        click.echo(summary)
+
+
+if __name__ == "__main__":
+    collect_coco()
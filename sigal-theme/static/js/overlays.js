@@ -0,0 +1,23 @@
+// Draw the annotation overlay of a page (page_01.overlay.svg, written by
+// `lp-labelstudio generate-thumbnails --overlays sidecar`) over the page shown by colorbox.
+// Pages without an overlay file are shown as they are.
+$(document).bind('cbox_complete', function(){
+  var photo = $("#cboxLoadedContent .cboxPhoto");
+  if (!photo.length) {
+    return;
+  }
+  $("#cboxLoadedContent").css("position", "relative");
+  var src = photo.attr("src").replace(/\.[^.\/]+$/, ".overlay.svg");
+  $("<img>", {"class": "page-overlay", alt: ""})
+    .css({
+      position: "absolute",
+      left: photo.position().left,
+      top: photo.position().top,
+      width: photo.width(),
+      height: photo.height(),
+      pointerEvents: "none"
+    })
+    .on("error", function(){ $(this).remove(); })
+    .attr("src", src)
+    .insertAfter(photo);
+});
@@ -22,7 +22,14 @@ title = "la masca"
 # Theme :
 # - colorbox (default), galleria, photoswipe, or the path to a custom theme
 # directory
-theme = "colorbox"
+# The colorbox theme, with the script in sigal-theme drawing the annotation overlays
+# of the pages. Sigal themes cannot extend each other: update-preview.sh assembles it
+# from both. Until it has been assembled, the plain colorbox theme is used.
+import os
+
+theme = "/tmp/sigal-theme" if os.path.isdir("/tmp/sigal-theme") else "colorbox"
+# Every name defined in this file is read as a setting
+del os
 
 # Theme for galleria (https://galleriajs.github.io/themes/)
 # galleria_theme = 'classic'
@@ -1,12 +1,16 @@
-from typing import List, Tuple
+import io
+from typing import Iterable, List, Optional, TextIO, Tuple
+from xml.sax.saxutils import escape
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
 
+ALTO_NAMESPACE = "http://www.loc.gov/standards/alto/ns-v4#"
+
 
 def create_alto_xml(
     image_width: int,
     image_height: int,
-    ocr_results: List[Tuple[List[float], Tuple[str, float]]],
+    ocr_results: Iterable[Tuple[List[float], Tuple[str, float]]],
 ) -> str:
     """
     Create ALTO XML from OCR results
@@ -16,9 +20,95 @@ def create_alto_xml(
         image_height: Height of the original image
         ocr_results: List of (bbox, (text, confidence)) tuples from PaddleOCR
     """
+    out = io.StringIO()
+    write_alto_xml(out, image_width, image_height, ocr_results)
+    return out.getvalue()
+
+
+def write_alto_xml(
+    out: TextIO,
+    image_width: int,
+    image_height: int,
+    ocr_results: Iterable[Tuple[List[float], Tuple[str, Optional[float]]]],
+    indent: str = "    ",
+) -> None:
+    """
+    Write ALTO XML for a page to `out`, one TextBlock at a time.
+
+    `ocr_results` can be a generator: results are consumed and written as they come,
+    without building the document in memory. The output is the same as the one
+    of `create_alto_xml_dom`. Pass an empty `indent` for compact output without newlines.
+    The WC attribute is left out for results whose confidence is None.
+
+    Args:
+        out: Text file handle to write to
+        image_width: Width of the original image
+        image_height: Height of the original image
+        ocr_results: (bbox, (text, confidence)) tuples from PaddleOCR
+        indent: Indentation of each nesting level
+    """
+    newline = "\n" if indent else ""
+
+    def write(depth: int, tag: str) -> None:
+        out.write(f"{indent * depth}{tag}{newline}")
+
+    out.write('<?xml version="1.0" ?>\n')
+    write(0, f'<alto xmlns="{ALTO_NAMESPACE}">')
+    write(1, "<Layout>")
+    write(
+        2,
+        f'<Page ID="0001" WIDTH="{float(image_width)}" HEIGHT="{float(image_height)}">',
+    )
+
+    empty = True
+    for idx, (bbox, (text, confidence)) in enumerate(ocr_results):
+        if empty:
+            write(3, "<PrintSpace>")
+            empty = False
+        position = (
+            f'HPOS="{float(bbox[0])}" VPOS="{float(bbox[1])}" '
+            f'WIDTH="{float(bbox[2] - bbox[0])}" HEIGHT="{float(bbox[3] - bbox[1])}"'
+        )
+        write(4, f'<TextBlock ID="block_{idx}" {position}>')
+        write(5, f"<TextLine {position}>")
+        word_confidence = "" if confidence is None else f' WC="{confidence}"'
+        write(
+            6,
+            f'<String CONTENT="{escape_attribute(text)}" {position}{word_confidence}/>',
+        )
+        write(5, "</TextLine>")
+        write(4, "</TextBlock>")
+    if empty:
+        write(3, "<PrintSpace/>")
+    else:
+        write(3, "</PrintSpace>")
+
+    write(2, "</Page>")
+    write(1, "</Layout>")
+    write(0, "</alto>")
+
+
+def escape_attribute(value: str) -> str:
+    """
+    >>> escape_attribute('Il "Secolo XIX" & <altro>')
+    'Il &quot;Secolo XIX&quot; &amp; &lt;altro&gt;'
+    """
+    return escape(value, {'"': "&quot;"})
+
+
+def create_alto_xml_dom(
+    image_width: int,
+    image_height: int,
+    ocr_results: List[Tuple[List[float], Tuple[str, float]]],
+) -> str:
+    """
+    Reference implementation of `create_alto_xml`, building the whole document with
+    ElementTree and pretty printing it with minidom. Kept to check the output of
+    `write_alto_xml` and to compare performance (see benchmarks/alto_writer.py).
+    """
     # Create the root element with namespace
     alto = ET.Element("alto")
-    alto.set("xmlns", "http://www.loc.gov/standards/alto/ns-v4#")
+    alto.set("xmlns", ALTO_NAMESPACE)
 
     # Create Layout element
     layout = ET.SubElement(alto, "Layout")
@@ -0,0 +1,517 @@
+"""
+Index of the pages and annotations of the whole archive, stored in a SQLite database.
+
+The index holds the issues, their pages with the image size, the annotation files
+fetched from Label Studio (see `labelstudio-api projects fetch`) with their annotator
+and version, and the labelled regions of every annotation. It is updated incrementally:
+only images and annotation files whose mtime (or size) changed are read again.
+`labelstudio-api projects fetch` updates the issues it fetched annotations for.
+
+The location defaults to `~/.cache/lp-labelstudio/annotations.sqlite3` and can be
+changed with the `LP_ANNOTATION_INDEX` environment variable. Commands reading
+annotations use the index when it exists and the annotation files of the issue are
+still the indexed ones (same mtime and size), and the files otherwise.
+"""
+
+import click
+import json
+import logging
+import os
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from PIL import Image
+from lp_labelstudio.constants import JPEG_EXTENSION
+from lp_labelstudio.generate_manifest import (
+    get_date,
+    get_page_number,
+    is_issue_directory,
+    list_annotation_files,
+)
+
+logger = logging.getLogger(__name__)
+
+# An index with a different schema version is rebuilt from scratch
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS issues (
+    id INTEGER PRIMARY KEY,
+    directory TEXT UNIQUE NOT NULL,
+    date TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY,
+    issue_id INTEGER NOT NULL REFERENCES issues (id) ON DELETE CASCADE,
+    page_number INTEGER NOT NULL,
+    image_path TEXT UNIQUE NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    UNIQUE (issue_id, page_number)
+);
+CREATE TABLE IF NOT EXISTS annotation_files (
+    issue_id INTEGER NOT NULL REFERENCES issues (id) ON DELETE CASCADE,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS annotation_files_issue ON annotation_files (issue_id);
+CREATE TABLE IF NOT EXISTS annotations (
+    id INTEGER PRIMARY KEY,
+    page_id INTEGER NOT NULL REFERENCES pages (id) ON DELETE CASCADE,
+    path TEXT UNIQUE NOT NULL,
+    annotator TEXT NOT NULL,
+    labelstudio_id INTEGER,
+    updated_at TEXT,
+    result TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS annotations_page ON annotations (page_id);
+CREATE INDEX IF NOT EXISTS annotations_annotator ON annotations (annotator);
+CREATE TABLE IF NOT EXISTS regions (
+    annotation_id INTEGER NOT NULL REFERENCES annotations (id) ON DELETE CASCADE,
+    region_id TEXT,
+    label TEXT NOT NULL,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    width REAL NOT NULL,
+    height REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS regions_label ON regions (label, annotation_id);
+CREATE INDEX IF NOT EXISTS regions_annotation ON regions (annotation_id);
+"""
+
+
+class AnnotationIndex:
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.db = sqlite3.connect(str(path))
+        self.db.execute("PRAGMA foreign_keys = ON")
+        (version,) = self.db.execute("PRAGMA user_version").fetchone()
+        if version != SCHEMA_VERSION:
+            self.db.executescript("""DROP TABLE IF EXISTS regions;
+                DROP TABLE IF EXISTS annotations;
+                DROP TABLE IF EXISTS annotation_files;
+                DROP TABLE IF EXISTS pages;
+                DROP TABLE IF EXISTS issues;""")
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def update(self, root: Path) -> Dict[str, int]:
+        """
+        Bring the index up to date with the issue directories found under `root`.
+        Issues under `root` that no longer exist are removed.
+        Return the number of issues, and of pages and annotations read again.
+        """
+        root = root.resolve()
+        stats = {"issues": 0, "pages": 0, "annotations": 0}
+        seen = set()
+        for directory, files in issue_directories(root):
+            seen.add(str(directory))
+            pages, annotations = self.update_issue(directory, files)
+            stats["issues"] += 1
+            stats["pages"] += pages
+            stats["annotations"] += annotations
+        for issue_id, directory in self.db.execute(
+            "SELECT id, directory FROM issues"
+        ).fetchall():
+            if directory not in seen and Path(directory).is_relative_to(root):
+                self.db.execute("DELETE FROM issues WHERE id = ?", (issue_id,))
+        self.db.commit()
+        return stats
+
+    def update_directory(self, directory: Path) -> Tuple[int, int]:
+        """
+        Bring a single issue up to date, if it has page images.
+        Return the number of pages and annotations read again.
+        """
+        directory = directory.resolve()
+        jpeg_files = page_images(directory)
+        if not jpeg_files or not is_indexed_directory(directory):
+            return 0, 0
+        counts = self.update_issue(directory, jpeg_files)
+        self.db.commit()
+        return counts
+
+    def update_issue(self, directory: Path, jpeg_files: List[str]) -> Tuple[int, int]:
+        self.db.execute(
+            "INSERT OR IGNORE INTO issues (directory, date) VALUES (?, ?)",
+            (str(directory), get_date(str(directory))),
+        )
+        (issue_id,) = self.db.execute(
+            "SELECT id FROM issues WHERE directory = ?", (str(directory),)
+        ).fetchone()
+
+        known_pages = {
+            image_path: (page_id, mtime_ns)
+            for page_id, image_path, mtime_ns in self.db.execute(
+                "SELECT id, image_path, mtime_ns FROM pages WHERE issue_id = ?",
+                (issue_id,),
+            )
+        }
+        pages_read = 0
+        for jpeg_file in jpeg_files:
+            image_path = str(directory / jpeg_file)
+            mtime_ns = os.stat(image_path).st_mtime_ns
+            known = known_pages.pop(image_path, None)
+            if known and known[1] == mtime_ns:
+                continue
+            with Image.open(image_path) as img:
+                width, height = img.size
+            self.db.execute(
+                """INSERT INTO pages
+                    (issue_id, page_number, image_path, width, height, mtime_ns)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (image_path) DO UPDATE SET
+                    width = excluded.width,
+                    height = excluded.height,
+                    mtime_ns = excluded.mtime_ns""",
+                (
+                    issue_id,
+                    get_page_number(jpeg_file),
+                    image_path,
+                    width,
+                    height,
+                    mtime_ns,
+                ),
+            )
+            pages_read += 1
+        self.db.executemany(
+            "DELETE FROM pages WHERE id = ?",
+            [(page_id,) for page_id, _ in known_pages.values()],
+        )
+
+        page_ids = dict(
+            self.db.execute(
+                "SELECT page_number, id FROM pages WHERE issue_id = ?", (issue_id,)
+            ).fetchall()
+        )
+        # Every JSON file seen, including those of pages missing from the index
+        known_files = {
+            path: (mtime_ns, size)
+            for path, mtime_ns, size in self.db.execute(
+                "SELECT path, mtime_ns, size FROM annotation_files WHERE issue_id = ?",
+                (issue_id,),
+            )
+        }
+        indexed = {
+            path
+            for (path,) in self.db.execute(
+                """SELECT path FROM annotations
+                JOIN pages ON pages.id = annotations.page_id
+                WHERE pages.issue_id = ?""",
+                (issue_id,),
+            )
+        }
+        annotations_read = 0
+        for entry in annotation_files(directory):
+            signature = file_signature(entry)
+            unchanged = known_files.pop(entry.path, None) == signature
+            # Annotations of pages that were missing are retried when pages change
+            if unchanged and (entry.path in indexed or not pages_read):
+                continue
+            self.db.execute("DELETE FROM annotations WHERE path = ?", (entry.path,))
+            self.db.execute(
+                """INSERT INTO annotation_files (issue_id, path, mtime_ns, size)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (path) DO UPDATE SET
+                    mtime_ns = excluded.mtime_ns,
+                    size = excluded.size""",
+                (issue_id, entry.path, *signature),
+            )
+            with open(entry.path) as f:
+                annotation = json.load(f)
+            page_number = annotation["task"]["data"]["pageNumber"]
+            if page_number not in page_ids:
+                logger.warning(f"No page {page_number} for annotation {entry.path}")
+                continue
+            self.add_annotation(
+                page_ids[page_number],
+                entry.path,
+                os.path.basename(os.path.dirname(entry.path)),
+                annotation,
+            )
+            annotations_read += 1
+        removed = [(path,) for path in known_files]
+        self.db.executemany("DELETE FROM annotation_files WHERE path = ?", removed)
+        self.db.executemany("DELETE FROM annotations WHERE path = ?", removed)
+        return pages_read, annotations_read
+
+    def add_annotation(
+        self,
+        page_id: int,
+        path: str,
+        annotator: str,
+        annotation: Dict[str, Any],
+    ) -> None:
+        cursor = self.db.execute(
+            """INSERT INTO annotations
+                (page_id, path, annotator, labelstudio_id, updated_at, result)
+            VALUES (?, ?, ?, ?, ?, ?)""",
+            (
+                page_id,
+                path,
+                annotator,
+                annotation.get("id"),
+                annotation.get("updated_at"),
+                json.dumps(annotation["result"]),
+            ),
+        )
+        self.db.executemany(
+            "INSERT INTO regions VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    cursor.lastrowid,
+                    result.get("id"),
+                    result["value"]["labels"][0],
+                    result["value"]["x"],
+                    result["value"]["y"],
+                    result["value"]["width"],
+                    result["value"]["height"],
+                )
+                for result in annotation["result"]
+                if "labels" in result.get("value", {})
+            ],
+        )
+
+    def pages(
+        self,
+        label: Optional[str] = None,
+        min_count: int = 1,
+        annotator: Optional[str] = None,
+    ) -> List[str]:
+        """
+        Image paths of the annotated pages, optionally only those with an annotation
+        (by `annotator`) containing at least `min_count` regions labelled `label`.
+        """
+        conditions, params = [], []
+        if annotator:
+            conditions.append("annotations.annotator = ?")
+            params.append(annotator)
+        query = """SELECT DISTINCT pages.image_path
+            FROM pages JOIN annotations ON annotations.page_id = pages.id"""
+        if label:
+            conditions.append(
+                """(SELECT COUNT(*) FROM regions
+                WHERE regions.annotation_id = annotations.id AND regions.label = ?) >= ?"""
+            )
+            params.extend([label, min_count])
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY pages.image_path"
+        return [image_path for (image_path,) in self.db.execute(query, params)]
+
+    def page_annotation(
+        self, image_path: Path
+    ) -> Optional[Tuple[List[Dict[str, Any]], int, int]]:
+        """
+        Results of the first annotation of a page, and the page size, if indexed and
+        neither the image nor the annotation files of its issue changed since
+        """
+        row = self.db.execute(
+            """SELECT issues.id, issues.directory, annotations.result,
+                pages.width, pages.height
+            FROM pages
+            JOIN issues ON issues.id = pages.issue_id
+            JOIN annotations ON annotations.page_id = pages.id
+            WHERE pages.image_path = ? AND pages.mtime_ns = ?
+            ORDER BY annotations.path LIMIT 1""",
+            (str(image_path.resolve()), image_path.stat().st_mtime_ns),
+        ).fetchone()
+        if row is None:
+            return None
+        issue_id, directory, result, width, height = row
+        if not self.annotations_up_to_date(issue_id, Path(directory)):
+            return None
+        return json.loads(result), width, height
+
+    def annotations_up_to_date(self, issue_id: int, directory: Path) -> bool:
+        """Whether the annotation files of an issue are the indexed ones"""
+        indexed = {
+            path: (mtime_ns, size)
+            for path, mtime_ns, size in self.db.execute(
+                "SELECT path, mtime_ns, size FROM annotation_files WHERE issue_id = ?",
+                (issue_id,),
+            )
+        }
+        on_disk = {
+            entry.path: file_signature(entry) for entry in annotation_files(directory)
+        }
+        return indexed == on_disk
+
+    def annotator_counts(self, directory: Path) -> Optional[Dict[str, int]]:
+        """
+        Number of annotations of every annotator of an issue, if indexed and its
+        annotation files did not change since
+        """
+        directory = directory.resolve()
+        row = self.db.execute(
+            "SELECT id FROM issues WHERE directory = ?", (str(directory),)
+        ).fetchone()
+        if row is None or not self.annotations_up_to_date(row[0], directory):
+            return None
+        return dict(
+            self.db.execute(
+                """SELECT annotator, COUNT(*)
+                FROM annotations JOIN pages ON pages.id = annotations.page_id
+                WHERE pages.issue_id = ?
+                GROUP BY annotator ORDER BY annotator""",
+                row,
+            ).fetchall()
+        )
+
+
+def issue_directories(root: Path) -> Iterator[Tuple[Path, List[str]]]:
+    """Yield the directories under `root` with page images, and their sorted images"""
+    for directory, dirs, files in os.walk(root):
+        dirs.sort()
+        jpeg_files = sorted(f for f in files if is_page_image(f))
+        if jpeg_files and is_indexed_directory(Path(directory)):
+            yield Path(directory), jpeg_files
+
+
+def is_indexed_directory(directory: Path) -> bool:
+    """Only issue directories are indexed: their name gives the date of the issue"""
+    if is_issue_directory(str(directory)):
+        return True
+    logger.warning(f"Skipping {directory}: not an issue directory (lamasca-YYYY-MM-DD)")
+    return False
+
+
+def is_page_image(filename: str) -> bool:
+    return filename.startswith("page_") and filename.endswith(JPEG_EXTENSION)
+
+
+def page_images(directory: Path) -> List[str]:
+    if not directory.is_dir():
+        return []
+    return sorted(f for f in os.listdir(directory) if is_page_image(f))
+
+
+def annotation_files(directory: Path) -> List[os.DirEntry]:
+    """The JSON annotation files of an issue"""
+    return [
+        entry
+        for entry in list_annotation_files(directory / "annotations")
+        if entry.name.endswith(".json")
+    ]
+
+
+def file_signature(entry: os.DirEntry) -> Tuple[int, int]:
+    stat = entry.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def update_indexed_issues(directories: Iterable[Path]) -> Optional[int]:
+    """
+    Update the issues in `directories` in the annotation index, if it has been built.
+    Return the number of annotations read again.
+    """
+    index = open_annotation_index()
+    if index is None:
+        return None
+    try:
+        return sum(index.update_directory(directory)[1] for directory in directories)
+    finally:
+        index.close()
+
+
+def index_path() -> Path:
+    cache_home = (
+        Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+        / "lp-labelstudio"
+    )
+    return Path(
+        os.environ.get("LP_ANNOTATION_INDEX", cache_home / "annotations.sqlite3")
+    )
+
+
+def open_annotation_index() -> Optional[AnnotationIndex]:
+    """The annotation index, if it has been built"""
+    path = index_path()
+    if not path.exists():
+        return None
+    return AnnotationIndex(path)
+
+
+@click.group(name="index")
+@click.option(
+    "--db",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=index_path,
+    show_default="$LP_ANNOTATION_INDEX or ~/.cache/lp-labelstudio/annotations.sqlite3",
+    help="Path of the index database",
+)
+@click.pass_context
+def annotation_index(ctx, db: Path):
+    """Index of the pages and annotations of the archive."""
+    ctx.ensure_object(dict)
+    ctx.obj["db"] = db
+
+
+@annotation_index.command()
+@click.argument(
+    "root", type=click.Path(exists=True, file_okay=False, dir_okay=True, path_type=Path)
+)
+@click.pass_context
+def build(ctx, root: Path):
+    """Build the index from scratch with the issues found under ROOT."""
+    db: Path = ctx.obj["db"]
+    if db.exists():
+        db.unlink()
+    update_index(db, root)
+
+
+@annotation_index.command()
+@click.argument(
+    "root", type=click.Path(exists=True, file_okay=False, dir_okay=True, path_type=Path)
+)
+@click.pass_context
+def update(ctx, root: Path):
+    """Update the index with the images and annotation files changed under ROOT."""
+    update_index(ctx.obj["db"], root)
+
+
+def update_index(db: Path, root: Path) -> None:
+    index = AnnotationIndex(db)
+    try:
+        stats = index.update(root)
+    finally:
+        index.close()
+    click.echo(
+        click.style(
+            f"Indexed {stats['issues']} issues in {db}: read {stats['pages']} pages "
+            f"and {stats['annotations']} annotations",
+            fg="green",
+        )
+    )
+
+
+@annotation_index.command()
+@click.option("--label", help="Only pages with regions with this label")
+@click.option(
+    "--min-count",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Minimum number of regions with --label in the same annotation",
+)
+@click.option("--annotator", help="Only pages annotated by this annotator")
+@click.pass_context
+def pages(ctx, label: Optional[str], min_count: int, annotator: Optional[str]):
+    """
+    Print the image paths of the annotated pages matching the given criteria,
+    e.g. all pages with at least one Headline annotated by an annotator.
+    """
+    db: Path = ctx.obj["db"]
+    if not db.exists():
+        raise click.ClickException(f"No index in {db}: run `index build` first")
+    index = AnnotationIndex(db)
+    try:
+        for image_path in index.pages(label, min_count, annotator):
+            click.echo(image_path)
+    finally:
+        index.close()
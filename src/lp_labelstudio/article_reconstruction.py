@@ -1,7 +1,10 @@
+import heapq
+import math
 from typing import List, Dict, Any, Tuple
 import numpy as np
 from dataclasses import dataclass
 from collections import defaultdict
+from itertools import count
 
 
 @dataclass
@@ -25,9 +28,14 @@ class ArticleReconstructor:
         "Author",
     }
 
+    # Zones whose top left corners are at least this far apart are not connected
+    MAX_EDGE_DISTANCE = 100
+
     def __init__(self):
         self.zones: List[Zone] = []
         self.graph = defaultdict(list)
+        # Zones by id, filled in by build_graph
+        self.zones_by_id: Dict[str, Zone] = {}
 
     def add_zone(self, zone_data: Dict[str, Any]) -> None:
         """Add a zone from Label Studio annotation data"""
@@ -48,20 +56,98 @@ class ArticleReconstructor:
         )
         self.zones.append(zone)
 
-    def build_graph(self) -> None:
-        """Build connectivity graph between zones"""
+    def build_graph(self, vectorized: bool = False, debug: bool = True) -> None:
+        """
+        Build connectivity graph between zones.
+
+        With `vectorized`, edge weights are computed with NumPy on blocks of zones,
+        giving the same graph. The `debug_weights` of zones are only filled in with `debug`.
+        """
         # Sort zones by y-coordinate for top-down processing
         self.zones.sort(key=lambda z: z.y)
-
-        # Build edges between zones based on spatial relationships
+        self.zones_by_id = {}
+        for zone in self.zones:
+            self.zones_by_id.setdefault(zone.id, zone)
+
+        if vectorized:
+            self._build_edges_vectorized()
+        else:
+            self._build_edges()
+
+        if debug:
+            for zone in self.zones[:-1]:
+                # The debug weights of a zone describe its pair with the last zone,
+                # as they did when all pairs were evaluated
+                self._calculate_edge_weight(zone, self.zones[-1], debug=True)
+
+    def _build_edges(self) -> None:
+        """Build edges between zones based on spatial relationships"""
+        # Only zones closer than MAX_EDGE_DISTANCE can get an edge: since zones are
+        # sorted by y, the scan for zone1 stops at the first zone too far below it.
+        max_distance = self.MAX_EDGE_DISTANCE
         for i, zone1 in enumerate(self.zones):
-            for zone2 in self.zones[i + 1 :]:
-                weight = self._calculate_edge_weight(zone1, zone2)
+            for j in range(i + 1, len(self.zones)):
+                zone2 = self.zones[j]
+                dx, dy = zone2.x - zone1.x, zone2.y - zone1.y
+                if dy >= max_distance:
+                    break
+                if dx * dx + dy * dy >= max_distance * max_distance:
+                    continue
+                weight = self._calculate_edge_weight(zone1, zone2, debug=False)
                 if weight > 0:
                     self.graph[zone1.id].append((zone2.id, weight))
 
-    def _calculate_edge_weight(self, zone1: Zone, zone2: Zone) -> float:
-        """Calculate edge weight between two zones based on spatial relationship"""
+    def _build_edges_vectorized(self, block_size: int = 256) -> None:
+        """
+        Same as `_build_edges`, with the weights of `block_size` zones against all the
+        following ones computed at once. Memory use grows with `block_size` times the
+        number of zones, rather than with the square of the number of zones.
+        """
+        zones = self.zones
+        ids = np.array([z.id for z in zones], dtype=object)
+        x = np.array([z.x for z in zones], dtype=float)
+        y = np.array([z.y for z in zones], dtype=float)
+        right = x + np.array([z.width for z in zones], dtype=float)
+        is_headline = np.array([z.label == "Headline" for z in zones])
+        is_text = np.array([z.label == "Text" for z in zones])
+
+        for start in range(0, len(zones), block_size):
+            stop = min(start + block_size, len(zones))
+            # Following zones at least MAX_EDGE_DISTANCE below the whole block get no edge
+            end = np.searchsorted(y, y[stop - 1] + self.MAX_EDGE_DISTANCE, side="left")
+            rows, cols = slice(start, stop), slice(start + 1, max(end, start + 1))
+
+            x_overlap = np.minimum(right[rows, None], right[None, cols]) - np.maximum(
+                x[rows, None], x[None, cols]
+            )
+            dx = x[rows, None] - x[None, cols]
+            dy = y[rows, None] - y[None, cols]
+            distance = np.sqrt(dx * dx + dy * dy)
+            weight = np.maximum(0, 1 - distance / self.MAX_EDGE_DISTANCE)
+            weight = np.where(x_overlap > 0, weight * 1.5, weight)
+            weight = np.where(
+                is_headline[rows, None] & is_text[None, cols], weight * 2.0, weight
+            )
+            # Row r is zone start + r, column c is zone start + 1 + c: only keep c >= r
+            weight = np.triu(weight)
+
+            for r, row in enumerate(weight):
+                connected = np.flatnonzero(row > 0)
+                if len(connected):
+                    self.graph[ids[start + r]].extend(
+                        zip(
+                            ids[connected + start + 1].tolist(),
+                            row[connected].tolist(),
+                        )
+                    )
+
+    def _calculate_edge_weight(
+        self, zone1: Zone, zone2: Zone, debug: bool = True
+    ) -> float:
+        """
+        Calculate edge weight between two zones based on spatial relationship.
+        With `debug`, the details of the calculation are stored in `zone1.debug_weights`.
+        """
         debug_info = {}
         weight = 1.0
 
@@ -74,11 +160,15 @@ class ArticleReconstructor:
             min(zone1.y + zone1.height, zone2.y + zone2.height) - max(zone1.y, zone2.y),
         )
 
-        # Penalize distance between zones
-        distance = np.sqrt((zone1.x - zone2.x) ** 2 + (zone1.y - zone2.y) ** 2)
-        distance_factor = max(0, 1 - distance / 100)
+        # Penalize distance between zones. Squares are computed by multiplication,
+        # like in the vectorized path: `** 2` goes through libm's pow, which may differ
+        # from it in the last bit.
+        dx, dy = zone1.x - zone2.x, zone1.y - zone2.y
+        distance = math.sqrt(dx * dx + dy * dy)
+        distance_factor = max(0, 1 - distance / self.MAX_EDGE_DISTANCE)
         weight *= distance_factor
-        debug_info["distance"] = f"{distance:.1f}px → {distance_factor:.2f}"
+        if debug:
+            debug_info["distance"] = f"{distance:.1f}px → {distance_factor:.2f}"
 
         # Bonus for vertical alignment
         if x_overlap > 0:
@@ -90,7 +180,8 @@ class ArticleReconstructor:
             weight *= 2.0
             debug_info["type_match"] = "2.0x"
 
-        zone1.debug_weights = debug_info
+        if debug:
+            zone1.debug_weights = debug_info
         return weight
 
     def reconstruct_articles(self) -> List[List[Zone]]:
@@ -109,17 +200,19 @@ class ArticleReconstructor:
             article = [headline]
             visited.add(headline.id)
 
-            # Find connected zones using graph
-            stack = [(nid, w) for nid, w in self.graph[headline.id]]
-            while stack:
-                zone_id, weight = max(stack, key=lambda x: x[1])
-                stack.remove((zone_id, weight))
+            # Find connected zones using graph, strongest connections first.
+            # Among equal weights, the connection found first wins.
+            order = count()
+            heap = [(-w, next(order), nid) for nid, w in self.graph[headline.id]]
+            heapq.heapify(heap)
+            while heap:
+                _, _, zone_id = heapq.heappop(heap)
 
                 if zone_id not in visited:
-                    zone = next(z for z in self.zones if z.id == zone_id)
-                    article.append(zone)
+                    article.append(self.zones_by_id[zone_id])
                     visited.add(zone_id)
-                    stack.extend(self.graph[zone_id])
+                    for nid, w in self.graph[zone_id]:
+                        heapq.heappush(heap, (-w, next(order), nid))
 
             articles.append(article)
 
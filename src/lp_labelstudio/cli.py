@@ -2,6 +2,7 @@ import click
 import os
 import logging
 import json
+from functools import partial
 import numpy as np
 from typing import Any, Dict, List, Union, Tuple, Optional
 from rich import print as rprint
@@ -12,12 +13,25 @@ from PIL import Image
 from lp_labelstudio.generate_manifest import generate_labelstudio_manifest
 from lp_labelstudio.escriptorium_cli import escriptorium as escriptorium_group
 from lp_labelstudio.labelstudio_api import labelstudio_api
-from lp_labelstudio.collect_coco import collect_coco
-from lp_labelstudio.generate_thumbnails import generate_thumbnails
+from lp_labelstudio.collect_coco import (
+    DEFAULT_OUTPUT as DEFAULT_COCO_OUTPUT,
+    collect_coco,
+)
+from lp_labelstudio.generate_thumbnails import (
+    DEFAULT_WORKERS as DEFAULT_THUMBNAIL_WORKERS,
+    OVERLAY_MODES,
+    generate_thumbnails,
+)
+from lp_labelstudio.oni_batch import build_oni_batch
+from lp_labelstudio.derivatives import generate_derivatives
+from lp_labelstudio.annotation_index import annotation_index, open_annotation_index
+from lp_labelstudio.reconstruct_articles import reconstruct_articles
+from lp_labelstudio.utils import call_task
 from lp_labelstudio.constants import (
     JPEG_EXTENSION,
     NEWSPAPER_MODEL_PATH,
     NEWSPAPER_LABEL_MAP,
+    NEWSPAPER_TEXT_LABELS,
 )
 
 logging.basicConfig(level=logging.INFO)
@@ -55,7 +69,12 @@ def cli_generate_index_txt(
     "image_path_string", type=click.Path(exists=True, file_okay=True, dir_okay=False)
 )
 @click.option("--redo", is_flag=True, help="Reprocess and replace existing annotations")
-def process_image(image_path_string: str, redo: bool) -> None:
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Run OCR on every box, ignoring and not updating the persistent OCR cache",
+)
+def process_image(image_path_string: str, redo: bool, no_cache: bool = False) -> None:
     """Process a single JPEG image. Perform OCR for the areas found in annotations and generate ALTO XML"""
     image_path = Path(image_path_string)
     results, img_width, img_height = get_page_annotations(image_path)
@@ -80,52 +99,52 @@ def process_image(image_path_string: str, redo: bool) -> None:
     rprint(table)
 
     # Initialize OCR and process image
-    from lp_labelstudio.alto_generator import create_alto_xml
+    from lp_labelstudio.alto_generator import write_alto_xml
     from lp_labelstudio.ocr import (
-        ocr_box,
+        ocr_boxes,
+        open_page,
     )  # Heavy import: we like it to be inside this function
 
-    # Open the image
-    with Image.open(image_path) as img:
-        img_width, img_height = img.size
+    # Open the image, decoded at the resolution used for OCR.
+    # Boxes and ALTO coordinates stay in original image coordinates.
+    with open_page(image_path) as img:
+        img_width, img_height = img.info["original_size"]
         console = Console()
         all_ocr_results = []
 
-        # Process headlines
-        console.print("\n[bold blue]Processing Headlines:[/]")
+        # Collect headline boxes in pixel coordinates
+        boxes = []
         for i in range(0, len(results), 2):
             bbox = results[i]
             label_info = results[i + 1]
 
             if label_info["value"]["labels"][0] == "Headline":
-                # Calculate pixel coordinates
                 x = int(bbox["value"]["x"] * img_width / 100)
                 y = int(bbox["value"]["y"] * img_height / 100)
                 width = int(bbox["value"]["width"] * img_width / 100)
                 height = int(bbox["value"]["height"] * img_height / 100)
+                boxes.append((x, y, width, height))
 
-                # Process the box
-                box_results = ocr_box(img, (x, y, width, height))
-
-                if box_results:
-                    all_ocr_results.extend(box_results)
-                    for abs_bbox, (text, confidence) in box_results:
-                        console.print(
-                            f"[yellow]Position:[/] ({abs_bbox[0]:.1f}, {abs_bbox[1]:.1f})"
-                        )
-                        console.print(
-                            f"[green]Word:[/] {text} [yellow]Confidence:[/] {confidence:.2f}\n"
-                        )
-                else:
-                    console.print(f"[red]No text detected[/] at position ({x}, {y})\n")
-
-        # Generate ALTO XML
-        alto_xml = create_alto_xml(img_width, img_height, all_ocr_results)
+        # Process headlines: single line ones are recognized in one batch
+        console.print("\n[bold blue]Processing Headlines:[/]")
+        all_box_results = ocr_boxes(img, boxes, use_cache=not no_cache)
+        for (x, y, _, _), box_results in zip(boxes, all_box_results):
+            if box_results:
+                all_ocr_results.extend(box_results)
+                for abs_bbox, (text, confidence) in box_results:
+                    console.print(
+                        f"[yellow]Position:[/] ({abs_bbox[0]:.1f}, {abs_bbox[1]:.1f})"
+                    )
+                    console.print(
+                        f"[green]Word:[/] {text} [yellow]Confidence:[/] {confidence:.2f}\n"
+                    )
+            else:
+                console.print(f"[red]No text detected[/] at position ({x}, {y})\n")
 
-        # Save ALTO XML
+        # Generate ALTO XML, writing it straight to the file
         alto_path = os.path.splitext(image_path)[0] + ".alto.xml"
         with open(alto_path, "w", encoding="utf-8") as f:
-            f.write(alto_xml)
+            write_alto_xml(f, img_width, img_height, all_ocr_results)
         console.print(f"[blue]ALTO XML saved to:[/] {alto_path}")
 
 
@@ -134,11 +153,52 @@ def process_image(image_path_string: str, redo: bool) -> None:
     "directory", type=click.Path(exists=True, file_okay=False, dir_okay=True)
 )
 @click.option("--redo", is_flag=True, help="Reprocess and replace existing annotations")
-def process_newspaper(directory: str, redo: bool) -> None:
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of pages run through the layout detection model at once. "
+    "Pages are decoded ahead of time in a background thread",
+)
+@click.option(
+    "--ocr-workers",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Run OCR in this many worker threads, concurrently with layout detection. "
+    "0 runs OCR after the detection of each page",
+)
+@click.option(
+    "--ocr-label",
+    "ocr_labels",
+    type=click.Choice(list(NEWSPAPER_LABEL_MAP.values())),
+    multiple=True,
+    default=NEWSPAPER_TEXT_LABELS,
+    show_default=True,
+    help="Run OCR only on blocks with this label. Can be repeated",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Run OCR on every block, ignoring and not updating the persistent OCR cache",
+)
+def process_newspaper(
+    directory: str,
+    redo: bool,
+    batch_size: int,
+    ocr_workers: int,
+    ocr_labels: Tuple[str, ...],
+    no_cache: bool = False,
+) -> None:
     """Process newspaper pages (JPEG images) recursively in a directory using layoutparser and convert to Label Studio format."""
     # We import here for performance reasons. Don't move up!
-    from lp_labelstudio.image_processing import process_single_image, get_image_size
-    from lp_labelstudio.image_processing import convert_to_label_studio_format
+    from lp_labelstudio.image_processing import (
+        PipelineStats,
+        process_single_image,
+        process_images_batched,
+        process_images_pipelined,
+    )
     import layoutparser as lp  # type: ignore
 
     logger.info(f"Processing newspaper pages recursively in directory: {directory}")
@@ -146,6 +206,7 @@ def process_newspaper(directory: str, redo: bool) -> None:
         NEWSPAPER_MODEL_PATH, label_map=NEWSPAPER_LABEL_MAP
     )
 
+    image_paths = []
     for root, _, files in os.walk(directory):
         for filename in files:
             if filename.lower().endswith(JPEG_EXTENSION):
@@ -160,42 +221,103 @@ def process_newspaper(directory: str, redo: bool) -> None:
                         )
                     )
                     continue
+                image_paths.append(image_path)
+
+    stats = None
+    if ocr_workers:
+        stats = PipelineStats({"decode": 1, "detection": 1, "ocr": ocr_workers})
+        results = process_images_pipelined(
+            image_paths,
+            model,
+            batch_size,
+            ocr_workers,
+            stats,
+            ocr_labels,
+            use_cache=not no_cache,
+        )
+    elif batch_size > 1:
+        results = process_images_batched(
+            image_paths, model, batch_size, ocr_labels, use_cache=not no_cache
+        )
+    else:
+        process = partial(
+            process_single_image,
+            model=model,
+            ocr_labels=ocr_labels,
+            use_cache=not no_cache,
+        )
+        results = (
+            (image_path, *call_task(process, image_path)) for image_path in image_paths
+        )
+
+    click.echo(click.style(f"Processing {len(image_paths)} pages...", fg="blue"))
+    failures: List[str] = []
+    for image_path, error, layout in results:
+        if error:
+            logger.error(f"Failed to process {image_path}: {error}")
+            failures.append(f"{image_path}: {error}")
+            continue
+        save_annotations(image_path, layout)
+
+    if stats:
+        click.echo(click.style(f"Stage utilisation: {stats.report()}", fg="cyan"))
+    if failures:
+        raise click.ClickException(
+            f"{len(failures)} pages could not be processed:\n" + "\n".join(failures)
+        )
+    click.echo(click.style("Processing complete.", fg="green"))
 
-                click.echo(click.style(f"Processing {image_path}...", fg="blue"))
 
-                layout = process_single_image(image_path, model)
-                img_width, img_height = get_image_size(image_path)
-                label_studio_data = convert_to_label_studio_format(
-                    layout, img_width, img_height, filename
-                )
+def save_annotations(image_path: str, layout: List[Dict[str, Any]]) -> None:
+    """Save the annotations of a page next to it as a Label Studio `_annotations.json` file"""
+    from lp_labelstudio.image_processing import (
+        convert_to_label_studio_format,
+        get_image_size,
+    )
 
-                with open(output_path, "w") as f:
-                    json.dump(label_studio_data, f, indent=2)
-                logger.info(f"Annotations saved to {output_path}")
+    output_path = os.path.splitext(image_path)[0] + "_annotations.json"
+    img_width, img_height = get_image_size(image_path)
+    label_studio_data = convert_to_label_studio_format(
+        layout, img_width, img_height, os.path.basename(image_path)
+    )
 
-                summary = generate_summary(image_path, layout, output_path)
-                click.echo(summary)
+    with open(output_path, "w") as f:
+        json.dump(label_studio_data, f, indent=2)
+    logger.info(f"Annotations saved to {output_path}")
 
-    click.echo(click.style("Processing complete.", fg="green"))
+    summary = generate_summary(image_path, layout, output_path)
+    click.echo(summary)
 
 
 cli.add_command(escriptorium_group)
 cli.add_command(labelstudio_api)
+cli.add_command(build_oni_batch)
+cli.add_command(reconstruct_articles)
+cli.add_command(generate_derivatives)
+cli.add_command(annotation_index)
 
 
 @cli.command()
 @click.argument(
     "json_files", nargs=-1, type=click.Path(exists=True, file_okay=True, dir_okay=False)
 )
-def collect_coco(json_files):
+@click.option(
+    "--output",
+    type=click.Path(file_okay=True, dir_okay=False),
+    default=DEFAULT_COCO_OUTPUT,
+    show_default=True,
+    help="Output file, gzip compressed if its name ends with .gz",
+)
+@click.option("--gzip", "compress", is_flag=True, help="Gzip compress the output")
+def collect_coco(json_files, output, compress):
     """Collect COCO data from multiple JSON files into a single output file."""
     from lp_labelstudio.collect_coco import collect_coco as cc
 
     if not json_files:
         click.echo("No JSON files found. Please check your input.")
         return
-    cc(json_files)
-    click.echo(f"COCO data collected and saved to /tmp/coco-out.json")
+    cc(json_files, output, compress)
+    click.echo(f"COCO data collected and saved to {output}")
 
 
 @cli.command(name="generate-thumbnails")
@@ -203,16 +325,59 @@ def collect_coco(json_files):
     "source_folder", type=click.Path(exists=True, file_okay=False, dir_okay=True)
 )
 @click.argument("destination_folder", type=click.Path(file_okay=False, dir_okay=True))
-def generate_thumbnails_command(source_folder: str, destination_folder: str):
-    """Generate thumbnails from images in the source folder and save them in the destination folder."""
+@click.option("--force", is_flag=True, help="Regenerate thumbnails that are up to date")
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    help="Only report the thumbnails that would be generated or removed",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=DEFAULT_THUMBNAIL_WORKERS,
+    show_default=True,
+    help="Number of processes generating thumbnails",
+)
+@click.option(
+    "--chunksize",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of images sent to a worker process at once",
+)
+@click.option(
+    "--overlays",
+    type=click.Choice(OVERLAY_MODES),
+    default="raster",
+    show_default=True,
+    help="Draw the annotations on the thumbnails (raster), or write them to an SVG "
+    "file next to each thumbnail, shown on top of it by the gallery (sidecar)",
+)
+def generate_thumbnails_command(
+    source_folder: str,
+    destination_folder: str,
+    force: bool,
+    dry_run: bool,
+    workers: int,
+    chunksize: int,
+    overlays: str,
+):
+    """
+    Generate thumbnails from images in the source folder and save them in the destination folder.
+    Only thumbnails whose image or annotations changed are generated again.
+    """
     click.echo(f"Generating thumbnails from {source_folder} to {destination_folder}")
-    generate_thumbnails(source_folder, destination_folder)
+    generate_thumbnails(
+        source_folder, destination_folder, force, dry_run, workers, chunksize, overlays
+    )
     click.echo("Thumbnail generation complete!")
 
 
 def get_page_annotations(image_path: Path) -> Tuple[List[Dict], int, int]:
     """
     Get annotations for a page and its dimensions.
+    They are read from the annotation index when it exists and the page is in it,
+    from the manifest of the issue otherwise.
 
     Args:
         image_path: Path to the image file
@@ -223,6 +388,15 @@ def get_page_annotations(image_path: Path) -> Tuple[List[Dict], int, int]:
         - Image width
         - Image height
     """
+    index = open_annotation_index()
+    if index is not None:
+        try:
+            indexed = index.page_annotation(image_path)
+        finally:
+            index.close()
+        if indexed is not None:
+            return indexed
+
     manifest_file = image_path.parent / "manifest.json"
     assert manifest_file.exists()
 
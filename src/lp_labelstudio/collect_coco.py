@@ -1,31 +1,106 @@
+import gzip
 import json
-from typing import List, Dict, Any
+import shutil
+import tempfile
+from typing import List, Dict, Any, Iterator, TextIO, Tuple
 from datetime import datetime
 from lp_labelstudio.constants import NEWSPAPER_CATEGORIES
 
+DEFAULT_OUTPUT = "/tmp/coco-out.json"
 
-def collect_coco(json_files: List[str]) -> None:
+
+def collect_coco(
+    json_files: List[str], output: str = DEFAULT_OUTPUT, compress: bool = False
+) -> None:
     """
     Collect COCO data from multiple JSON files and save to a single output file.
+    The output is compact JSON, gzip compressed with `compress` or when `output`
+    ends with `.gz`.
     """
+    if compress or output.endswith(".gz"):
+        out = gzip.open(output, "wt", encoding="utf-8")
+    else:
+        out = open(output, "w", encoding="utf-8")
+    with out:
+        summary = write_coco(json_files, out)
+
+    print(f"COCO data collected from {len(json_files)} files and saved to {output}")
+    print(f"Total images: {summary['images']}")
+    print(f"Total annotations: {summary['annotations']}")
+    print(f"Total categories: {len(summary['categories'])}")
+    print("Categories:")
+    for category in summary["categories"]:
+        print(f"  - {category['name']} (id: {category['id']})")
+
+
+def write_coco(json_files: List[str], out: TextIO) -> Dict[str, Any]:
+    """
+    Write COCO data collected from `json_files` to `out` as compact JSON, one image
+    at a time: annotations are spooled to a temporary file while the images are
+    written, so memory use does not grow with the number of pages.
+    Return the number of images and annotations, and the categories.
+    """
+    categories = [dict(category) for category in NEWSPAPER_CATEGORIES]
+    images = annotations = 0
+    out.write('{"info":' + json.dumps(coco_info(), separators=(",", ":")))
+    out.write(',"images":[')
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as spool:
+        for image, image_annotations in coco_items(json_files, categories):
+            out.write(
+                ("," if images else "") + json.dumps(image, separators=(",", ":"))
+            )
+            images += 1
+            for annotation in image_annotations:
+                spool.write(
+                    ("," if annotations else "")
+                    + json.dumps(annotation, separators=(",", ":"))
+                )
+                annotations += 1
+        out.write('],"annotations":[')
+        spool.seek(0)
+        shutil.copyfileobj(spool, out)
+    out.write('],"categories":' + json.dumps(categories, separators=(",", ":")) + "}")
+    return {"images": images, "annotations": annotations, "categories": categories}
+
+
+def collect_coco_dict(json_files: List[str]) -> Dict[str, Any]:
+    """The same data as `write_coco`, collected in memory"""
+    categories = [dict(category) for category in NEWSPAPER_CATEGORIES]
     coco_data: Dict[str, Any] = {
         "images": [],
-        "categories": NEWSPAPER_CATEGORIES,
+        "categories": categories,
         "annotations": [],
-        "info": {
-            "year": datetime.now().year,
-            "version": "1.0",
-            "description": "Collected COCO data",
-            "contributor": "Label Studio",
-            "url": "",
-            "date_created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        },
+        "info": coco_info(),
     }
+    for image, image_annotations in coco_items(json_files, categories):
+        coco_data["images"].append(image)
+        coco_data["annotations"].extend(image_annotations)
+    return coco_data
+
 
+def coco_info() -> Dict[str, Any]:
+    return {
+        "year": datetime.now().year,
+        "version": "1.0",
+        "description": "Collected COCO data",
+        "contributor": "Label Studio",
+        "url": "",
+        "date_created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def coco_items(
+    json_files: List[str], categories: List[Dict[str, Any]]
+) -> Iterator[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+    """
+    Yield the COCO image and annotations of every annotated page of the manifests in
+    `json_files`, loading one manifest at a time. Labels missing from `categories`
+    are appended to it.
+    """
     image_id = 0
     annotation_id = 0
-    category_map = {cat["name"]: cat["id"] for cat in NEWSPAPER_CATEGORIES}
-    next_category_id = max(cat["id"] for cat in NEWSPAPER_CATEGORIES) + 1
+    category_map = {cat["name"]: cat["id"] for cat in categories}
+    next_category_id = max(cat["id"] for cat in categories) + 1
 
     for file_path in json_files:
         with open(file_path, "r") as f:
@@ -37,36 +112,33 @@ def collect_coco(json_files: List[str]) -> None:
             image_annotations = []
 
             # Process annotations
-            if "annotations" in item:
-                for annotation in item["annotations"]:
-                    for result in annotation["result"]:
-                        if "value" in result and "labels" in result["value"]:
-                            label = result["value"]["labels"][0]
-                            if label not in category_map:
-                                category_map[label] = next_category_id
-                                coco_data["categories"].append(
-                                    {"id": next_category_id, "name": label}
-                                )
-                                next_category_id += 1
-
-                            coco_annotation = {
-                                "id": annotation_id,
-                                "image_id": image_id,
-                                "category_id": category_map[label],
-                                "segmentation": [],
-                                "bbox": [
-                                    result["value"]["x"],
-                                    result["value"]["y"],
-                                    result["value"]["width"],
-                                    result["value"]["height"],
-                                ],
-                                "ignore": 0,
-                                "iscrowd": 0,
-                                "area": result["value"]["width"]
-                                * result["value"]["height"],
-                            }
-                            image_annotations.append(coco_annotation)
-                            annotation_id += 1
+            for annotation in item["annotations"]:
+                for result in annotation["result"]:
+                    if "value" in result and "labels" in result["value"]:
+                        label = result["value"]["labels"][0]
+                        if label not in category_map:
+                            category_map[label] = next_category_id
+                            categories.append({"id": next_category_id, "name": label})
+                            next_category_id += 1
+
+                        coco_annotation = {
+                            "id": annotation_id,
+                            "image_id": image_id,
+                            "category_id": category_map[label],
+                            "segmentation": [],
+                            "bbox": [
+                                result["value"]["x"],
+                                result["value"]["y"],
+                                result["value"]["width"],
+                                result["value"]["height"],
+                            ],
+                            "ignore": 0,
+                            "iscrowd": 0,
+                            "area": result["value"]["width"]
+                            * result["value"]["height"],
+                        }
+                        image_annotations.append(coco_annotation)
+                        annotation_id += 1
 
             # Only add the image and its annotations if there are annotations
             if image_annotations:
@@ -76,20 +148,5 @@ def collect_coco(json_files: List[str]) -> None:
                     "height": item["annotations"][0]["result"][0]["original_height"],
                     "file_name": item["data"]["ocr"],
                 }
-                coco_data["images"].append(image)
-                coco_data["annotations"].extend(image_annotations)
+                yield image, image_annotations
                 image_id += 1
-
-    # Save the collected COCO data
-    with open("/tmp/coco-out.json", "w") as f:
-        json.dump(coco_data, f, indent=2)
-
-    print(
-        f"COCO data collected from {len(json_files)} files and saved to /tmp/coco-out.json"
-    )
-    print(f"Total images: {len(coco_data['images'])}")
-    print(f"Total annotations: {len(coco_data['annotations'])}")
-    print(f"Total categories: {len(coco_data['categories'])}")
-    print("Categories:")
-    for category in coco_data["categories"]:
-        print(f"  - {category['name']} (id: {category['id']})")
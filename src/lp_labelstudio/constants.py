@@ -4,6 +4,15 @@ from pathlib import Path
 # File extensions
 JPEG_EXTENSION = ".jpeg"
 
+# Tiled, multi-resolution JP2s let the IIIF server (RAIS) decode only the tiles it serves
+JP2_OPTIONS = dict(
+    irreversible=True,
+    quality_mode="rates",
+    quality_layers=[10],
+    num_resolutions=6,
+    tile_size=(1024, 1024),
+)
+
 # Model paths
 NEWSPAPER_MODEL_PATH = "lp://NewspaperNavigator/faster_rcnn_R_50_FPN_3x/config"
 
@@ -27,5 +36,17 @@ NEWSPAPER_CATEGORIES = [
 # Create NEWSPAPER_LABEL_MAP from NEWSPAPER_CATEGORIES
 NEWSPAPER_LABEL_MAP = {cat["id"]: cat["name"] for cat in NEWSPAPER_CATEGORIES}
 
+# Labels of blocks that carry text worth transcribing. Photographs, illustrations,
+# maps, cartoons and advertisements are large and OCR only produces garbage for them.
+NEWSPAPER_TEXT_LABELS = (
+    "Headline",
+    "SubHeadline",
+    "Text",
+    "Author",
+    "PageTitle",
+    "Date",
+    "PageNumber",
+)
+
 # UI XML
 UI_CONFIG_XML = (Path(__file__).parent / "ui.xml").read_text()
@@ -0,0 +1,219 @@
+"""
+Generate page derivatives (resized copies in other formats) from the master images.
+
+Every derivative is described as `name=width:format`, e.g. `preview=1000:jpeg`, with a
+width of `full` to keep the size of the master. The derivatives of a page are written
+to `<output_dir>/<name>/<path of the page>`, with the extension of their format:
+
+    /tmp/derivatives/preview/1994/lamasca-1994-01-12/page_01.jpeg
+    /tmp/derivatives/jp2/1994/lamasca-1994-01-12/page_01.jp2
+
+Each master is decoded once for all its derivatives, at the smallest scale still larger
+than the largest of them, and derivatives newer than their master are not generated again.
+"""
+
+import click
+import logging
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Tuple
+from PIL import Image
+from lp_labelstudio.constants import JP2_OPTIONS, JPEG_EXTENSION
+from lp_labelstudio.utils import atomic_output, is_up_to_date, run_tasks
+
+logger = logging.getLogger(__name__)
+
+# Pillow format, file extension and save options of every derivative format
+FORMATS = {
+    "jpeg": ("JPEG", ".jpeg", dict(quality=85, optimize=True)),
+    "webp": ("WEBP", ".webp", dict(quality=80, method=4)),
+    "jp2": ("JPEG2000", ".jp2", JP2_OPTIONS),
+    "tiff": ("TIFF", ".tif", dict(compression="tiff_lzw")),
+}
+
+DEFAULT_DERIVATIVES = (
+    "thumb=280:jpeg",
+    "preview=1000:jpeg",
+    "webp=1415:webp",
+    "jp2=full:jp2",
+)
+
+
+@dataclass(frozen=True)
+class Derivative:
+    name: str
+    width: Optional[int]  # None keeps the size of the master
+    format: str
+
+    @classmethod
+    def parse(cls, spec: str) -> "Derivative":
+        """
+        >>> Derivative.parse("preview=1000:jpeg")
+        Derivative(name='preview', width=1000, format='jpeg')
+        >>> Derivative.parse("jp2=full:jp2")
+        Derivative(name='jp2', width=None, format='jp2')
+        """
+        name, _, rest = spec.partition("=")
+        width, _, format = rest.partition(":")
+        if not name or format not in FORMATS:
+            raise ValueError(
+                f"Invalid derivative {spec!r}: expected name=width:format, "
+                f"with format one of {', '.join(FORMATS)}"
+            )
+        if width == "full":
+            return cls(name, None, format)
+        if not width.isdigit() or int(width) <= 0:
+            raise ValueError(
+                f"Invalid derivative {spec!r}: the width must be a positive number "
+                "of pixels or 'full'"
+            )
+        return cls(name, int(width), format)
+
+    def path(self, output_dir: Path, relative_path: Path) -> Path:
+        return (output_dir / self.name / relative_path).with_suffix(
+            FORMATS[self.format][1]
+        )
+
+
+@dataclass
+class PageTask:
+    image_path: Path
+    outputs: List[Tuple[Derivative, Path]]
+    force: bool
+
+
+class DerivativeType(click.ParamType):
+    name = "derivative"
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, Derivative):
+            return value
+        try:
+            return Derivative.parse(value)
+        except ValueError as e:
+            self.fail(str(e), param, ctx)
+
+
+@click.command(name="generate-derivatives")
+@click.argument(
+    "source_folder",
+    type=click.Path(exists=True, file_okay=False, dir_okay=True, path_type=Path),
+)
+@click.argument(
+    "output_dir", type=click.Path(file_okay=False, dir_okay=True, path_type=Path)
+)
+@click.option(
+    "--derivative",
+    "derivatives",
+    type=DerivativeType(),
+    multiple=True,
+    default=DEFAULT_DERIVATIVES,
+    show_default=True,
+    help="Derivative to generate, as name=width:format, with width 'full' to keep the "
+    f"size of the master and format one of {', '.join(FORMATS)}. Can be repeated",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=os.cpu_count(),
+    show_default=True,
+    help="Number of processes generating derivatives",
+)
+@click.option(
+    "--force", is_flag=True, help="Regenerate derivatives that are up to date"
+)
+def generate_derivatives(
+    source_folder: Path,
+    output_dir: Path,
+    derivatives: Tuple[Derivative, ...],
+    workers: int,
+    force: bool,
+):
+    """
+    Generate resized copies of the page images in several sizes and formats,
+    decoding every page once.
+
+    SOURCE_FOLDER: Folder searched recursively for page_XX.jpeg images
+    """
+    if len({derivative.name for derivative in derivatives}) != len(derivatives):
+        raise click.BadParameter(
+            "Derivative names must be unique", param_hint="--derivative"
+        )
+    tasks = []
+    for image_path in sorted(source_folder.rglob(f"page_*{JPEG_EXTENSION}")):
+        relative_path = image_path.relative_to(source_folder)
+        outputs = [
+            (derivative, derivative.path(output_dir, relative_path))
+            for derivative in derivatives
+        ]
+        tasks.append(PageTask(image_path, outputs, force))
+
+    click.echo(
+        f"Generating {len(derivatives)} derivatives of {len(tasks)} pages in {output_dir}"
+    )
+    failures: List[str] = []
+    written = 0
+    with click.progressbar(length=len(tasks), label="Generating derivatives") as bar:
+        for task, error, count in run_tasks(build_page, tasks, workers):
+            if error:
+                logger.error(f"Failed to process {task.image_path}: {error}")
+                failures.append(f"{task.image_path}: {error}")
+            else:
+                written += count
+            bar.update(1)
+
+    click.echo(
+        f"Wrote {written} derivatives, "
+        f"{len(tasks) * len(derivatives) - written} were up to date or failed"
+    )
+    if failures:
+        raise click.ClickException(
+            f"{len(failures)} pages could not be processed:\n" + "\n".join(failures)
+        )
+
+
+def build_page(task: PageTask) -> int:
+    return build_derivatives(task.image_path, task.outputs, task.force)
+
+
+def build_derivatives(
+    image_path: Path, outputs: List[Tuple[Derivative, Path]], force: bool = False
+) -> int:
+    """
+    Write the derivatives of a page that are not up to date, from a single decode of
+    the master. Return the number of derivatives written.
+    """
+    outdated = [
+        (derivative, path)
+        for derivative, path in outputs
+        if force or not is_up_to_date(path, image_path)
+    ]
+    if not outdated:
+        return 0
+    with Image.open(image_path) as img:
+        master_width, master_height = img.size
+        widths = [derivative.width for derivative, _ in outdated]
+        if None not in widths:
+            # JPEG masters are decoded directly at a reduced scale (DCT scaling)
+            largest = max(widths)
+            img.draft(
+                img.mode, (largest, round(largest * master_height / master_width))
+            )
+        img.load()
+        for derivative, path in outdated:
+            if derivative.width is None or derivative.width >= img.width:
+                resized = img
+            else:
+                resized = img.resize(
+                    (
+                        derivative.width,
+                        round(derivative.width * master_height / master_width),
+                    ),
+                    Image.LANCZOS,
+                )
+            pil_format, _, options = FORMATS[derivative.format]
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with atomic_output(path) as tmp_path:
+                resized.save(tmp_path, pil_format, **options)
+    return len(outdated)
@@ -1,9 +1,19 @@
 import click
+import hashlib
 import os
 import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from typing import List, Dict, Any
 from pathlib import Path
 from collections import defaultdict
+from lp_labelstudio.utils import write_atomically
+
+# Digest of the inputs of the manifest of an issue, next to it
+MANIFEST_STATE_FILENAME = ".manifest-state.json"
+
+MANIFEST_VERSION = 1
 
 
 def get_image_url(image_path: str) -> str:
@@ -39,72 +49,169 @@ def get_date(directory: str) -> str:
     return directory.split("/")[-1].replace("lamasca-", "")
 
 
+def is_issue_directory(directory: str) -> bool:
+    """Tell whether a directory is named after the date of its issue.
+
+    Example:
+    >>> is_issue_directory("/path/to/lamasca-2023-05-15")
+    True
+    >>> is_issue_directory("/path/to/scans")
+    False
+    """
+    name = directory.rstrip("/").split("/")[-1]
+    return re.fullmatch(r"lamasca-\d{4}-\d{2}-\d{2}", name) is not None
+
+
+@dataclass
+class IssueManifest:
+    directory: str
+    pages: int
+    annotations: int
+    written: bool
+
+
 @click.argument(
     "directories",
     nargs=-1,
     type=click.Path(exists=True, file_okay=False, dir_okay=True),
 )
-def generate_labelstudio_manifest(directories: List[str]) -> List[Dict[str, Any]]:
-    """Generate Label Studio JSON manifest for the given directories."""
-    total_issues: int = 0
-    total_pages: int = 0
-    total_annotations: int = 0
-
-    all_manifests = []
-
-    for directory in directories:
-        manifest: List[Dict[str, Any]] = []
-        if directory.endswith("/"):
-            directory = directory[:-1]
-
-        publication_name: str = os.path.basename(directory)
-        jpeg_files: List[str] = [
-            f for f in os.listdir(directory) if f.lower().endswith(".jpeg")
-        ]
-
-        for jpeg_file in jpeg_files:
-            image_path: str = os.path.join(directory, jpeg_file)
-            image_url: str = get_image_url(image_path)
-            page_number: int = get_page_number(jpeg_file)
-            date: str = get_date(directory)
-            task_item: Dict[str, Any] = {
-                "id": get_task_id(directory, jpeg_file),
-                "data": {
-                    "ocr": image_url,
-                    "pageNumber": page_number,
-                    "date": date,
-                },
-            }
-            manifest.append(task_item)
-        num_annotations = 0
-        annotations_path = Path(directory) / "annotations"
-        if annotations_path.exists():
-            num_annotations = augment_manifest_with_annotations(
-                manifest, directory, annotations_path
-            )
-        total_issues += 1
-        total_pages += len(manifest)
-        total_annotations += num_annotations
-
-        all_manifests.extend(manifest)
-
-        output = Path(directory) / "manifest.json"
-        with output.open("w") as f:
-            json.dump(manifest, f, indent=2)
-        click.echo(
-            click.style(
-                f"Manifest file generated with {num_annotations} annotations: {output}",
-                fg="green",
-            )
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="Number of issue directories scanned concurrently. "
+    "Scanning is mostly waiting for the (network) file system",
+)
+@click.option("--force", is_flag=True, help="Rewrite manifests that are up to date")
+def generate_labelstudio_manifest(
+    directories: List[str], workers: int = 8, force: bool = False
+) -> List[IssueManifest]:
+    """
+    Generate Label Studio JSON manifest for the given directories.
+    Manifests whose pages and annotation files did not change are not rewritten.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        issues = list(
+            executor.map(lambda d: update_issue_manifest(d, force), directories)
         )
 
-    click.echo(click.style(f"Total issues included: {total_issues}", fg="green"))
-    click.echo(click.style(f"Total pages included: {total_pages}", fg="green"))
+    for issue in issues:
+        if issue.written:
+            click.echo(
+                click.style(
+                    f"Manifest file generated with {issue.annotations} annotations: "
+                    f"{Path(issue.directory) / 'manifest.json'}",
+                    fg="green",
+                )
+            )
+    written = sum(issue.written for issue in issues)
     click.echo(
-        click.style(f"Total annotations included: {total_annotations}", fg="green")
+        click.style(
+            f"Manifests written: {written}, up to date: {len(issues) - written}",
+            fg="green",
+        )
+    )
+    click.echo(click.style(f"Total issues included: {len(issues)}", fg="green"))
+    click.echo(
+        click.style(
+            f"Total pages included: {sum(issue.pages for issue in issues)}", fg="green"
+        )
     )
+    click.echo(
+        click.style(
+            f"Total annotations included: {sum(issue.annotations for issue in issues)}",
+            fg="green",
+        )
+    )
+
+    return issues
+
+
+def update_issue_manifest(directory: str, force: bool = False) -> IssueManifest:
+    """
+    Write the manifest of an issue directory, unless the digest of its inputs (page
+    file names and annotation file names, sizes and mtimes) matches the stored one.
+    """
+    if directory.endswith("/"):
+        directory = directory[:-1]
+
+    with os.scandir(directory) as entries:
+        jpeg_files: List[str] = sorted(
+            entry.name for entry in entries if entry.name.lower().endswith(".jpeg")
+        )
+    annotation_files = list_annotation_files(Path(directory) / "annotations")
+    digest = inputs_digest(directory, jpeg_files, annotation_files)
+
+    output = Path(directory) / "manifest.json"
+    state_path = Path(directory) / MANIFEST_STATE_FILENAME
+    if not force and output.exists() and state_path.exists():
+        try:
+            state = json.loads(state_path.read_text())
+        except ValueError:
+            state = {}
+        if state.get("digest") == digest:
+            return IssueManifest(
+                directory, state["pages"], state["annotations"], written=False
+            )
 
-    return all_manifests
+    manifest: List[Dict[str, Any]] = []
+    date: str = get_date(directory)
+    for jpeg_file in jpeg_files:
+        image_path: str = os.path.join(directory, jpeg_file)
+        task_item: Dict[str, Any] = {
+            "id": get_task_id(directory, jpeg_file),
+            "data": {
+                "ocr": get_image_url(image_path),
+                "pageNumber": get_page_number(jpeg_file),
+                "date": date,
+            },
+        }
+        manifest.append(task_item)
+    num_annotations = add_annotations(manifest, annotation_files)
+
+    write_atomically(output, json.dumps(manifest, indent=2))
+    write_atomically(
+        state_path,
+        json.dumps(
+            {"digest": digest, "pages": len(manifest), "annotations": num_annotations}
+        ),
+    )
+    return IssueManifest(directory, len(manifest), num_annotations, written=True)
+
+
+def list_annotation_files(annotations_path: Path) -> List[os.DirEntry]:
+    """The annotation files of every contributor, sorted by contributor and name"""
+    if not annotations_path.exists():
+        return []
+    files = []
+    with os.scandir(annotations_path) as contributors:
+        for contributor_dir in contributors:
+            if not contributor_dir.is_dir():
+                continue
+            with os.scandir(contributor_dir.path) as entries:
+                files.extend(entry for entry in entries if entry.is_file())
+    return sorted(files, key=lambda entry: entry.path)
+
+
+def inputs_digest(
+    directory: str, jpeg_files: List[str], annotation_files: List[os.DirEntry]
+) -> str:
+    """
+    Digest of everything the manifest of an issue depends on. The image URLs are
+    built from `directory` as it is given, so running the command on the same issue
+    through another path writes the manifest again.
+    """
+    inputs = {
+        "version": MANIFEST_VERSION,
+        "url_prefix": get_image_url(os.path.join(directory, "")),
+        "pages": jpeg_files,
+        "annotations": [
+            [entry.path, entry.stat().st_size, entry.stat().st_mtime_ns]
+            for entry in annotation_files
+        ],
+    }
+    return hashlib.sha256(json.dumps(inputs).encode()).hexdigest()
 
 
 def read_xml_file(file_path: str) -> str:
@@ -112,25 +219,23 @@ def read_xml_file(file_path: str) -> str:
         return file.read()
 
 
-def augment_manifest_with_annotations(manifest, directory, annotations_path):
-    """Finds JSON files for annotations and amends the passed `manifest` dict.
+def add_annotations(manifest, annotation_files):
+    """Amends the passed `manifest` dict with the annotations in `annotation_files`.
     Returns the number of pages that received annotations
     """
-    if not annotations_path.exists():
-        return 0
     manifest_by_page = {}
     for page in manifest:
         manifest_by_page[page["data"]["pageNumber"]] = page
     total_annotated = 0
-    for contributor_dir in annotations_path.iterdir():
-        for file in contributor_dir.iterdir():
-            annotation = json.loads(file.read_text())
-            annotation.pop("completed_by", None)
-            page_number = annotation["task"]["data"]["pageNumber"]
-            if not manifest_by_page[page_number].get("annotations"):
-                manifest_by_page[page_number]["annotations"] = []
-            manifest_by_page[page_number]["annotations"].append(annotation)
-            total_annotated += 1
+    for file in annotation_files:
+        with open(file.path) as f:
+            annotation = json.load(f)
+        annotation.pop("completed_by", None)
+        page_number = annotation["task"]["data"]["pageNumber"]
+        if not manifest_by_page[page_number].get("annotations"):
+            manifest_by_page[page_number]["annotations"] = []
+        manifest_by_page[page_number]["annotations"].append(annotation)
+        total_annotated += 1
     return total_annotated
 
 
@@ -1,73 +1,310 @@
 import os
+import hashlib
 import json
+import time
 import numpy as np
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Optional, Tuple
 from .article_reconstruction import ArticleReconstructor
 from PIL import Image, ImageDraw, ImageFont, ImageColor
 import click
-from multiprocessing import Pool, cpu_count
-from functools import partial
+from multiprocessing import cpu_count
+from functools import partial, lru_cache
+from pathlib import Path
+from xml.sax.saxutils import escape
+from .utils import run_tasks, write_atomically
 
 TRANSPARENCY = 0.25  # Degree of transparency, 0-100%
 OPACITY = int(255 * TRANSPARENCY)
 
+THUMBNAIL_WIDTH = 1000
 
-def generate_thumbnails(source_folder: str, destination_folder: str):
+# Thumbnails that are up to date are recorded in this file in the destination folder
+INDEX_FILENAME = ".thumbnails-index.json"
+
+# Bump this when a change in the code alters the thumbnails
+RENDERER_VERSION = 1
+
+# Using all CPUs would freeze my laptop
+DEFAULT_WORKERS = max(1, int(cpu_count() * 0.8))
+
+# Number of slowest images listed in the timing summary
+SLOWEST_REPORTED = 5
+
+# Overlays are either drawn on the thumbnails ("raster"), or written next to them in
+# an SVG file with this suffix, for the gallery to show on top of them ("sidecar")
+OVERLAY_MODES = ("raster", "sidecar")
+OVERLAY_SUFFIX = ".overlay.svg"
+
+FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+BOLD_FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+
+
+@lru_cache(maxsize=None)
+def get_font(path: str, size: int) -> ImageFont.FreeTypeFont:
+    """Load a font once per worker process for every size it is used at"""
+    return ImageFont.truetype(path, size)
+
+
+def generate_thumbnails(
+    source_folder: str,
+    destination_folder: str,
+    force: bool = False,
+    dry_run: bool = False,
+    workers: int = DEFAULT_WORKERS,
+    chunksize: int = 1,
+    overlays: str = "raster",
+):
     """
     Generate thumbnails from images in the source folder and save them in the destination folder.
     Only process directories with a manifest.json file and annotations in their JSON files.
 
+    Thumbnails are recorded in an index file in the destination folder, and only those
+    whose image, annotations or renderer changed are generated again. Thumbnails of
+    images that are no longer in the source folder are removed.
+
+    With sidecar `overlays`, thumbnails are bare pages and the annotations go into a
+    small SVG file next to each of them, so annotation changes only rewrite the SVG.
+
+    Images that fail are reported at the end without stopping the others, and are
+    generated again on the next run.
+
     :param source_folder: Path to the source folder containing images and manifest files
     :param destination_folder: Path to save the generated thumbnails
-    :param progress_callback: Optional callback function to report progress
+    :param force: Regenerate all thumbnails, even if they are up to date
+    :param dry_run: Only report which thumbnails would be generated or removed
+    :param workers: Number of processes generating thumbnails
+    :param chunksize: Number of images sent to a worker process at once
+    :param overlays: One of OVERLAY_MODES
     """
+    index = read_index(destination_folder)
+    new_index = {}
     tasks = []
     for root, dirs, files in os.walk(source_folder):
         if "manifest.json" not in files:
             continue
 
-        with open(os.path.join(root, "manifest.json"), "r") as f:
+        manifest_path = os.path.join(root, "manifest.json")
+        with open(manifest_path, "r") as f:
             manifest = json.load(f)
 
-        for item in manifest:
-            image_filename = os.path.basename(item["data"]["ocr"])
-            image_path = os.path.join(root, image_filename)
+        for offset, item in enumerate(manifest):
+            image_path = manifest_image_path(manifest_path, item)
             if not os.path.exists(image_path):
                 click.echo(f"Image not found: {image_path}", err=True)
                 continue
+            thumbnail = os.path.relpath(image_path, source_folder)
+            entry = thumbnail_entry(image_path, item.get("annotations", []), overlays)
+            new_index[thumbnail] = entry
+            render_image, write_overlay = stale_outputs(
+                None if force else index.get(thumbnail),
+                entry,
+                os.path.join(destination_folder, thumbnail),
+            )
+            if not (render_image or write_overlay):
+                continue
+            # Workers load the annotations from the manifest themselves
             tasks.append(
                 (
+                    manifest_path,
+                    offset,
                     image_path,
-                    item.get("annotations", []),
                     source_folder,
                     destination_folder,
+                    overlays,
+                    render_image,
                 )
             )
 
-    # Use multiprocessing to process images in parallel
+    orphans = sorted(set(index) - set(new_index))
+    click.echo(
+        f"{len(tasks)} thumbnails to generate, {len(new_index) - len(tasks)} up to date, "
+        f"{len(orphans)} to remove"
+    )
+    if dry_run:
+        for _, _, image_path, _, _, _, render_image in tasks:
+            thumbnail = os.path.relpath(image_path, source_folder)
+            if render_image:
+                click.echo(f"Would generate {thumbnail}")
+            else:
+                click.echo(f"Would update the overlay of {thumbnail}")
+        for thumbnail in orphans:
+            click.echo(f"Would remove {thumbnail}")
+        return
+
+    for thumbnail in orphans:
+        thumbnail_path = os.path.join(destination_folder, thumbnail)
+        for path in (thumbnail_path, overlay_path(thumbnail_path)):
+            if os.path.exists(path):
+                os.remove(path)
+
     total_tasks = len(tasks)
     processed_images = 0
     images_with_annotations = 0
-    concurrency = int(cpu_count() * 0.8)  # Using all CPUs would freeze my laptop
-    with Pool(processes=concurrency) as pool:
-        with click.progressbar(
-            length=total_tasks, label="Generating thumbnails"
-        ) as progress_bar:
-            for has_annotations in pool.imap_unordered(process_image, tasks):
-                processed_images += 1
+    failures = []
+    timings = []
+    with click.progressbar(
+        length=total_tasks, label="Generating thumbnails"
+    ) as progress_bar:
+        for task, error, result in run_tasks(
+            process_image_task, tasks, workers, chunksize
+        ):
+            processed_images += 1
+            image_path = task[2]
+            thumbnail = os.path.relpath(image_path, source_folder)
+            if error:
+                failures.append(f"{image_path}: {error}")
+                # Not recorded in the index, so it is tried again on the next run
+                new_index.pop(thumbnail, None)
+            else:
+                has_annotations, elapsed = result
+                timings.append((elapsed, thumbnail))
                 if has_annotations:
                     images_with_annotations += 1
-                progress_bar.update(1)
-                progress_bar.label = f"Processed {processed_images}/{total_tasks} images, {images_with_annotations} with annotations"
+            progress_bar.update(1)
+            progress_bar.label = f"Processed {processed_images}/{total_tasks} images, {images_with_annotations} with annotations"
+
+    write_index(destination_folder, new_index)
+
+    if timings:
+        total = sum(elapsed for elapsed, _ in timings)
+        click.echo(
+            f"Generated {len(timings)} thumbnails in {total:.1f}s of worker time, "
+            f"{total / len(timings):.2f}s per image. Slowest:"
+        )
+        for elapsed, thumbnail in sorted(timings, reverse=True)[:SLOWEST_REPORTED]:
+            click.echo(f"  {elapsed:.2f}s {thumbnail}")
+    if failures:
+        raise click.ClickException(
+            f"{len(failures)} thumbnails could not be generated:\n"
+            + "\n".join(failures)
+        )
+
+
+def process_image_task(task: tuple) -> Tuple[bool, float]:
+    """
+    Generate the thumbnail of the page at `offset` in a manifest.
+    Return whether it has annotations and the time it took.
+    """
+    (
+        manifest_path,
+        offset,
+        image_path,
+        source_folder,
+        destination_folder,
+        overlays,
+        render_image,
+    ) = task
+    start = time.perf_counter()
+    item = load_manifest(manifest_path)[offset]
+    has_annotations = process_image(
+        (
+            image_path,
+            item.get("annotations", []),
+            source_folder,
+            destination_folder,
+            overlays,
+            render_image,
+        )
+    )
+    return has_annotations, time.perf_counter() - start
+
+
+def load_manifest(manifest_path: str) -> List[Dict[str, Any]]:
+    """
+    Load a manifest, keeping the last few in memory: consecutive tasks of a worker
+    usually come from the same manifest.
+    """
+    return load_manifest_version(manifest_path, os.stat(manifest_path).st_mtime_ns)
+
+
+@lru_cache(maxsize=4)
+def load_manifest_version(manifest_path: str, mtime_ns: int) -> List[Dict[str, Any]]:
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def manifest_image_path(manifest_path: str, item: Dict[str, Any]) -> str:
+    """The local path of the image of a manifest item"""
+    return os.path.join(
+        os.path.dirname(manifest_path), os.path.basename(item["data"]["ocr"])
+    )
+
+
+def thumbnail_entry(
+    image_path: str, annotations: List[Dict[str, Any]], overlays: str
+) -> Dict[str, Any]:
+    """What a thumbnail depends on: its image, its annotations and the renderer"""
+    stat = os.stat(image_path)
+    serialized = json.dumps(annotations, sort_keys=True, separators=(",", ":"))
+    return {
+        "image_size": stat.st_size,
+        "image_mtime": stat.st_mtime,
+        "annotations_sha256": hashlib.sha256(serialized.encode()).hexdigest(),
+        "renderer_version": RENDERER_VERSION,
+        "overlays": overlays,
+    }
+
+
+def stale_outputs(
+    previous: Optional[Dict[str, Any]], entry: Dict[str, Any], thumbnail_path: str
+) -> Tuple[bool, bool]:
+    """
+    Tell whether the thumbnail image and its overlay sidecar, if any, need to be
+    generated again. With sidecar overlays the image does not depend on the annotations.
+    """
+    sidecar = entry["overlays"] == "sidecar"
+    if not previous:
+        return True, sidecar
+    image_keys = ["image_size", "image_mtime", "renderer_version", "overlays"]
+    if not sidecar:
+        image_keys.append("annotations_sha256")
+    render_image = not os.path.exists(thumbnail_path) or any(
+        previous.get(key) != entry[key] for key in image_keys
+    )
+    write_overlay = sidecar and (
+        previous != entry or not os.path.exists(overlay_path(thumbnail_path))
+    )
+    return render_image, write_overlay
+
+
+def overlay_path(thumbnail_path: str) -> str:
+    """The overlay sidecar of a thumbnail: page_01.jpeg -> page_01.overlay.svg"""
+    return os.path.splitext(thumbnail_path)[0] + OVERLAY_SUFFIX
+
+
+def read_index(destination_folder: str) -> Dict[str, Any]:
+    index_path = os.path.join(destination_folder, INDEX_FILENAME)
+    if not os.path.exists(index_path):
+        return {}
+    try:
+        with open(index_path) as f:
+            return json.load(f)
+    except ValueError as e:
+        click.echo(f"Ignoring unreadable index {index_path}: {e}", err=True)
+        return {}
+
+
+def write_index(destination_folder: str, index: Dict[str, Any]) -> None:
+    os.makedirs(destination_folder, exist_ok=True)
+    write_atomically(
+        Path(destination_folder) / INDEX_FILENAME,
+        json.dumps(index, separators=(",", ":"), sort_keys=True),
+    )
 
 
 def process_image(args):
-    """Process a single image, create a thumbnail with overlays, and save it."""
-    image_path, annotations, source_root, destination_folder = args
+    """
+    Process a single image, create a thumbnail with overlays, and save it.
+    With sidecar `overlays` the overlays are written to an SVG file instead, and
+    the thumbnail itself is only created if `render_image` is set.
+    """
+    image_path, annotations, source_root, destination_folder, overlays, render_image = (
+        args
+    )
 
     def draw_debug_info(draw, zone, x, y, debug_info):
         """Helper to draw debug information for a zone"""
-        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 12)
+        font = get_font(FONT_PATH, 12)
 
         # Just show the label
         debug_text = [zone.label]
@@ -90,10 +327,29 @@ def process_image(args):
             )
 
     has_annotations = len(annotations) > 0
+
+    # Create the destination directory structure
+    rel_path = os.path.relpath(os.path.dirname(image_path), source_root)
+    dest_dir = os.path.join(destination_folder, rel_path)
+    os.makedirs(dest_dir, exist_ok=True)
+    thumbnail_path = os.path.join(dest_dir, os.path.basename(image_path))
+
     with Image.open(image_path) as img:
         # Resize image to 1000 pixels wide
         aspect_ratio = img.height / img.width
-        new_size = (1000, int(1000 * aspect_ratio))
+        new_size = (THUMBNAIL_WIDTH, int(THUMBNAIL_WIDTH * aspect_ratio))
+
+        # Opening the image only reads its size: sidecars are written without decoding it
+        if overlays == "sidecar":
+            write_overlay_svg(overlay_path(thumbnail_path), annotations, new_size)
+            if not render_image:
+                return has_annotations
+        elif os.path.exists(overlay_path(thumbnail_path)):
+            os.remove(overlay_path(thumbnail_path))
+
+        # JPEGs are decoded at the smallest scale still larger than the thumbnail,
+        # so that LANCZOS only has to resize by less than a factor of two
+        img.draft(img.mode, new_size)
         img_resized = img.resize(new_size, Image.LANCZOS)
 
         # Convert image to RGBA mode
@@ -103,10 +359,10 @@ def process_image(args):
         overlay = Image.new("RGBA", img_resized.size, (0, 0, 0, 0))
         draw = ImageDraw.Draw(overlay)
 
-        # Collect all boxes and their metadata
+        # Collect all boxes and their metadata. Sidecar thumbnails are bare pages.
         boxes = []
         box_metadata = []
-        for annotation in annotations:
+        for annotation in annotations if overlays == "raster" else []:
             for result in annotation["result"]:
                 if "labels" in result["value"]:
                     x = result["value"]["x"] * new_size[0] / 100
@@ -140,17 +396,17 @@ def process_image(args):
                     reconstructor.add_zone(result)
 
             # Build connectivity graph and reconstruct articles
-            reconstructor.build_graph()
+            reconstructor.build_graph(vectorized=True)
             articles = reconstructor.reconstruct_articles()
 
             # Draw connectivity graph first
             for zone1_id, connections in reconstructor.graph.items():
-                zone1 = next(z for z in reconstructor.zones if z.id == zone1_id)
+                zone1 = reconstructor.zones_by_id[zone1_id]
                 start_x = zone1.x * new_size[0] / 100
                 start_y = zone1.y * new_size[1] / 100
 
                 for connected_id, weight in connections:
-                    zone2 = next(z for z in reconstructor.zones if z.id == connected_id)
+                    zone2 = reconstructor.zones_by_id[connected_id]
                     end_x = zone2.x * new_size[0] / 100
                     end_y = zone2.y * new_size[1] / 100
 
@@ -186,10 +442,7 @@ def process_image(args):
                     if zone == article[0]:
                         # Draw white background for number
                         number_size = max(int(height / 2), 20)  # Minimum size of 20px
-                        font = ImageFont.truetype(
-                            "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-                            number_size,
-                        )
+                        font = get_font(BOLD_FONT_PATH, number_size)
                         number_text = str(article_idx + 1)
                         text_bbox = draw.textbbox((0, 0), number_text, font=font)
                         text_width = text_bbox[2] - text_bbox[0]
@@ -218,18 +471,76 @@ def process_image(args):
         # Alpha composite the original image with the overlay
         img_with_overlay = Image.alpha_composite(img_resized, overlay)
 
-        # Create the destination directory structure
-        rel_path = os.path.relpath(os.path.dirname(image_path), source_root)
-        dest_dir = os.path.join(destination_folder, rel_path)
-        os.makedirs(dest_dir, exist_ok=True)
-
         # Convert back to RGB mode and save the thumbnail
         img_rgb = img_with_overlay.convert("RGB")
-        thumbnail_path = os.path.join(dest_dir, os.path.basename(image_path))
         img_rgb.save(thumbnail_path)
         return has_annotations
 
 
+def write_overlay_svg(
+    svg_path: str, annotations: List[Dict[str, Any]], size: Tuple[int, int]
+) -> None:
+    """
+    Write the overlays of a page as an SVG file with the size of its thumbnail: the
+    connectivity graph, and the boxes of every article with its number, as they are
+    drawn by `process_image`.
+    """
+    width, height = size
+    sx, sy = width / 100, height / 100
+
+    reconstructor = ArticleReconstructor()
+    for result in annotations[-1]["result"] if annotations else []:
+        if "labels" in result["value"]:
+            reconstructor.add_zone(result)
+    articles = []
+    if reconstructor.zones:
+        reconstructor.build_graph(vectorized=True, debug=False)
+        articles = reconstructor.reconstruct_articles()
+
+    elements = ['<g stroke="#ff0000" stroke-width="2">']
+    for zone1_id, connections in reconstructor.graph.items():
+        zone1 = reconstructor.zones_by_id[zone1_id]
+        for connected_id, weight in connections:
+            zone2 = reconstructor.zones_by_id[connected_id]
+            elements.append(
+                f'<line x1="{zone1.x * sx:.1f}" y1="{zone1.y * sy:.1f}" '
+                f'x2="{zone2.x * sx:.1f}" y2="{zone2.y * sy:.1f}" '
+                f'stroke-opacity="{min(weight, 1.0):.2f}"/>'
+            )
+    elements.append("</g>")
+
+    for article_idx, article in enumerate(articles):
+        elements.append(f'<g class="article" data-article="{article_idx + 1}">')
+        for zone in article:
+            elements.append(
+                f'<rect x="{zone.x * sx:.1f}" y="{zone.y * sy:.1f}" '
+                f'width="{zone.width * sx:.1f}" height="{zone.height * sy:.1f}" '
+                f'fill="#{"%02x%02x%02x" % get_color_for_label(zone.label)}" '
+                f'fill-opacity="{TRANSPARENCY}"><title>{escape(zone.label)}</title></rect>'
+            )
+        # Article number in the first zone, on a white background
+        first = article[0]
+        number_text = str(article_idx + 1)
+        number_size = max(int(first.height * sy / 2), 20)
+        padding = 4
+        elements.append(
+            f'<rect x="{first.x * sx:.1f}" y="{first.y * sy:.1f}" '
+            f'width="{len(number_text) * number_size * 0.7 + 2 * padding:.1f}" '
+            f'height="{number_size + 2 * padding}" fill="#ffffff"/>'
+            f'<text x="{first.x * sx + padding:.1f}" '
+            f'y="{first.y * sy + padding + number_size * 0.85:.1f}" '
+            f'font-size="{number_size}">{number_text}</text>'
+        )
+        elements.append("</g>")
+
+    with open(svg_path, "w") as f:
+        f.write(
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'viewBox="0 0 {width} {height}" font-family="DejaVu Sans, sans-serif" '
+            f'font-weight="bold">{"".join(elements)}</svg>'
+        )
+
+
 def get_color_for_label(label: str) -> tuple:
     """Return a color tuple (R, G, B) for a given label."""
     color_map = {
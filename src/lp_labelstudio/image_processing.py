@@ -1,30 +1,344 @@
-from typing import List, Dict, Any, Tuple
+from typing import (
+    TYPE_CHECKING,
+    List,
+    Dict,
+    Any,
+    Collection,
+    Iterable,
+    Iterator,
+    Optional,
+    Tuple,
+)
 import logging
+import queue
+import itertools
+import threading
+import time
 import uuid
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
 import numpy as np
 from PIL import Image
-import layoutparser as lp  # type: ignore
-from paddleocr import PaddleOCR  # type: ignore
 
-from lp_labelstudio.constants import JPEG_EXTENSION
+if TYPE_CHECKING:
+    # Only needed for annotations: the caller loads the model
+    import layoutparser as lp  # type: ignore
 
-logger = logging.getLogger(__name__)
+from lp_labelstudio.constants import JPEG_EXTENSION, NEWSPAPER_TEXT_LABELS
+from lp_labelstudio.ocr import get_ocr
+from lp_labelstudio.ocr_cache import cache_key, get_ocr_cache
 
-# Initialize PaddleOCR
-ocr: PaddleOCR = PaddleOCR(lang="it")
+logger = logging.getLogger(__name__)
 
 # Make coordinates reading readable
 X1, Y1, X2, Y2 = 0, 1, 2, 3
 
+# Configuration of the engine transcribing detected layout blocks
+BLOCK_OCR_CONFIG = dict(lang="it")
+
 
 def process_single_image(
-    image_path: str, model: lp.models.Detectron2LayoutModel
+    image_path: str,
+    model: "lp.models.Detectron2LayoutModel",
+    ocr_labels: Optional[Collection[str]] = NEWSPAPER_TEXT_LABELS,
+    use_cache: bool = True,
 ) -> List[Dict[str, Any]]:
-    """Returns a list of annotations suitable for Label Studio from a single image."""
+    """
+    Returns a list of annotations suitable for Label Studio from a single image.
+    Only blocks whose label is in `ocr_labels` are transcribed (all of them if None).
+    `use_cache`: Reuse transcriptions stored in the persistent OCR cache
+    """
     logger.info(f"Processing image: {image_path}")
     image: Image.Image = Image.open(image_path)
-    layout: List[lp.elements.layout_element.BaseLayoutElement] = model.detect(image)
+    layout: "List[lp.elements.layout_element.BaseLayoutElement]" = model.detect(image)
+
+    result = annotate_layout(image, layout, ocr_labels=ocr_labels, use_cache=use_cache)
+    logger.info(f"Processed {len(result)} blocks in {image_path}")
+    return result
+
+
+def process_images_batched(
+    image_paths: Iterable[str],
+    model: "lp.models.Detectron2LayoutModel",
+    batch_size: int,
+    ocr_labels: Optional[Collection[str]] = NEWSPAPER_TEXT_LABELS,
+    use_cache: bool = True,
+) -> Iterator[Tuple[str, Optional[str], Optional[List[Dict[str, Any]]]]]:
+    """
+    Like `process_single_image`, for many images: yields `(image_path, error message,
+    annotations)` in the order of `image_paths`. A page that fails is reported with its
+    error message and None annotations, without stopping the others.
+
+    Images are decoded ahead of time in a background thread and run through the
+    detection model `batch_size` at a time.
+    """
+    images = iter_decoded_images(image_paths, prefetch=2 * batch_size)
+    for batch in iter_batches(images, batch_size):
+        logger.info(f"Detecting layout of {len(batch)} images")
+        for image_path, error, image, layout in detect_pages(model, batch):
+            result = None
+            if error is None:
+                try:
+                    result = annotate_layout(
+                        image, layout, ocr_labels=ocr_labels, use_cache=use_cache
+                    )
+                    logger.info(f"Processed {len(result)} blocks in {image_path}")
+                except Exception as e:
+                    error = str(e)
+            yield image_path, error, result
+
+
+@dataclass
+class PipelineStats:
+    """Busy time of each pipeline stage, used to report how well the stages are utilised"""
+
+    workers: Dict[str, int]
+    busy: Dict[str, float] = field(default_factory=lambda: defaultdict(float))
+    started: float = field(default_factory=time.perf_counter)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    @contextmanager
+    def measure(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.busy[stage] += time.perf_counter() - start
+
+    def report(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        return ", ".join(
+            f"{stage} ({workers} workers): {self.busy[stage] / (elapsed * workers):.0%} busy"
+            for stage, workers in self.workers.items()
+        )
+
+
+def process_images_pipelined(
+    image_paths: Iterable[str],
+    model: "lp.models.Detectron2LayoutModel",
+    batch_size: int,
+    ocr_workers: int,
+    stats: Optional[PipelineStats] = None,
+    ocr_labels: Optional[Collection[str]] = NEWSPAPER_TEXT_LABELS,
+    use_cache: bool = True,
+) -> Iterator[Tuple[str, Optional[str], Optional[List[Dict[str, Any]]]]]:
+    """
+    Like `process_images_batched`, but layout detection and OCR run concurrently.
+
+    The stages are connected by bounded queues: a decoding thread, a detection thread
+    (running `batch_size` pages at a time) and `ocr_workers` OCR threads, each with its
+    own PaddleOCR instance since they are not thread safe. Every detected block is a
+    separate OCR task. Results are reassembled and yielded in the order of `image_paths`.
+    """
+    if stats is None:
+        stats = PipelineStats({"decode": 1, "detection": 1, "ocr": ocr_workers})
+    detected: queue.Queue = queue.Queue(maxsize=2 * batch_size)
+    done = object()
+
+    def detect() -> None:
+        try:
+            images = iter_decoded_images(image_paths, 2 * batch_size, stats)
+            for batch in iter_batches(images, batch_size):
+                with stats.measure("detection"):
+                    pages = detect_pages(model, batch)
+                for page in pages:
+                    detected.put(page)
+        except Exception as e:
+            detected.put(e)
+        detected.put(done)
+
+    engines = threading.local()
+    instances = itertools.count()
+
+    def transcribe(image: Image.Image, block) -> Optional[str]:
+        if not hasattr(engines, "ocr"):
+            engines.ocr = get_ocr(instance=next(instances), config=BLOCK_OCR_CONFIG)
+        with stats.measure("ocr"):
+            return transcribe_block(image, block, engines.ocr, use_cache)
+
+    def assemble(page: Tuple[str, Optional[str], Any, Any, List[Optional[Future]]]):
+        image_path, error, image, layout, futures = page
+        if error is not None:
+            return image_path, error, None
+        try:
+            texts = [f.result() if f else None for f in futures]
+        except Exception as e:
+            return image_path, str(e), None
+        result = annotate_layout(image, layout, texts)
+        logger.info(f"Processed {len(result)} blocks in {image_path}")
+        return image_path, None, result
+
+    threading.Thread(target=detect, daemon=True).start()
+    # Pages waiting for their OCR tasks. Keeping a couple lets the OCR workers move on
+    # to the next page while the blocks of the current one finish.
+    pending: deque = deque()
+    max_pending = 2
+    with ThreadPoolExecutor(max_workers=ocr_workers) as executor:
+        while True:
+            item = detected.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            image_path, error, image, layout = item
+            futures = [
+                (
+                    executor.submit(transcribe, image, block)
+                    if is_textual(block, ocr_labels)
+                    else None
+                )
+                for block in layout or []
+            ]
+            pending.append((image_path, error, image, layout, futures))
+            while pending and (
+                len(pending) > max_pending or all(f.done() for f in pending[0][4] if f)
+            ):
+                yield assemble(pending.popleft())
+        while pending:
+            yield assemble(pending.popleft())
+
+
+def detect_pages(
+    model: "lp.models.Detectron2LayoutModel",
+    batch: List[Tuple[str, Optional[str], Optional[Image.Image]]],
+) -> List[Tuple[str, Optional[str], Optional[Image.Image], Any]]:
+    """
+    Detect the layout of a batch of decoded pages `(image_path, error message, image)`
+    and return them as `(image_path, error message, image, layout)`.
+    Pages that could not be decoded keep their error. If detection fails, every page
+    of the batch fails with its error.
+    """
+    images = [image for _, error, image in batch if error is None]
+    try:
+        if len(images) > 1:
+            layouts = iter(detect_batch(model, images))
+        else:
+            layouts = iter([model.detect(image) for image in images])
+    except Exception as e:
+        return [
+            (image_path, error or str(e), None, None) for image_path, error, _ in batch
+        ]
+    return [
+        (image_path, error, image, None if error else next(layouts))
+        for image_path, error, image in batch
+    ]
+
+
+def detect_batch(
+    model: "lp.models.Detectron2LayoutModel", images: List[Image.Image]
+) -> "List[lp.Layout]":
+    """
+    Run `model.detect` on several images with a single forward pass.
+
+    This replicates what `model.detect` and detectron2's `DefaultPredictor` do for
+    a single image, but feeds all the images to the underlying model at once.
+    """
+    import torch  # type: ignore
+
+    predictor = model.model
+    inputs = []
+    for image in images:
+        # Same conversion as Detectron2LayoutModel.detect
+        array = np.array(image.convert("RGB"))
+        # Same preprocessing as DefaultPredictor.__call__
+        if predictor.input_format == "RGB":
+            array = array[:, :, ::-1]
+        height, width = array.shape[:2]
+        transformed = predictor.aug.get_transform(array).apply_image(array)
+        tensor = torch.as_tensor(transformed.astype("float32").transpose(2, 0, 1))
+        inputs.append({"image": tensor, "height": height, "width": width})
+
+    with torch.no_grad():
+        outputs = predictor.model(inputs)
+    return [model.gather_output(output) for output in outputs]
+
+
+def iter_decoded_images(
+    image_paths: Iterable[str], prefetch: int, stats: Optional[PipelineStats] = None
+) -> Iterator[Tuple[str, Optional[str], Optional[Image.Image]]]:
+    """
+    Yield `(image_path, error message, image)`, decoding the images in a background
+    thread. Images that cannot be decoded come with their error and no image.
+    At most `prefetch` decoded images are kept waiting.
+    """
+    decoded: queue.Queue = queue.Queue(maxsize=prefetch)
+    done = object()
+
+    def load() -> None:
+        try:
+            for image_path in image_paths:
+                with stats.measure("decode") if stats else nullcontext():
+                    try:
+                        image = Image.open(image_path)
+                        image.load()
+                    except Exception as e:
+                        decoded.put((image_path, str(e), None))
+                        continue
+                decoded.put((image_path, None, image))
+        except Exception as e:
+            decoded.put(e)
+        decoded.put(done)
+
+    threading.Thread(target=load, daemon=True).start()
+    while True:
+        item = decoded.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
 
+
+def iter_batches(items: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+    batch: List[Any] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def annotate_layout(
+    image: Image.Image,
+    layout: "List[lp.elements.layout_element.BaseLayoutElement]",
+    texts: Optional[List[Optional[str]]] = None,
+    ocr_labels: Optional[Collection[str]] = NEWSPAPER_TEXT_LABELS,
+    use_cache: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    Returns Label Studio annotations for a detected layout.
+
+    `texts` holds the transcription of each block (None for blocks without text).
+    When not given, the blocks whose label is in `ocr_labels` (all of them if None)
+    are transcribed with OCR.
+    """
+    if texts is None:
+        texts = [
+            (
+                transcribe_block(image, block, use_cache=use_cache)
+                if is_textual(block, ocr_labels)
+                else None
+            )
+            for block in layout
+        ]
+    result: List[Dict[str, Any]] = []
+    for i, (block, text) in enumerate(zip(layout, texts)):
+        result.extend(block_annotations(image, i, block, text))
+    return result
+
+
+def block_annotations(
+    image: Image.Image,
+    index: int,
+    block: "lp.elements.layout_element.BaseLayoutElement",
+    text: Optional[str],
+) -> List[Dict[str, Any]]:
+    """Returns the bbox, label and (if there is any text) transcription annotations of a block."""
     result: List[Dict[str, Any]] = []
     template = {
         "original_width": image.width,
@@ -32,72 +346,103 @@ def process_single_image(
         "image_rotation": 0,
         "to_name": "image",
     }
-    for i, block in enumerate(layout):
-        # Add the block and the labels to result
-        x_percentage = (block.coordinates[X1] / image.width) * 100
-        y_percentage = (block.coordinates[Y1] / image.height) * 100
-        width_percentage = (
-            (block.coordinates[X2] - block.coordinates[X1]) / image.width
-        ) * 100
-        height_percentage = (
-            (block.coordinates[Y2] - block.coordinates[Y1]) / image.height
-        ) * 100
-
-        block_template = dict(
-            template,
+    # Add the block and the labels to result
+    x_percentage = (block.coordinates[X1] / image.width) * 100
+    y_percentage = (block.coordinates[Y1] / image.height) * 100
+    width_percentage = (
+        (block.coordinates[X2] - block.coordinates[X1]) / image.width
+    ) * 100
+    height_percentage = (
+        (block.coordinates[Y2] - block.coordinates[Y1]) / image.height
+    ) * 100
+
+    block_template = dict(
+        template,
+        **{
+            "id": f"{index}",
+            "value": {
+                "x": x_percentage,
+                "y": y_percentage,
+                "width": width_percentage,
+                "height": height_percentage,
+                "rotation": 0,
+            },
+        },
+    )
+    result.append(
+        dict(
+            block_template,
             **{
-                "id": f"{i}",
-                "value": {
-                    "x": x_percentage,
-                    "y": y_percentage,
-                    "width": width_percentage,
-                    "height": height_percentage,
-                    "rotation": 0,
-                },
+                "from_name": "bbox",
+                "type": "rectangle",
             },
         )
-        result.append(
-            dict(
-                block_template,
-                **{
-                    "from_name": "bbox",
-                    "type": "rectangle",
-                },
-            )
+    )
+    result.append(
+        dict(
+            block_template,
+            **{
+                "from_name": "label",
+                "type": "labels",
+            },
         )
+    )
+    result[-1]["value"]["labels"] = [block.type]
+
+    if text is not None:
         result.append(
             dict(
                 block_template,
                 **{
-                    "from_name": "label",
-                    "type": "labels",
+                    "from_name": "transcription",
+                    "type": "textarea",
                 },
             )
         )
-        result[-1]["value"]["labels"] = [block.type]
-        # Perform OCR on the block
-        crop: Image.Image = image.crop(tuple(map(int, block.block.coordinates)))
-        ocr_result: List[List[Tuple[List[List[int]], Tuple[str, float]]]] = ocr.ocr(
-            np.array(crop), cls=False
-        )
+        result[-1]["value"]["text"] = [text]
 
-        if ocr_result is not None and ocr_result[0]:
-            text = " ".join([line[1][0] for line in ocr_result[0]])
-            result.append(
-                dict(
-                    block_template,
-                    **{
-                        "from_name": "transcription",
-                        "type": "textarea",
-                    },
-                )
-            )
-            result[-1]["value"]["text"] = [text]
-
-    logger.info(f"Processed {len(result)} blocks in {image_path}")
     return result
 
 
+def is_textual(
+    block: "lp.elements.layout_element.BaseLayoutElement",
+    ocr_labels: Optional[Collection[str]],
+) -> bool:
+    return ocr_labels is None or block.type in ocr_labels
+
+
+def transcribe_block(
+    image: Image.Image,
+    block: "lp.elements.layout_element.BaseLayoutElement",
+    engine: Optional[Any] = None,
+    use_cache: bool = True,
+) -> Optional[str]:
+    """
+    Perform OCR on the block. Returns None if no text was found.
+    `engine` is the PaddleOCR instance to use, by default the shared one for
+    `BLOCK_OCR_CONFIG`.
+    `use_cache`: Reuse the transcription stored in the persistent OCR cache
+    """
+    coordinates = tuple(map(int, block.block.coordinates))
+    if use_cache:
+        key = cache_key(image, coordinates, None, BLOCK_OCR_CONFIG, "block")
+        cached = get_ocr_cache().get(key)
+        if cached is not None:
+            return cached["text"]
+
+    crop: Image.Image = image.crop(coordinates)
+    ocr_result: List[List[Tuple[List[List[int]], Tuple[str, float]]]] = (
+        engine or get_ocr(config=BLOCK_OCR_CONFIG)
+    ).ocr(np.array(crop), cls=False)
+
+    text = None
+    if ocr_result is not None and ocr_result[0]:
+        text = " ".join([line[1][0] for line in ocr_result[0]])
+    if use_cache:
+        get_ocr_cache().put(key, {"text": text})
+    return text
+
+
 def get_image_size(image_path: str) -> Tuple[int, int]:
     with Image.open(image_path) as img:
         return img.size
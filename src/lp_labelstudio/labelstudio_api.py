@@ -198,6 +198,7 @@ import json
 import os
 from collections import defaultdict
 from pathlib import Path
+from .annotation_index import open_annotation_index, update_indexed_issues
 from .generate_manifest import generate_labelstudio_manifest
 
 
@@ -224,14 +225,24 @@ def get_local_annotations_info(local_root, project_name, remote_annotations_coun
         return "No local annotations", remote_annotations_count, annotators
 
     annotators = defaultdict(int)
-    local_annotations_count = 0
-
-    for root, dirs, files in os.walk(full_path):
-        for file in files:
-            if file.endswith(".json"):
-                annotator = os.path.basename(os.path.dirname(os.path.join(root, file)))
-                annotators[annotator] += 1
-                local_annotations_count += 1
+    index = open_annotation_index()
+    indexed = None
+    if index is not None:
+        try:
+            indexed = index.annotator_counts(Path(local_root) / dir_name)
+        finally:
+            index.close()
+    if indexed is not None:
+        annotators.update(indexed)
+    else:
+        for root, dirs, files in os.walk(full_path):
+            for file in files:
+                if file.endswith(".json"):
+                    annotator = os.path.basename(
+                        os.path.dirname(os.path.join(root, file))
+                    )
+                    annotators[annotator] += 1
+    local_annotations_count = sum(annotators.values())
 
     if not annotators:
         return "No annotations found", remote_annotations_count, annotators
@@ -382,6 +393,8 @@ def fetch(ctx, local_root, verbose):
     response.raise_for_status()
     projects = response.json()["results"]
 
+    # Issue directories where annotations were written
+    fetched_issues = set()
     for project in projects:
         project_id = project["id"]
         project_title = project["title"]
@@ -439,6 +452,7 @@ def fetch(ctx, local_root, verbose):
                         # Update the local copy if there are changes
                         with full_path.open("w") as f:
                             json.dump(annotation, f, indent=2)
+                        fetched_issues.add(local_path.parent.parent)
                         console.print(
                             f"Updated existing annotation: {full_path} ({changes_summary})"
                         )
@@ -454,11 +468,14 @@ def fetch(ctx, local_root, verbose):
                     # Save the new annotation locally
                     with full_path.open("w") as f:
                         json.dump(annotation, f, indent=2)
+                    fetched_issues.add(local_path.parent.parent)
                     console.print(f"Saved new annotation: {full_path}")
                     if verbose:
                         console.print("New annotation content:")
                         console.print(json.dumps(annotation, indent=2))
 
+    if update_indexed_issues(fetched_issues) is not None:
+        console.print(f"Updated {len(fetched_issues)} issues in the annotation index")
     console.print(
         "[bold green]Finished fetching and updating annotations.[/bold green]"
     )
@@ -1,13 +1,15 @@
-from typing import List, Tuple, Optional
+from typing import Any, Dict, List, Tuple, Optional
+import threading
 import numpy as np
 from PIL import Image
-from paddleocr import PaddleOCR
+from lp_labelstudio.ocr_cache import cache_key, get_ocr_cache
 
 
 def ocr_box(
     img: Image.Image,
     box: Tuple[int, int, int, int],
     target_dpi: int = 150,  # Target DPI for OCR processing
+    use_cache: bool = True,
 ) -> List[Tuple[List[float], Tuple[str, float]]]:
     """
     Perform OCR on a specific region of an image, with resolution adjustment.
@@ -18,6 +20,7 @@ def ocr_box(
         target_dpi: Target DPI for OCR processing. Original image will be scaled
                    to this resolution for processing, but coordinates will be
                    returned in the original resolution.
+        use_cache: Reuse results stored in the persistent OCR cache (see ocr_cache.py)
 
     Returns:
         List of tuples containing:
@@ -25,51 +28,232 @@ def ocr_box(
         - Tuple of (text, confidence)
     """
     x, y, width, height = box
+    if use_cache:
+        key = cache_key(img, box, target_dpi, OCR_CONFIG, "ocr_box")
+        cached = get_ocr_cache().get(key)
+        if cached is not None:
+            return [(abs_bbox, tuple(line)) for abs_bbox, line in cached]
+
+    scaled_img = scale_region(img, box, target_dpi)
+
+    # Run OCR on the scaled image
+    ocr_result = get_ocr().ocr(ocr_input(scaled_img), cls=True, rec=True)
+
+    results = []
+    if ocr_result and ocr_result[0]:
+        for line in ocr_result[0]:
+            text, confidence = line[1]
+            abs_bbox = [x, y, x + width, y + height]
+
+            results.append((abs_bbox, (text, float(confidence))))
+
+    if use_cache:
+        get_ocr_cache().put(key, results)
+    return results
+
+
+def ocr_boxes(
+    img: Image.Image,
+    boxes: List[Tuple[int, int, int, int]],
+    target_dpi: int = 150,
+    detect: Optional[List[bool]] = None,
+    use_cache: bool = True,
+) -> List[List[Tuple[List[float], Tuple[str, float]]]]:
+    """
+    Perform OCR on several regions of a page.
+
+    Text detection runs on each box that needs it, and the text lines it finds are
+    cropped. The other boxes are assumed to hold a single line of text, and are not
+    run through detection at all. The lines of all the boxes of the page are then
+    recognized together, in a single batched call.
+
+    Args:
+        img: PIL Image of the page
+        boxes: List of (x, y, width, height) regions to process
+        target_dpi: See `ocr_box`
+        detect: Whether to run text detection, for each box. By default detection is
+                skipped for boxes that look like a single line (see `looks_single_line`)
+        use_cache: See `ocr_box`
+
+    Returns:
+        For each box, a list of results in the same format as `ocr_box`
+    """
+    if detect is None:
+        detect = [not looks_single_line(box) for box in boxes]
+
+    results: List[List[Tuple[List[float], Tuple[str, float]]]] = [[] for _ in boxes]
+    keys = {}
+    # Boxes not found in the cache
+    pending = []
+    # (index of the box, whether it went through detection, crop of a text line)
+    lines: List[Tuple[int, bool, np.ndarray]] = []
+    for i, (box, detect_box) in enumerate(zip(boxes, detect)):
+        if use_cache:
+            kind = "ocr_box" if detect_box else "single_line"
+            keys[i] = cache_key(img, box, target_dpi, OCR_CONFIG, kind)
+            cached = get_ocr_cache().get(keys[i])
+            if cached is not None:
+                results[i] = [(abs_bbox, tuple(line)) for abs_bbox, line in cached]
+                continue
+        pending.append(i)
+        region = ocr_input(scale_region(img, box, target_dpi))
+        if detect_box:
+            lines.extend((i, True, crop) for crop in detect_lines(get_ocr(), region))
+        else:
+            lines.append((i, False, region))
+
+    if lines:
+        engine = get_ocr()
+        rec_res, _ = engine.text_recognizer([crop for _, _, crop in lines])
+        for (i, detected, _), (text, confidence) in zip(lines, rec_res):
+            if detected:
+                # Like PaddleOCR.ocr, keep the lines recognized with a high enough score
+                if confidence < engine.drop_score:
+                    continue
+            elif not text:
+                continue
+            x, y, width, height = boxes[i]
+            abs_bbox = [x, y, x + width, y + height]
+            results[i].append((abs_bbox, (text, float(confidence))))
+
+    if use_cache:
+        for i in pending:
+            get_ocr_cache().put(keys[i], results[i])
+
+    return results
+
+
+def detect_lines(engine, region: np.ndarray) -> List[np.ndarray]:
+    """
+    Crops of the text lines detected in a region, in reading order, cropped as
+    `PaddleOCR.ocr` does before recognizing them.
+    """
+    from paddleocr.tools.infer.predict_system import sorted_boxes  # type: ignore
+    from paddleocr.tools.infer.utility import get_rotate_crop_image  # type: ignore
+
+    dt_boxes, _ = engine.text_detector(region)
+    if dt_boxes is None:
+        return []
+    return [
+        get_rotate_crop_image(region, np.array(box, dtype=np.float32))
+        for box in sorted_boxes(dt_boxes)
+    ]
+
+
+def ocr_input(img: Image.Image) -> np.ndarray:
+    """
+    The array given to PaddleOCR for an image: BGR, like images read with OpenCV.
+    `ocr_box` and `ocr_boxes` both use it, so a box gets the same text whichever
+    path it takes.
+    """
+    return np.array(img.convert("RGB"))[:, :, ::-1]
+
+
+# Boxes at least this many times wider than tall are taken to hold a single line
+SINGLE_LINE_MIN_ASPECT_RATIO = 8
+
+
+def looks_single_line(box: Tuple[int, int, int, int]) -> bool:
+    """
+    >>> looks_single_line((1471, 933, 1724, 55))
+    True
+    >>> looks_single_line((1512, 1035, 1644, 288))
+    False
+    """
+    _, _, width, height = box
+    return width >= SINGLE_LINE_MIN_ASPECT_RATIO * height
+
+
+def open_page(image_path, target_dpi: int = 150) -> Image.Image:
+    """
+    Open a page image for OCR at `target_dpi`.
+
+    JPEG pages are decoded directly at a reduced scale (DCT scaling), as close to
+    `target_dpi` as possible without going below it: 300dpi scans are decoded at half
+    their size, which saves most of the decoding time and memory and the resizing of
+    every box. `info["ocr_scale"]` holds the ratio between the decoded and the original
+    size and `info["original_size"]` the original size, so that `ocr_box` and
+    `ocr_boxes` still take and return boxes in original image coordinates.
+    """
+    img = Image.open(image_path)
+    original_size = img.size
+    dpi = img.info.get("dpi", (300, 300))[0]
+    if target_dpi < dpi:
+        scale = target_dpi / dpi
+        img.draft(
+            img.mode, (int(original_size[0] * scale), int(original_size[1] * scale))
+        )
+    ocr_scale = img.width / original_size[0]
+    img.info["ocr_scale"] = ocr_scale
+    img.info["original_size"] = original_size
+    img.info["dpi"] = (dpi * ocr_scale, dpi * ocr_scale)
+    return img
+
+
+def scale_region(
+    img: Image.Image, box: Tuple[int, int, int, int], target_dpi: int
+) -> Image.Image:
+    """
+    Crop the (x, y, width, height) region of the image and scale it to `target_dpi`.
+    `box` is in original image coordinates, also for pages opened with `open_page`.
+    """
+    x, y, width, height = box
+    page_scale = img.info.get("ocr_scale", 1.0)
 
     # Crop the image to the region
-    region_img = img.crop((x, y, x + width, y + height))
+    region_img = img.crop(
+        tuple(round(c * page_scale) for c in (x, y, x + width, y + height))
+    )
 
     # Get current DPI (assuming standard 300 DPI if not specified)
-    # Store it as a global for future ratio-based calculations
     current_dpi = region_img.info.get("dpi", (300, 300))[0]
-    if "current_dpi" not in OCR_CACHE:
-        OCR_CACHE["current_dpi"] = current_dpi
 
     # Calculate scale factor
     scale_factor = target_dpi / current_dpi
 
     # Scale the image
-    new_width = int(width * scale_factor)
-    new_height = int(height * scale_factor)
-    scaled_img = region_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+    new_width = int(width * page_scale * scale_factor)
+    new_height = int(height * page_scale * scale_factor)
+    if region_img.size == (new_width, new_height):
+        return region_img
+    return region_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
 
-    # Run OCR on the scaled image
-    ocr_result = get_ocr().ocr(np.array(scaled_img), cls=True, rec=True)
 
-    results = []
-    if ocr_result and ocr_result[0]:
-        for line in ocr_result[0]:
-            text, confidence = line[1]
-            abs_bbox = [x, y, x + width, y + height]
+# Default configuration of the engines returned by `get_ocr`
+OCR_CONFIG = dict(
+    use_angle_cls=False,
+    lang="it",
+    rec_algorithm="SVTR_LCNet",
+    det_db_box_thresh=0.1,
+)
 
-            results.append((abs_bbox, (text, confidence)))
+# PaddleOCR instances, keyed by configuration and instance number
+OCR_ENGINES: Dict[Tuple, Any] = {}
+OCR_ENGINES_LOCK = threading.Lock()
 
-    return results
 
+def get_ocr(instance: int = 0, config: Optional[Dict[str, Any]] = None):
+    """
+    Return the shared PaddleOCR instance for `config` (`OCR_CONFIG` by default).
+    Engines with different configurations are kept apart, so every caller gets
+    the configuration it asked for.
 
-OCR_CACHE = {}
+    PaddleOCR instances are not thread safe: threads running OCR concurrently
+    should each ask for a different `instance`.
+    """
+    return get_ocr_engine(config or OCR_CONFIG, instance)
 
 
-def get_ocr():
+def get_ocr_engine(config: Dict[str, Any], instance: int = 0):
     """
-    Cache the ocr object so that we instantiate at most one per invocation
+    Return the PaddleOCR instance for the given configuration, creating it on first use.
+    PaddleOCR is imported here, so that importing this module does not load the models.
     """
-    ocr = OCR_CACHE.get("ocr")
-    if not ocr:
-        ocr = OCR_CACHE["ocr"] = PaddleOCR(
-            use_angle_cls=False,
-            lang="it",
-            rec_algorithm="SVTR_LCNet",
-            det_db_box_thresh=0.1,
-        )
-    return ocr
+    key = (tuple(sorted(config.items())), instance)
+    with OCR_ENGINES_LOCK:
+        engine = OCR_ENGINES.get(key)
+        if engine is None:
+            from paddleocr import PaddleOCR  # type: ignore
+
+            engine = OCR_ENGINES[key] = PaddleOCR(**config)
+    return engine
@@ -0,0 +1,200 @@
+"""
+Persistent cache of OCR results, stored in a SQLite database.
+
+Results are keyed by the hash of the page image, the box, the target DPI, the
+PaddleOCR version and configuration (which together select the models), so
+re-running OCR on unchanged boxes does not need the OCR engine at all. When the
+database grows beyond its maximum size the least recently used results are evicted.
+Access times of cache hits are kept in memory, and written with the next insertion,
+eviction or when the cache is closed.
+
+The location defaults to `~/.cache/lp-labelstudio/ocr.sqlite3` and can be changed with
+the `LP_OCR_CACHE` environment variable. `LP_OCR_CACHE_MAX_BYTES` sets the maximum size.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from importlib import metadata
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from PIL import Image
+
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+# Check the size of the cache every this many insertions
+EVICTION_INTERVAL = 100
+
+
+class OCRResultCache:
+    def __init__(self, path: Path, max_bytes: int = DEFAULT_MAX_BYTES):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.inserts = 0
+        # Access times of cache hits not written to the database yet
+        self.accessed: Dict[str, float] = {}
+        self.closed = False
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS ocr_results (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS ocr_results_last_used ON ocr_results (last_used)"
+        )
+        self.evict()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT value FROM ocr_results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.accessed[key] = time.time()
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any) -> None:
+        serialized = json.dumps(value)
+        with self.lock:
+            self.write_accessed()
+            self.db.execute(
+                "INSERT OR REPLACE INTO ocr_results VALUES (?, ?, ?, ?)",
+                (key, serialized, len(serialized), time.time()),
+            )
+            self.db.commit()
+            self.inserts += 1
+        if self.inserts % EVICTION_INTERVAL == 0:
+            self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used results until the cache fits in `max_bytes`"""
+        with self.lock:
+            self.write_accessed()
+            self.db.commit()
+            (total,) = self.db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM ocr_results"
+            ).fetchone()
+            if total <= self.max_bytes:
+                return
+            to_free = total - self.max_bytes
+            freed = 0
+            keys = []
+            for key, size in self.db.execute(
+                "SELECT key, size FROM ocr_results ORDER BY last_used"
+            ):
+                if freed >= to_free:
+                    break
+                keys.append((key,))
+                freed += size
+            self.db.executemany("DELETE FROM ocr_results WHERE key = ?", keys)
+            self.db.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            if self.closed:
+                return
+            self.write_accessed()
+            self.db.commit()
+            self.db.close()
+            self.closed = True
+
+    def write_accessed(self) -> None:
+        """Write the pending access times, in the transaction committed by the caller"""
+        self.db.executemany(
+            "UPDATE ocr_results SET last_used = ? WHERE key = ?",
+            [(last_used, key) for key, last_used in self.accessed.items()],
+        )
+        self.accessed.clear()
+
+
+CACHE: Dict[str, Any] = {}
+CACHE_LOCK = threading.Lock()
+
+
+def get_ocr_cache() -> OCRResultCache:
+    """
+    Return the process-wide OCR result cache, opening it on first use.
+    Threads running OCR concurrently all get the same cache.
+    """
+    with CACHE_LOCK:
+        cache = CACHE.get("cache")
+        if cache is None:
+            cache_home = (
+                Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+                / "lp-labelstudio"
+            )
+            path = Path(os.environ.get("LP_OCR_CACHE", cache_home / "ocr.sqlite3"))
+            max_bytes = int(os.environ.get("LP_OCR_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+            cache = CACHE["cache"] = OCRResultCache(path, max_bytes)
+            atexit.register(cache.close)
+    return cache
+
+
+@lru_cache
+def paddleocr_version() -> str:
+    """The installed PaddleOCR version, read without importing it"""
+    try:
+        return metadata.version("paddleocr")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+# Image hashes, keyed by (path, mtime, size) of the file the image was read from
+IMAGE_HASHES: Dict[Tuple[str, float, int], str] = {}
+
+
+def image_hash(img: Image.Image) -> str:
+    """
+    Hash of the content of a page image. For images read from a file, the file is
+    hashed and the result remembered for as long as the file does not change.
+    Other images are hashed once, and the hash is kept on the image object: it is
+    assumed not to change while its boxes go through OCR. The hash is not stored in
+    `img.info`, which Pillow copies to the images derived from it.
+    """
+    filename = getattr(img, "filename", None)
+    if not filename:
+        if getattr(img, "ocr_sha256", None) is None:
+            img.ocr_sha256 = hashlib.sha256(img.tobytes()).hexdigest()
+        return img.ocr_sha256
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_mtime, stat.st_size)
+    if key not in IMAGE_HASHES:
+        IMAGE_HASHES[key] = hashlib.sha256(Path(filename).read_bytes()).hexdigest()
+    return IMAGE_HASHES[key]
+
+
+def cache_key(
+    img: Image.Image,
+    box: Tuple[int, int, int, int],
+    target_dpi: Optional[int],
+    config: Dict[str, Any],
+    kind: str,
+) -> str:
+    """
+    Key of the OCR results of a box. `kind` tells apart the different ways of
+    running OCR on the same box (e.g. with or without text detection).
+    Pages decoded at a reduced scale (see `ocr.open_page`) get different keys, and
+    so do results of another PaddleOCR version, which may ship other models.
+    """
+    return hashlib.sha256(
+        json.dumps(
+            [
+                image_hash(img),
+                img.info.get("ocr_scale", 1.0),
+                list(box),
+                target_dpi,
+                paddleocr_version(),
+                sorted(config.items()),
+                kind,
+            ]
+        ).encode()
+    ).hexdigest()
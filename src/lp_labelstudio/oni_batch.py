@@ -0,0 +1,387 @@
+"""
+Build an Open ONI batch from processed issue directories.
+
+Every issue directory (e.g. `/tmp/newspapers/lamasca-pages/1994/lamasca-1994-01-12`)
+becomes an issue folder `data/<lccn>/<reel>/<YYYYMMDD><edition>/` of the batch, containing:
+
+- `0001.tif` and `0001.jp2`: master and service images of every page
+- `0001.xml`: ALTO of every page
+- `<YYYYMMDD><edition>.xml`: METS of the issue
+
+`data/batch.xml` lists all the issues.
+
+The ALTO of a page is copied from `page_01.alto.xml` (written by `process-image`) when it
+exists, otherwise it is generated from the transcriptions in `page_01_annotations.json`
+(written by `process-newspaper`). Derivatives newer than their source are not regenerated,
+so re-running the command after adding issues only encodes the new pages.
+"""
+
+import click
+import json
+import logging
+import os
+import shutil
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+from PIL import Image
+from lp_labelstudio.alto_generator import write_alto_xml
+from lp_labelstudio.constants import JPEG_EXTENSION
+from lp_labelstudio.derivatives import Derivative, build_derivatives
+from lp_labelstudio.generate_manifest import (
+    get_date,
+    get_page_number,
+    is_issue_directory,
+)
+from lp_labelstudio.utils import atomic_output, is_up_to_date, run_tasks
+
+logger = logging.getLogger(__name__)
+
+EDITION = "01"
+
+# Master and service images of the pages, at the size of the source image
+MASTER = Derivative("master", None, "tiff")
+SERVICE = Derivative("service", None, "jp2")
+
+METS_NAMESPACES = {
+    "xmlns": "http://www.loc.gov/METS/",
+    "xmlns:mods": "http://www.loc.gov/mods/v3",
+    "xmlns:mix": "http://www.loc.gov/mix/",
+    "xmlns:xlink": "http://www.w3.org/1999/xlink",
+}
+
+
+@dataclass
+class PageTask:
+    image_path: Path
+    output_dir: Path
+    sequence: int
+    force: bool
+
+
+@dataclass
+class PageInfo:
+    sequence: int
+    width: int
+    height: int
+    encoded: bool
+
+
+@click.command()
+@click.argument(
+    "issue_dirs",
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, file_okay=False, dir_okay=True, path_type=Path),
+)
+@click.option(
+    "--output-dir",
+    required=True,
+    type=click.Path(file_okay=False, dir_okay=True, path_type=Path),
+    help="Directory the batch is created in, e.g. test-alto/test_batches",
+)
+@click.option("--lccn", default="sn00000001", show_default=True)
+@click.option("--reel", default="001", show_default=True, help="Reel number")
+@click.option("--awardee", default="lamasca", show_default=True)
+@click.option(
+    "--batch-name",
+    help="Name of the batch. Defaults to batch_<awardee>_<year of the first issue>_ver01",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=os.cpu_count(),
+    show_default=True,
+    help="Number of processes encoding the TIFF and JP2 images of the pages",
+)
+@click.option(
+    "--force", is_flag=True, help="Regenerate derivatives that are up to date"
+)
+def build_oni_batch(
+    issue_dirs: Tuple[Path, ...],
+    output_dir: Path,
+    lccn: str,
+    reel: str,
+    awardee: str,
+    batch_name: Optional[str],
+    workers: int,
+    force: bool,
+):
+    """
+    Build an Open ONI batch, with METS, ALTO, TIFF and JP2 files, from issue directories.
+
+    ISSUE_DIRS: Issue directories containing the page_XX.jpeg images
+    """
+    for issue_dir in issue_dirs:
+        if not is_issue_directory(str(issue_dir.resolve())):
+            raise click.ClickException(
+                f"{issue_dir.resolve().name} is not an issue directory named "
+                "lamasca-YYYY-MM-DD"
+            )
+    issues = sorted(
+        (get_date(str(issue_dir.resolve())), issue_dir) for issue_dir in issue_dirs
+    )
+    if batch_name is None:
+        batch_name = f"batch_{awardee}_{issues[0][0][:4]}_ver01"
+    data_dir = output_dir / batch_name / "data"
+
+    tasks: List[PageTask] = []
+    issue_folders: Dict[str, Path] = {}
+    for date, issue_dir in issues:
+        images = sorted(
+            issue_dir.glob(f"page_*{JPEG_EXTENSION}"),
+            key=lambda path: get_page_number(path.name),
+        )
+        if not images:
+            logger.warning(f"No pages found in {issue_dir}, skipping it")
+            continue
+        issue_folder = data_dir / lccn / reel / f"{date.replace('-', '')}{EDITION}"
+        issue_folder.mkdir(parents=True, exist_ok=True)
+        issue_folders[date] = issue_folder
+        for image_path in images:
+            tasks.append(
+                PageTask(
+                    image_path, issue_folder, get_page_number(image_path.name), force
+                )
+            )
+
+    click.echo(f"Building {batch_name} from {len(issues)} issues, {len(tasks)} pages")
+    pages: Dict[Path, List[PageInfo]] = {
+        folder: [] for folder in issue_folders.values()
+    }
+    failures: List[str] = []
+    encoded = 0
+    for task, error, info in run_tasks(build_page, tasks, workers):
+        if error:
+            logger.error(f"Failed to process {task.image_path}: {error}")
+            failures.append(f"{task.image_path}: {error}")
+            pages.pop(task.output_dir, None)
+        else:
+            encoded += info.encoded
+            if task.output_dir in pages:
+                pages[task.output_dir].append(info)
+
+    # Issues with failed pages are left out of the batch, so it can still be loaded
+    complete = {
+        date: folder for date, folder in issue_folders.items() if folder in pages
+    }
+    for date, issue_folder in complete.items():
+        write_issue_mets(
+            issue_folder / f"{issue_folder.name}.xml",
+            date,
+            lccn,
+            reel,
+            awardee,
+            sorted(pages[issue_folder], key=lambda page: page.sequence),
+        )
+    if complete:
+        write_batch_xml(data_dir, batch_name, awardee, lccn, complete)
+
+    click.echo(
+        f"Encoded {encoded} pages, {len(tasks) - encoded - len(failures)} were up to date"
+    )
+    if failures:
+        raise click.ClickException(
+            f"{len(failures)} pages could not be processed:\n" + "\n".join(failures)
+        )
+    click.echo(click.style(f"Batch written to {data_dir.parent}", fg="green"))
+
+
+def build_page(task: PageTask) -> PageInfo:
+    """
+    Write the TIFF, JP2 and ALTO files of a page, unless they are up to date.
+    The source image is decoded at most once, for both TIFF and JP2 (see
+    `build_derivatives`).
+    """
+    stem = f"{task.sequence:04d}"
+    alto_path = task.output_dir / f"{stem}.xml"
+
+    encoded = build_derivatives(
+        task.image_path,
+        [
+            (MASTER, task.output_dir / f"{stem}.tif"),
+            (SERVICE, task.output_dir / f"{stem}.jp2"),
+        ],
+        task.force,
+    )
+    with Image.open(task.image_path) as img:
+        width, height = img.size
+
+    alto_source = task.image_path.with_suffix(".alto.xml")
+    annotations_path = task.image_path.with_name(
+        f"{task.image_path.stem}_annotations.json"
+    )
+    if alto_source.exists():
+        if task.force or not is_up_to_date(alto_path, alto_source):
+            with atomic_output(alto_path) as tmp_path:
+                shutil.copyfile(alto_source, tmp_path)
+    elif task.force or not is_up_to_date(alto_path, annotations_path):
+        if not annotations_path.exists():
+            logger.warning(f"No OCR for {task.image_path}, writing an empty ALTO file")
+        with atomic_output(alto_path) as tmp_path:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                write_alto_xml(
+                    f,
+                    width,
+                    height,
+                    annotation_ocr_results(annotations_path, width, height),
+                )
+
+    return PageInfo(task.sequence, width, height, bool(encoded))
+
+
+def annotation_ocr_results(
+    annotations_path: Path, width: int, height: int
+) -> Iterator[Tuple[List[float], Tuple[str, Optional[float]]]]:
+    """
+    Yield (bbox, (text, confidence)) for every transcribed block of a
+    `_annotations.json` file. Transcriptions carry no confidence.
+    """
+    if not annotations_path.exists():
+        return
+    data = json.loads(annotations_path.read_text())
+    for prediction in data["predictions"]:
+        for result in prediction:
+            if result["type"] != "textarea":
+                continue
+            value = result["value"]
+            x = value["x"] * width / 100
+            y = value["y"] * height / 100
+            bbox = [
+                x,
+                y,
+                x + value["width"] * width / 100,
+                y + value["height"] * height / 100,
+            ]
+            yield bbox, (" ".join(value["text"]), None)
+
+
+def write_issue_mets(
+    mets_path: Path,
+    date: str,
+    lccn: str,
+    reel: str,
+    awardee: str,
+    pages: List[PageInfo],
+) -> None:
+    """Write the METS file of an issue, following the NDNP issue profile read by Open ONI"""
+    mets = ET.Element(
+        "mets",
+        {
+            **METS_NAMESPACES,
+            "TYPE": "urn:library-of-congress:ndnp:mets:newspaper:issue",
+            "PROFILE": "urn:library-of-congress:mets:profiles:ndnp:issue:v1.5",
+            "LABEL": f"{awardee} {date}",
+        },
+    )
+    issue_mods = mods_section(mets, "issueModsBib", "Issue metadata")
+    related = ET.SubElement(issue_mods, "mods:relatedItem", type="host")
+    ET.SubElement(related, "mods:identifier", type="lccn").text = lccn
+    detail = ET.SubElement(
+        ET.SubElement(related, "mods:part"), "mods:detail", type="edition"
+    )
+    ET.SubElement(detail, "mods:number").text = EDITION
+    origin = ET.SubElement(issue_mods, "mods:originInfo")
+    ET.SubElement(origin, "mods:dateIssued", encoding="iso8601").text = date
+    ET.SubElement(issue_mods, "mods:note", type="noteAboutReproduction").text = (
+        "Present"
+    )
+
+    file_sec = ET.SubElement(mets, "fileSec")
+    struct_map = ET.SubElement(mets, "structMap")
+    issue_div = ET.SubElement(struct_map, "div", TYPE="np:issue", DMDID="issueModsBib")
+    amd_sec = ET.SubElement(mets, "amdSec")
+
+    for page in pages:
+        n = page.sequence
+        stem = f"{n:04d}"
+        file_grp = ET.SubElement(file_sec, "fileGrp")
+        page_div = ET.SubElement(
+            issue_div, "div", TYPE="np:page", DMDID=f"pageModsBib{n}"
+        )
+        for use, file_id, filename in (
+            ("service", f"serviceFile{n}", f"{stem}.jp2"),
+            ("master", f"masterFile{n}", f"{stem}.tif"),
+            ("ocr", f"ocrFile{n}", f"{stem}.xml"),
+        ):
+            file_el = ET.SubElement(file_grp, "file", ID=file_id, USE=use)
+            ET.SubElement(
+                file_el,
+                "FLocat",
+                {
+                    "LOCTYPE": "OTHER",
+                    "OTHERLOCTYPE": "file",
+                    "xlink:href": f"./{filename}",
+                },
+            )
+            ET.SubElement(page_div, "fptr", FILEID=file_id)
+            if use != "ocr":
+                file_el.set("ADMID", f"mix{file_id}")
+                image_metadata(amd_sec, f"mix{file_id}", page)
+
+        page_mods = mods_section(mets, f"pageModsBib{n}", "Page metadata")
+        extent = ET.SubElement(
+            ET.SubElement(page_mods, "mods:part"), "mods:extent", unit="pages"
+        )
+        ET.SubElement(extent, "mods:start").text = str(n)
+        original = ET.SubElement(page_mods, "mods:relatedItem", type="original")
+        ET.SubElement(
+            ET.SubElement(original, "mods:physicalDescription"),
+            "mods:form",
+            type="microfilm",
+        )
+        ET.SubElement(original, "mods:identifier", type="reel number").text = reel
+        ET.SubElement(page_mods, "mods:note", type="noteAboutReproduction").text = (
+            "Present"
+        )
+
+    tree = ET.ElementTree(mets)
+    ET.indent(tree, "\t")
+    with atomic_output(mets_path) as tmp_path:
+        tree.write(tmp_path, encoding="utf-8", xml_declaration=True)
+
+
+def write_batch_xml(
+    data_dir: Path,
+    batch_name: str,
+    awardee: str,
+    lccn: str,
+    issue_folders: Dict[str, Path],
+) -> None:
+    batch = ET.Element("batch")
+    batch.set("xmlns", "http://www.loc.gov/ndnp")
+    batch.set("name", batch_name)
+    batch.set("awardee", awardee)
+    batch.set("awardYear", min(issue_folders)[:4])
+    for date, issue_folder in sorted(issue_folders.items()):
+        mets_path = issue_folder / f"{issue_folder.name}.xml"
+        issue = ET.SubElement(
+            batch, "issue", editionOrder=EDITION, issueDate=date, lccn=lccn
+        )
+        issue.text = f"./{mets_path.relative_to(data_dir)}"
+    tree = ET.ElementTree(batch)
+    ET.indent(tree, "\t")
+    with atomic_output(data_dir / "batch.xml") as tmp_path:
+        tree.write(tmp_path, encoding="utf-8", xml_declaration=True)
+
+
+def mods_section(mets: ET.Element, dmd_id: str, label: str) -> ET.Element:
+    """Add a dmdSec with the given ID to `mets` and return its (empty) mods:mods element"""
+    dmd_sec = ET.SubElement(mets, "dmdSec", ID=dmd_id)
+    md_wrap = ET.SubElement(dmd_sec, "mdWrap", LABEL=label, MDTYPE="MODS")
+    xml_data = ET.SubElement(md_wrap, "xmlData")
+    return ET.SubElement(xml_data, "mods:mods")
+
+
+def image_metadata(amd_sec: ET.Element, admid: str, page: PageInfo) -> None:
+    """Add the techMD with the image size, which Open ONI reads for the JP2 dimensions"""
+    tech_md = ET.SubElement(amd_sec, "techMD", ID=admid)
+    md_wrap = ET.SubElement(tech_md, "mdWrap", MDTYPE="NISOIMG")
+    mix = ET.SubElement(ET.SubElement(md_wrap, "xmlData"), "mix:mix")
+    metrics = ET.SubElement(
+        ET.SubElement(mix, "mix:ImagingPerformanceAssessment"),
+        "mix:SpatialMetrics",
+    )
+    ET.SubElement(metrics, "mix:ImageWidth").text = str(page.width)
+    ET.SubElement(metrics, "mix:ImageLength").text = str(page.height)
@@ -6,69 +6,279 @@ import pymupdf
 import sys
 from PIL import Image
 import io
+import hashlib
 import logging
+import math
+from typing import Any, Dict, Optional
 import numpy as np
 from jdeskew.estimator import get_angle
 from jdeskew.utility import rotate
+from state import (
+    DEFAULT_SETTINGS,
+    file_sha256,
+    is_page_up_to_date,
+    issue_state,
+    is_pdf_up_to_date,
+    page_settings,
+    pdf_fingerprint,
+    read_state,
+    write_state,
+)
 
 
-def extract_images(input_pdf: Path, output_dir: Path, force: bool = False):
+def extract_images(
+    input_pdf: Path,
+    output_dir: Path,
+    force: bool = False,
+    deskew_max_size: int = 0,
+    min_skew_angle: float = 0.0,
+    passthrough: bool = False,
+):
     """
     Extract images from a PDF file, rotate them 180 degrees, deskew, and save them in grayscale.
 
     input_pdf: Path to the input PDF file
     output_dir: Directory to save the output images
+    deskew_max_size, min_skew_angle, passthrough: See `extract_page`
     """
     output_dir.mkdir(parents=True, exist_ok=True)
 
+    state = read_state(output_dir)
+    fingerprint = pdf_fingerprint(input_pdf, state.get("pdf"))
+    settings = page_settings(
+        deskew_max_size=deskew_max_size,
+        min_skew_angle=min_skew_angle,
+        passthrough=passthrough,
+    )
+    if not force and is_pdf_up_to_date(state, fingerprint, output_dir, settings):
+        logging.info(f"Skipping {input_pdf}, all pages are up to date")
+        return
+
     try:
         doc = pymupdf.open(input_pdf)
     except Exception as e:
         logging.error(f"Failed to open PDF file: {input_pdf}. Error: {e}")
         return
 
-    for page_num, page in enumerate(doc, start=1):
-        image_list = page.get_images()
-
-        if len(image_list) != 1:
-            raise ValueError(
-                f"Page {page_num:02d} has {len(image_list)} images. Expected 1 image per page."
+    previous_pages = state.get("pages", {})
+    pages = {}
+    try:
+        for page_num in range(1, doc.page_count + 1):
+            key = f"{page_num:02d}"
+            pages[key] = extract_page(
+                doc,
+                page_num,
+                output_dir,
+                force,
+                deskew_max_size=deskew_max_size,
+                min_skew_angle=min_skew_angle,
+                passthrough=passthrough,
+                previous=previous_pages.get(key),
             )
+        report_passthrough(input_pdf, pages)
+    finally:
+        write_state(
+            output_dir,
+            issue_state(fingerprint, doc.page_count, previous_pages, pages),
+        )
+        doc.close()
+    logging.info(
+        f"PDF image extraction, rotation, deskewing, and grayscale conversion completed."
+    )
 
-        for img_index, img in enumerate(image_list, start=1):
-            xref = img[0]
-            base_image = doc.extract_image(xref)
 
-            output_path = output_dir / f'page_{page_num:02d}.{base_image["ext"]}'
+def extract_page(
+    doc: pymupdf.Document,
+    page_num: int,
+    output_dir: Path,
+    force: bool = False,
+    deskew_max_size: int = 0,
+    min_skew_angle: float = 0.0,
+    passthrough: bool = False,
+    previous: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Extract the image of a single page of an open PDF document, rotate, deskew and
+    save it in grayscale as `page_NN.<ext>` inside `output_dir`.
+    Returns the entry for the page in the state file (see state.py).
 
-            if not force and output_path.exists():
-                logging.info(
-                    f"Skipping page {page_num:02d}, file already exists: {output_path}"
-                )
-                continue
-            image_bytes = base_image.pop("image")
+    doc: The open PDF document
+    page_num: 1-based page number
+    output_dir: Directory to save the output image
+    deskew_max_size: Estimate the skew angle on a copy of the page whose longest side
+                     is at most this many pixels. 0 means full resolution.
+    min_skew_angle: Do not deskew pages whose skew angle (in degrees) is smaller than this
+    passthrough: Write the embedded image bytes as they are when it is a grayscale JPEG
+                 on an unrotated page that needs no deskewing (see `needs_deskew`)
+    previous: The entry for the page in the state file of a previous run, if any.
+              The page is skipped if its source image and settings did not change.
+    """
+    page = doc[page_num - 1]
+    image_list = page.get_images()
 
-            img = Image.open(io.BytesIO(image_bytes))
-            if page.rotation:
-                img = img.rotate(page.rotation)
-            img = img.convert("L")
+    if len(image_list) != 1:
+        raise ValueError(
+            f"Page {page_num:02d} has {len(image_list)} images. Expected 1 image per page."
+        )
 
-            # Deskew
-            img_array = np.array(img)
-            angle = get_angle(img_array)
-            img_array = rotate(img_array, angle)
-            img = Image.fromarray(img_array)
+    xref = image_list[0][0]
+    base_image = doc.extract_image(xref)
 
-            img.save(output_path)
+    output_path = output_dir / f'page_{page_num:02d}.{base_image["ext"]}'
+    image_bytes = base_image.pop("image")
 
+    settings = page_settings(
+        deskew_max_size=deskew_max_size,
+        min_skew_angle=min_skew_angle,
+        passthrough=passthrough,
+    )
+    page_state = {
+        "output": output_path.name,
+        "source_sha256": hashlib.sha256(image_bytes).hexdigest(),
+        "rotation": page.rotation,
+    }
+    if not force:
+        if is_page_up_to_date(
+            previous, output_dir, page_state["source_sha256"], page.rotation, settings
+        ):
+            logging.info(f"Skipping page {page_num:02d}, up to date: {output_path}")
+            return previous
+        # Outputs that predate the state file are only kept with the default settings
+        if previous is None and output_path.exists() and settings == DEFAULT_SETTINGS:
             logging.info(
-                f"Extracted, processed, and deskewed page {page_num:02d} as {output_path} (skew angle: {angle:.2f} degrees)"
+                f"Skipping page {page_num:02d}, file already exists: {output_path}"
+            )
+            return dict(
+                page_state,
+                settings=None,
+                skew_angle=None,
+                output_sha256=file_sha256(output_path),
             )
 
-    doc.close()
+    img = Image.open(io.BytesIO(image_bytes))
+    page_img = None
+    if deskew_max_size:
+        angle = estimate_page_skew(image_bytes, page.rotation, deskew_max_size)
+    else:
+        # Decoded once, for both the estimate and the output
+        page_img = grayscale_page(img, page.rotation)
+        angle = estimate_skew(page_img)
+    deskew = needs_deskew(angle, min_skew_angle)
+    if passthrough and not deskew and can_pass_through(base_image, img, page.rotation):
+        output_path.write_bytes(image_bytes)
+        logging.info(
+            f"Wrote page {page_num:02d} as {output_path} without re-encoding (skew angle: {angle:.2f} degrees)"
+        )
+        return dict(
+            page_state,
+            settings=settings,
+            skew_angle=angle,
+            passthrough=True,
+            output_sha256=page_state["source_sha256"],
+        )
+
+    if page_img is None:
+        page_img = grayscale_page(img, page.rotation)
+
+    # Deskew
+    if deskew:
+        page_img = Image.fromarray(rotate(np.array(page_img), angle))
+    else:
+        logging.debug(f"Page {page_num:02d}: skew angle {angle:.2f} below threshold")
+
+    page_img.save(output_path)
+
     logging.info(
-        f"PDF image extraction, rotation, deskewing, and grayscale conversion completed."
+        f"Extracted, processed, and deskewed page {page_num:02d} as {output_path} (skew angle: {angle:.2f} degrees)"
     )
+    return dict(
+        page_state,
+        settings=settings,
+        skew_angle=angle,
+        passthrough=False,
+        output_sha256=file_sha256(output_path),
+    )
+
+
+def can_pass_through(base_image: Dict[str, Any], img: Image.Image, rotation: int):
+    """Tell whether an embedded image is already a grayscale JPEG that needs no rotation"""
+    return base_image["ext"] == "jpeg" and img.mode == "L" and not rotation
+
+
+def report_passthrough(pdf_file: Path, pages: Dict[str, Dict[str, Any]]) -> None:
+    """Log which pages of `pdf_file` were written without re-encoding"""
+    fast_pages = sorted(key for key, page in pages.items() if page.get("passthrough"))
+    if fast_pages:
+        logging.info(
+            f"{pdf_file.name}: {len(fast_pages)} of {len(pages)} pages written without re-encoding ({', '.join(fast_pages)})"
+        )
+
+
+def needs_deskew(angle: float, min_skew_angle: float) -> bool:
+    """Pages are deskewed unless their skew angle is 0 or below `min_skew_angle`"""
+    return angle != 0 and abs(angle) >= min_skew_angle
+
+
+def grayscale_page(img: Image.Image, rotation: int) -> Image.Image:
+    """The embedded image of a page, rotated by `rotation` and converted to grayscale"""
+    if rotation:
+        img = img.rotate(rotation)
+    return img.convert("L")
+
+
+def estimate_page_skew(image_bytes: bytes, rotation: int, max_size: int) -> float:
+    """
+    Estimate the skew angle of an embedded page image, once rotated by `rotation`,
+    at most `max_size` pixels on its longest side.
+
+    JPEG images are decoded directly at a reduced scale, so pages written as they
+    are never get decoded in full. Re-encoded pages use the same estimate, so the
+    angle does not depend on whether a page is passed through.
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    longest = max(img.size)
+    img.draft("L", (img.width * max_size // longest, img.height * max_size // longest))
+    return estimate_skew(grayscale_page(img, rotation), max_size)
+
+
+def estimate_skew(img: Image.Image, max_size: int = 0) -> float:
+    """
+    Estimate the skew angle (in degrees) of a grayscale image.
+
+    The angle does not depend on the resolution, so when `max_size` is set the estimate
+    is computed on a copy reduced by an integer factor until its longest side is at most
+    `max_size` pixels. This is much cheaper than running jdeskew on the full page.
+    """
+    if max_size and max(img.size) > max_size:
+        img = img.reduce(math.ceil(max(img.size) / max_size))
+    return get_angle(np.array(img))
+
+
+def page_options(function):
+    """Click options controlling how pages are processed, shared with directory.py"""
+    function = click.option(
+        "--passthrough",
+        is_flag=True,
+        help="Write grayscale JPEG pages that need no rotation nor deskewing (skew angle "
+        "0 or below --min-skew-angle) as they are embedded in the PDF, without "
+        "re-encoding them",
+    )(function)
+    function = click.option(
+        "--min-skew-angle",
+        type=click.FloatRange(min=0),
+        default=0.0,
+        show_default=True,
+        help="Do not rotate pages whose skew angle (in degrees) is below this value",
+    )(function)
+    function = click.option(
+        "--deskew-max-size",
+        type=click.IntRange(min=0),
+        default=0,
+        show_default=True,
+        help="Estimate the skew angle on a copy downscaled to at most this many pixels "
+        "on the longest side (e.g. 1500). 0 uses the full resolution",
+    )(function)
+    return function
 
 
 @click.command()
@@ -81,8 +291,15 @@ def extract_images(input_pdf: Path, output_dir: Path, force: bool = False):
     help="Set the logging level",
 )
 @click.option("--force", is_flag=True, help="Overwrite existing files")
+@page_options
 def cli_extract_images(
-    input_pdf: Path, output_dir: Path, log_level: str, force: bool = False
+    input_pdf: Path,
+    output_dir: Path,
+    log_level: str,
+    force: bool = False,
+    deskew_max_size: int = 0,
+    min_skew_angle: float = 0.0,
+    passthrough: bool = False,
 ):
     """
     Command-line interface for extracting images from a PDF file.
@@ -93,7 +310,9 @@ def cli_extract_images(
     logging.basicConfig(
         level=log_level, format="%(asctime)s - %(levelname)s - %(message)s"
     )
-    extract_images(input_pdf, output_dir, force)
+    extract_images(
+        input_pdf, output_dir, force, deskew_max_size, min_skew_angle, passthrough
+    )
 
 
 if __name__ == "__main__":
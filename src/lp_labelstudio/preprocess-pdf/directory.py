@@ -3,7 +3,22 @@
 import click
 from pathlib import Path
 import logging
-from cli import extract_images
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import pymupdf
+from cli import extract_page, page_options, report_passthrough
+from lp_labelstudio.utils import run_tasks
+from state import (
+    is_pdf_up_to_date,
+    issue_state,
+    page_settings,
+    pdf_fingerprint,
+    read_state,
+    write_state,
+)
+
+# (pdf_file, page_num, keyword arguments for extract_page)
+PageTask = Tuple[Path, int, Dict[str, Any]]
 
 
 @click.command()
@@ -16,8 +31,23 @@ from cli import extract_images
     help="Set the logging level",
 )
 @click.option("--force", is_flag=True, help="Overwrite existing files")
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of worker processes. Pages of all PDFs are spread across them",
+)
+@page_options
 def process_directory(
-    input_dir: Path, output_dir: Path, log_level: str, force: bool = False
+    input_dir: Path,
+    output_dir: Path,
+    log_level: str,
+    force: bool = False,
+    workers: int = 1,
+    deskew_max_size: int = 0,
+    min_skew_angle: float = 0.0,
+    passthrough: bool = False,
 ):
     """
     Process all PDF files in the input directory and extract images to corresponding output directories.
@@ -29,20 +59,127 @@ def process_directory(
         level=log_level, format="%(asctime)s - %(levelname)s - %(message)s"
     )
 
-    pdf_files = list(input_dir.glob("*.pdf"))
+    pdf_files = sorted(input_dir.glob("*.pdf"))
     if not pdf_files:
         logging.warning(f"No PDF files found in {input_dir}")
         return
 
-    for pdf_file in pdf_files:
-        pdf_name = pdf_file.stem
-        pdf_output_dir = output_dir / pdf_name
+    failures: Dict[Path, List[str]] = defaultdict(list)
+    issues: Dict[Path, Dict[str, Any]] = {}
+    options = dict(
+        deskew_max_size=deskew_max_size,
+        min_skew_angle=min_skew_angle,
+        passthrough=passthrough,
+    )
+    # Every page is a separate task, so a single long issue does not keep one core busy
+    # while the others are idle. Tasks are generated as workers become free, which
+    # bounds the number of decoded pages held in memory.
+    tasks = iter_page_tasks(pdf_files, output_dir, force, options, failures, issues)
+    for task, error, page_state in run_tasks(extract_page_task, tasks, workers):
+        record_result(task, error, page_state, failures, issues)
 
-        logging.info(f"Processing {pdf_file}")
-        extract_images(pdf_file, pdf_output_dir, force)
+    if failures:
+        logging.error(f"{len(failures)} of {len(pdf_files)} PDF files had errors:")
+        for pdf_file in sorted(failures):
+            for error in failures[pdf_file]:
+                logging.error(f"  {pdf_file.name}: {error}")
+        raise click.ClickException(f"{len(failures)} PDF files could not be processed")
 
     logging.info("All PDF files processed.")
 
 
+def iter_page_tasks(
+    pdf_files: List[Path],
+    output_dir: Path,
+    force: bool,
+    options: Dict[str, Any],
+    failures: Dict[Path, List[str]],
+    issues: Dict[Path, Dict[str, Any]],
+) -> Iterator[PageTask]:
+    """
+    Yield one task per page that needs processing, in order.
+
+    PDFs whose pages are all up to date according to their state file are skipped
+    without being opened. For the others, the state to be written once all their pages
+    are done is registered in `issues`.
+    """
+    settings = page_settings(**options)
+    for pdf_file in pdf_files:
+        pdf_output_dir = output_dir / pdf_file.stem
+        state = read_state(pdf_output_dir)
+        fingerprint = pdf_fingerprint(pdf_file, state.get("pdf"))
+        if not force and is_pdf_up_to_date(
+            state, fingerprint, pdf_output_dir, settings
+        ):
+            logging.info(f"Skipping {pdf_file}, all pages are up to date")
+            continue
+        try:
+            with pymupdf.open(pdf_file) as doc:
+                page_count = doc.page_count
+        except Exception as e:
+            logging.error(f"Failed to open PDF file: {pdf_file}. Error: {e}")
+            failures[pdf_file].append(str(e))
+            continue
+        pdf_output_dir.mkdir(parents=True, exist_ok=True)
+        previous_pages = state.get("pages", {})
+        issues[pdf_file] = {
+            "output_dir": pdf_output_dir,
+            "remaining": page_count,
+            "fingerprint": fingerprint,
+            "page_count": page_count,
+            "previous_pages": previous_pages,
+            "pages": {},
+        }
+        logging.info(f"Queueing {page_count} pages of {pdf_file}")
+        for page_num in range(1, page_count + 1):
+            yield pdf_file, page_num, dict(
+                options,
+                output_dir=pdf_output_dir,
+                force=force,
+                previous=previous_pages.get(f"{page_num:02d}"),
+            )
+
+
+def extract_page_task(task: PageTask) -> Dict[str, Any]:
+    pdf_file, page_num, kwargs = task
+    with pymupdf.open(pdf_file) as doc:
+        return extract_page(doc, page_num, **kwargs)
+
+
+def record_result(
+    task: PageTask,
+    error: Optional[str],
+    page_state: Optional[Dict[str, Any]],
+    failures: Dict[Path, List[str]],
+    issues: Dict[Path, Dict[str, Any]],
+) -> None:
+    """
+    Record the outcome of a page, and write the state file of its PDF once all of its
+    pages are done. Failed pages keep their previous entry, and the state is marked
+    incomplete so they are retried next time.
+    """
+    pdf_file, page_num, _ = task
+    if error:
+        logging.error(f"Failed to process page {page_num:02d} of {pdf_file}: {error}")
+        failures[pdf_file].append(f"page {page_num:02d}: {error}")
+
+    issue = issues[pdf_file]
+    if page_state:
+        issue["pages"][f"{page_num:02d}"] = page_state
+    issue["remaining"] -= 1
+    if not issue["remaining"]:
+        report_passthrough(pdf_file, issue["pages"])
+        write_state(
+            issue["output_dir"],
+            issue_state(
+                issue["fingerprint"],
+                issue["page_count"],
+                issue["previous_pages"],
+                issue["pages"],
+            ),
+        )
+        del issues[pdf_file]
+
+
 if __name__ == "__main__":
     process_directory()
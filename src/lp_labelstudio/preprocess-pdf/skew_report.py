@@ -0,0 +1,65 @@
+#!/bin/env python
+
+import click
+from pathlib import Path
+from statistics import mean
+import time
+from typing import List, Tuple
+from PIL import Image
+from cli import estimate_skew
+
+
+@click.command()
+@click.argument(
+    "images", nargs=-1, required=True, type=click.Path(exists=True, path_type=Path)
+)
+@click.option(
+    "--max-size",
+    "max_sizes",
+    type=click.IntRange(min=1),
+    multiple=True,
+    default=[1000, 1500, 2000],
+    show_default=True,
+    help="Longest side of the downscaled copy used for estimation. Can be repeated",
+)
+def skew_report(images: Tuple[Path, ...], max_sizes: Tuple[int, ...]):
+    """
+    Compare skew angles estimated on downscaled copies against full-resolution estimation.
+
+    IMAGES: Sample page images. Use images that have not been deskewed yet,
+    e.g. extracted from the original PDFs
+    """
+    # (max_size, absolute angle difference, seconds) for every page and size
+    samples: List[Tuple[int, float, float]] = []
+    full_times: List[float] = []
+
+    for image_path in images:
+        with Image.open(image_path) as img:
+            img = img.convert("L")
+            start = time.perf_counter()
+            reference = estimate_skew(img)
+            full_times.append(time.perf_counter() - start)
+            line = f"{image_path.name}: full {reference:+.2f}°"
+
+            for max_size in max_sizes:
+                start = time.perf_counter()
+                angle = estimate_skew(img, max_size)
+                samples.append(
+                    (max_size, abs(angle - reference), time.perf_counter() - start)
+                )
+                line += f", {max_size}px {angle:+.2f}°"
+        click.echo(line)
+
+    click.echo(f"\nfull resolution: {mean(full_times):.3f}s per page")
+    for max_size in max_sizes:
+        diffs = [diff for size, diff, _ in samples if size == max_size]
+        times = [seconds for size, _, seconds in samples if size == max_size]
+        click.echo(
+            f"{max_size}px: {mean(times):.3f}s per page "
+            f"({mean(full_times) / mean(times):.1f}x faster), "
+            f"angle difference mean {mean(diffs):.3f}° max {max(diffs):.3f}°"
+        )
+
+
+if __name__ == "__main__":
+    skew_report()
@@ -0,0 +1,178 @@
+"""
+Per-issue state file used to make preprocessing incremental.
+
+Every output directory gets a `.preprocess-state.json` file recording the PDF it was
+extracted from and, for every page, the parameters used to produce it:
+
+{
+    "pdf": {"name": "...", "size": 123, "mtime": 1700000000.0, "sha256": "..."},
+    "page_count": 12,
+    "pages": {
+        "01": {
+            "output": "page_01.jpeg",
+            "source_sha256": "...",     # hash of the embedded image
+            "rotation": 180,
+            "settings": {"version": 1, "deskew_max_size": 0, ...},
+            "skew_angle": 0.32,
+            "output_sha256": "...",
+        }
+    }
+}
+
+Pages extracted before the state file existed are recorded with `"settings": null`.
+They are assumed to have been extracted with the default settings, and are kept as
+they are until they are run with other settings or with `--force`.
+
+When some pages could not be processed, their entries from the previous state are
+kept and the state is marked `"incomplete": true`, so that the PDF is opened again
+next time and every page is checked.
+"""
+
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, Optional
+from lp_labelstudio.utils import write_atomically
+
+STATE_FILENAME = ".preprocess-state.json"
+
+TOOL_VERSION = 1
+
+
+def read_state(output_dir: Path) -> Dict[str, Any]:
+    state_path = output_dir / STATE_FILENAME
+    if not state_path.exists():
+        return {}
+    try:
+        return json.loads(state_path.read_text())
+    except ValueError as e:
+        logging.warning(f"Ignoring unreadable state file {state_path}: {e}")
+        return {}
+
+
+def write_state(output_dir: Path, state: Dict[str, Any]) -> None:
+    write_atomically(
+        output_dir / STATE_FILENAME, json.dumps(state, indent=2, sort_keys=True)
+    )
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def pdf_fingerprint(
+    pdf_file: Path, previous: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Return name, size, mtime and content hash of `pdf_file`.
+    The hash of `previous` is reused when size and mtime did not change.
+    """
+    stat = pdf_file.stat()
+    fingerprint = {"name": pdf_file.name, "size": stat.st_size, "mtime": stat.st_mtime}
+    if (
+        previous
+        and previous.get("size") == stat.st_size
+        and previous.get("mtime") == stat.st_mtime
+    ):
+        fingerprint["sha256"] = previous["sha256"]
+    else:
+        fingerprint["sha256"] = file_sha256(pdf_file)
+    return fingerprint
+
+
+def page_settings(**settings) -> Dict[str, Any]:
+    """The settings that, together with the source image, determine a page's output"""
+    return dict(settings, version=TOOL_VERSION)
+
+
+DEFAULT_SETTINGS = page_settings(
+    deskew_max_size=0, min_skew_angle=0.0, passthrough=False
+)
+
+
+def settings_match(stored: Optional[Dict[str, Any]], settings: Dict[str, Any]) -> bool:
+    """Pages without stored settings predate the state file and used the defaults"""
+    if stored is None:
+        return settings == DEFAULT_SETTINGS
+    return stored == settings
+
+
+def merge_pages(
+    previous: Dict[str, Dict[str, Any]],
+    processed: Dict[str, Dict[str, Any]],
+    page_count: int,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    The page entries of the new state: the processed pages, and the previous entries
+    of the pages that failed or were not reached
+    """
+    pages = {}
+    for page_num in range(1, page_count + 1):
+        key = f"{page_num:02d}"
+        entry = processed.get(key, previous.get(key))
+        if entry is not None:
+            pages[key] = entry
+    return pages
+
+
+def issue_state(
+    fingerprint: Dict[str, Any],
+    page_count: int,
+    previous_pages: Dict[str, Dict[str, Any]],
+    processed: Dict[str, Dict[str, Any]],
+) -> Dict[str, Any]:
+    state = {
+        "pdf": fingerprint,
+        "page_count": page_count,
+        "pages": merge_pages(previous_pages, processed, page_count),
+    }
+    if len(processed) != page_count:
+        state["incomplete"] = True
+    return state
+
+
+def is_page_up_to_date(
+    previous: Optional[Dict[str, Any]],
+    output_dir: Path,
+    source_sha256: str,
+    rotation: int,
+    settings: Dict[str, Any],
+) -> bool:
+    if not previous or not (output_dir / previous["output"]).exists():
+        return False
+    return (
+        previous["source_sha256"] == source_sha256
+        and previous["rotation"] == rotation
+        and settings_match(previous["settings"], settings)
+    )
+
+
+def is_pdf_up_to_date(
+    state: Dict[str, Any],
+    fingerprint: Dict[str, Any],
+    output_dir: Path,
+    settings: Dict[str, Any],
+) -> bool:
+    """
+    Tell whether every page of the PDF described by `fingerprint` has already been
+    extracted with `settings`, so that the PDF does not even need to be opened.
+    """
+    if (
+        not state
+        or state.get("incomplete")
+        or state["pdf"]["sha256"] != fingerprint["sha256"]
+    ):
+        return False
+    pages = state.get("pages", {})
+    if len(pages) != state.get("page_count"):
+        return False
+    return all(
+        settings_match(page["settings"], settings)
+        and (output_dir / page["output"]).exists()
+        for page in pages.values()
+    )
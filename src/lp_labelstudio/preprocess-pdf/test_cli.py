@@ -0,0 +1,64 @@
+import io
+import json
+import pymupdf
+from PIL import Image, ImageDraw
+import cli
+from cli import extract_images
+from state import STATE_FILENAME
+
+
+def write_pdf(path, img):
+    jpeg = io.BytesIO()
+    img.save(jpeg, "JPEG")
+    doc = pymupdf.open()
+    page = doc.new_page(width=img.width, height=img.height)
+    page.insert_image(page.rect, stream=jpeg.getvalue())
+    doc.save(path)
+    doc.close()
+
+
+def skewed_page(angle):
+    img = Image.new("L", (800, 1200), 255)
+    draw = ImageDraw.Draw(img)
+    for y in range(100, 1100, 40):
+        draw.rectangle((100, y, 700, y + 12), fill=0)
+    return img.rotate(angle, fillcolor=255)
+
+
+def extracted_page(tmp_path, pdf, **options):
+    output_dir = tmp_path / f"out-{len(list(tmp_path.iterdir()))}"
+    extract_images(pdf, output_dir, **options)
+    return json.loads((output_dir / STATE_FILENAME).read_text())["pages"]["01"]
+
+
+def test_passthrough_alone_writes_unskewed_pages(tmp_path):
+    write_pdf(tmp_path / "issue.pdf", Image.new("L", (800, 1200), 255))
+    page = extracted_page(tmp_path, tmp_path / "issue.pdf", passthrough=True)
+    assert page["skew_angle"] == 0
+    assert page["passthrough"]
+
+
+def test_skew_angle_does_not_depend_on_passthrough(tmp_path):
+    write_pdf(tmp_path / "issue.pdf", skewed_page(2))
+    options = dict(deskew_max_size=300, min_skew_angle=5)
+    reencoded = extracted_page(tmp_path, tmp_path / "issue.pdf", **options)
+    passed = extracted_page(
+        tmp_path, tmp_path / "issue.pdf", passthrough=True, **options
+    )
+    assert passed["passthrough"] and not reencoded["passthrough"]
+    assert passed["skew_angle"] == reencoded["skew_angle"] != 0
+
+
+def test_reencoded_pages_are_decoded_once(tmp_path, monkeypatch):
+    write_pdf(tmp_path / "issue.pdf", skewed_page(2))
+    decoded = []
+
+    def grayscale_page(img, rotation):
+        decoded.append(img.size)
+        return original(img, rotation)
+
+    original = cli.grayscale_page
+    monkeypatch.setattr(cli, "grayscale_page", grayscale_page)
+    page = extracted_page(tmp_path, tmp_path / "issue.pdf")
+    assert not page["passthrough"] and page["skew_angle"] != 0
+    assert decoded == [(800, 1200)]
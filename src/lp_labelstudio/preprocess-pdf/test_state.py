@@ -0,0 +1,114 @@
+import io
+import json
+import pymupdf
+import pytest
+from PIL import Image
+from cli import extract_images
+from state import (
+    DEFAULT_SETTINGS,
+    STATE_FILENAME,
+    issue_state,
+    is_page_up_to_date,
+    is_pdf_up_to_date,
+    page_settings,
+)
+
+SETTINGS = page_settings(deskew_max_size=1500, min_skew_angle=0.1, passthrough=False)
+FINGERPRINT = {"name": "issue.pdf", "size": 1, "mtime": 1.0, "sha256": "pdf"}
+
+
+def page_entry(output, source_sha256="source", settings=SETTINGS):
+    return {
+        "output": output,
+        "source_sha256": source_sha256,
+        "rotation": 0,
+        "settings": settings,
+    }
+
+
+@pytest.fixture
+def output_dir(tmp_path):
+    for name in ("page_01.jpeg", "page_02.jpeg"):
+        (tmp_path / name).write_bytes(b"")
+    return tmp_path
+
+
+def test_up_to_date(output_dir):
+    previous = page_entry("page_01.jpeg")
+    assert is_page_up_to_date(previous, output_dir, "source", 0, SETTINGS)
+    state = issue_state(
+        FINGERPRINT, 2, {}, {"01": previous, "02": page_entry("page_02.jpeg")}
+    )
+    assert is_pdf_up_to_date(state, FINGERPRINT, output_dir, SETTINGS)
+    (output_dir / "page_02.jpeg").unlink()
+    assert not is_pdf_up_to_date(state, FINGERPRINT, output_dir, SETTINGS)
+
+
+def test_settings_change(output_dir):
+    previous = page_entry("page_01.jpeg")
+    other = dict(SETTINGS, min_skew_angle=0.5)
+    assert not is_page_up_to_date(previous, output_dir, "source", 0, other)
+    state = issue_state(FINGERPRINT, 1, {}, {"01": previous})
+    assert not is_pdf_up_to_date(state, FINGERPRINT, output_dir, other)
+
+    # Pages that predate the state file only match the default settings
+    legacy = page_entry("page_01.jpeg", settings=None)
+    assert is_page_up_to_date(legacy, output_dir, "source", 0, DEFAULT_SETTINGS)
+    assert not is_page_up_to_date(legacy, output_dir, "source", 0, SETTINGS)
+
+
+def test_source_change(output_dir):
+    previous = page_entry("page_01.jpeg")
+    assert not is_page_up_to_date(previous, output_dir, "changed", 0, SETTINGS)
+    assert not is_page_up_to_date(previous, output_dir, "source", 180, SETTINGS)
+    state = issue_state(FINGERPRINT, 1, {}, {"01": previous})
+    changed = dict(FINGERPRINT, sha256="changed")
+    assert not is_pdf_up_to_date(state, changed, output_dir, SETTINGS)
+
+
+def test_partial_failure_keeps_the_previous_entries(output_dir):
+    previous_pages = {
+        "01": page_entry("page_01.jpeg", "old"),
+        "02": page_entry("page_02.jpeg", "old"),
+        "03": page_entry("page_03.jpeg", "old"),
+    }
+    processed = {"01": page_entry("page_01.jpeg", "new")}
+    state = issue_state(FINGERPRINT, 2, previous_pages, processed)
+    assert state["pages"] == {"01": processed["01"], "02": previous_pages["02"]}
+    assert state["incomplete"]
+    assert not is_pdf_up_to_date(state, FINGERPRINT, output_dir, SETTINGS)
+    assert "incomplete" not in issue_state(FINGERPRINT, 1, previous_pages, processed)
+
+
+def write_pdf(path, images_per_page):
+    jpeg = io.BytesIO()
+    Image.new("L", (200, 300), 255).save(jpeg, "JPEG")
+    doc = pymupdf.open()
+    for count in images_per_page:
+        page = doc.new_page(width=200, height=300)
+        for i in range(count):
+            page.insert_image(pymupdf.Rect(0, i * 10, 200, 300), stream=jpeg.getvalue())
+    doc.save(path)
+    doc.close()
+
+
+def test_failed_run_does_not_grandfather_pages(tmp_path):
+    pdf, output_dir = tmp_path / "issue.pdf", tmp_path / "issue"
+    write_pdf(pdf, [1, 1])
+    extract_images(pdf, output_dir)
+    first = json.loads((output_dir / STATE_FILENAME).read_text())
+    assert first["pages"]["02"]["settings"] == DEFAULT_SETTINGS
+
+    # The first page now fails, before the second one is reached
+    write_pdf(pdf, [2, 1])
+    with pytest.raises(ValueError):
+        extract_images(pdf, output_dir, min_skew_angle=0.5)
+    state = json.loads((output_dir / STATE_FILENAME).read_text())
+    assert state["incomplete"]
+    assert state["pages"] == first["pages"]
+
+    write_pdf(pdf, [1, 1])
+    extract_images(pdf, output_dir, min_skew_angle=0.5)
+    state = json.loads((output_dir / STATE_FILENAME).read_text())
+    assert "incomplete" not in state
+    assert state["pages"]["02"]["settings"]["min_skew_angle"] == 0.5
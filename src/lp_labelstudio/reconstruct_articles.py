@@ -0,0 +1,169 @@
+"""
+Reconstruct the articles of every annotated page of the archive.
+
+Every issue directory with a `manifest.json` gets an `articles.json` file, written
+compactly, listing the articles of its pages in reading order:
+
+{
+    "version": 1,
+    "pages": {
+        "1": {
+            "annotations_sha256": "...",
+            "articles": [
+                [{"id": "...", "label": "Headline", "bbox": [x, y, width, height]}, ...],
+                ...
+            ]
+        }
+    }
+}
+
+Bounding boxes are in percentages of the page, like in Label Studio. Pages whose
+annotations did not change since the last run, according to `annotations_sha256`,
+are not reconstructed again.
+"""
+
+import click
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List
+from lp_labelstudio.article_reconstruction import ArticleReconstructor
+from lp_labelstudio.utils import run_tasks, write_atomically
+
+logger = logging.getLogger(__name__)
+
+ARTICLES_FILENAME = "articles.json"
+
+ARTICLES_VERSION = 1
+
+
+@dataclass
+class PageTask:
+    issue_dir: Path
+    page_number: int
+    results: List[Dict[str, Any]]
+
+
+@click.command(name="reconstruct-articles")
+@click.argument(
+    "source_folder",
+    type=click.Path(exists=True, file_okay=False, dir_okay=True, path_type=Path),
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=os.cpu_count(),
+    show_default=True,
+    help="Number of processes reconstructing the articles of the pages",
+)
+@click.option("--force", is_flag=True, help="Reconstruct pages that are up to date")
+def reconstruct_articles(source_folder: Path, workers: int, force: bool):
+    """
+    Reconstruct the articles of annotated pages and save them in an articles.json
+    file in every issue directory.
+
+    SOURCE_FOLDER: Folder searched recursively for issue directories with a manifest.json
+    """
+    issues: Dict[Path, Dict[str, Any]] = {}
+    tasks: List[PageTask] = []
+    for root, _, files in os.walk(source_folder):
+        if "manifest.json" not in files:
+            continue
+        issue_dir = Path(root)
+        manifest = json.loads((issue_dir / "manifest.json").read_text())
+        previous = read_articles(issue_dir) if not force else {}
+        pages = {}
+        for item in manifest:
+            results = latest_results(item)
+            if not results:
+                continue
+            page_number = item["data"]["pageNumber"]
+            digest = annotations_sha256(results)
+            known = previous.get(str(page_number))
+            if known and known["annotations_sha256"] == digest:
+                pages[str(page_number)] = known
+            else:
+                pages[str(page_number)] = {"annotations_sha256": digest}
+                tasks.append(PageTask(issue_dir, page_number, results))
+        if pages != previous or not (issue_dir / ARTICLES_FILENAME).exists():
+            issues[issue_dir] = pages
+
+    click.echo(f"Reconstructing articles of {len(tasks)} pages in {len(issues)} issues")
+    failures: List[str] = []
+    for task, error, articles in run_tasks(reconstruct_page_task, tasks, workers):
+        page = issues[task.issue_dir][str(task.page_number)]
+        if error:
+            failure = f"{task.issue_dir} page {task.page_number}: {error}"
+            logger.error(f"Failed to reconstruct {failure}")
+            failures.append(failure)
+            issues[task.issue_dir].pop(str(task.page_number))
+        else:
+            page["articles"] = articles
+
+    for issue_dir, pages in issues.items():
+        write_articles(issue_dir, pages)
+    click.echo(f"Articles written for {len(issues)} issues")
+    if failures:
+        raise click.ClickException(
+            f"{len(failures)} pages could not be processed:\n" + "\n".join(failures)
+        )
+
+
+def latest_results(item: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The results of the most recent annotation of a manifest item, if any"""
+    annotations = item.get("annotations") or []
+    return annotations[-1]["result"] if annotations else []
+
+
+def annotations_sha256(results: List[Dict[str, Any]]) -> str:
+    serialized = json.dumps(results, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+def read_articles(issue_dir: Path) -> Dict[str, Any]:
+    """The pages of the articles file of `issue_dir`, if it exists and is current"""
+    articles_path = issue_dir / ARTICLES_FILENAME
+    if not articles_path.exists():
+        return {}
+    try:
+        data = json.loads(articles_path.read_text())
+    except ValueError as e:
+        logger.warning(f"Ignoring unreadable articles file {articles_path}: {e}")
+        return {}
+    if data.get("version") != ARTICLES_VERSION:
+        return {}
+    return data["pages"]
+
+
+def write_articles(issue_dir: Path, pages: Dict[str, Any]) -> None:
+    data = {"version": ARTICLES_VERSION, "pages": pages}
+    write_atomically(
+        issue_dir / ARTICLES_FILENAME,
+        json.dumps(data, separators=(",", ":"), sort_keys=True),
+    )
+
+
+def reconstruct_page_task(task: PageTask) -> List[List[Dict[str, Any]]]:
+    return reconstruct_page(task.results)
+
+
+def reconstruct_page(results: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """The articles of a page, as lists of zones in reading order"""
+    reconstructor = ArticleReconstructor()
+    for result in results:
+        reconstructor.add_zone(result)
+    reconstructor.build_graph(vectorized=True, debug=False)
+    return [
+        [
+            {
+                "id": zone.id,
+                "label": zone.label,
+                "bbox": [zone.x, zone.y, zone.width, zone.height],
+            }
+            for zone in article
+        ]
+        for article in reconstructor.reconstruct_articles()
+    ]
@@ -0,0 +1,38 @@
+import io
+import xml.etree.ElementTree as ET
+import pytest
+from lp_labelstudio.alto_generator import (
+    create_alto_xml,
+    create_alto_xml_dom,
+    write_alto_xml,
+)
+
+OCR_RESULTS = [
+    ([1471, 933, 3195, 988], ("Il medico di Ugo", 0.93)),
+    ([10.5, 20, 30, 40], ('"Genova" & <dintorni>', 0.5)),
+    ([0, 0, 1, 1], ("Perché è già così", 0.999)),
+]
+
+
+@pytest.mark.parametrize("ocr_results", [OCR_RESULTS, []])
+def test_streaming_writer_matches_minidom(ocr_results):
+    assert create_alto_xml(2000, 3000, ocr_results) == create_alto_xml_dom(
+        2000, 3000, ocr_results
+    )
+
+
+def test_writer_accepts_generators():
+    out = io.StringIO()
+    write_alto_xml(out, 2000, 3000, (result for result in OCR_RESULTS))
+    assert out.getvalue() == create_alto_xml_dom(2000, 3000, OCR_RESULTS)
+
+
+def test_compact_output():
+    out = io.StringIO()
+    write_alto_xml(out, 2000, 3000, OCR_RESULTS, indent="")
+    compact = out.getvalue()
+    assert compact.count("\n") == 1  # Only after the XML declaration
+    strings = ET.fromstring(compact.split("\n", 1)[1]).iter(
+        "{http://www.loc.gov/standards/alto/ns-v4#}String"
+    )
+    assert [s.get("CONTENT") for s in strings] == [text for _, (text, _) in OCR_RESULTS]
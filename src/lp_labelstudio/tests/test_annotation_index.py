@@ -0,0 +1,111 @@
+import json
+import os
+from PIL import Image
+from lp_labelstudio.annotation_index import (
+    AnnotationIndex,
+    open_annotation_index,
+    update_index,
+    update_indexed_issues,
+)
+from lp_labelstudio.labelstudio_api import get_local_annotations_info
+
+
+def region(region_id, label):
+    return {
+        "id": region_id,
+        "type": "labels",
+        "value": {"x": 1, "y": 2, "width": 3, "height": 4, "labels": [label]},
+    }
+
+
+def write_annotation(issue_dir, annotator, page_number, labels):
+    annotator_dir = issue_dir / "annotations" / annotator
+    annotator_dir.mkdir(parents=True, exist_ok=True)
+    path = annotator_dir / f"page{page_number:02d}.json"
+    annotation = {
+        "id": page_number,
+        "task": {"data": {"pageNumber": page_number}},
+        "result": [region(f"r{i}", label) for i, label in enumerate(labels)],
+    }
+    path.write_text(json.dumps(annotation))
+    return path
+
+
+def test_index_is_updated_incrementally_and_queried(tmp_path):
+    issue_dir = tmp_path / "1994" / "lamasca-1994-01-12"
+    issue_dir.mkdir(parents=True)
+    for page in ("page_01.jpeg", "page_02.jpeg"):
+        Image.new("L", (20, 30)).save(issue_dir / page)
+    write_annotation(issue_dir, "a@example.com", 1, ["Headline", "Text"])
+    path = write_annotation(issue_dir, "b@example.com", 2, ["Text"])
+
+    index = AnnotationIndex(tmp_path / "index.sqlite3")
+    assert index.update(tmp_path) == {"issues": 1, "pages": 2, "annotations": 2}
+    assert index.update(tmp_path) == {"issues": 1, "pages": 0, "annotations": 0}
+
+    assert index.pages() == [
+        str(issue_dir / "page_01.jpeg"),
+        str(issue_dir / "page_02.jpeg"),
+    ]
+    assert index.pages("Headline") == [str(issue_dir / "page_01.jpeg")]
+    assert index.pages("Text", annotator="b@example.com") == [
+        str(issue_dir / "page_02.jpeg")
+    ]
+    assert index.annotator_counts(issue_dir) == {"a@example.com": 1, "b@example.com": 1}
+    results, width, height = index.page_annotation(issue_dir / "page_01.jpeg")
+    assert (len(results), width, height) == (2, 20, 30)
+
+    write_annotation(issue_dir, "b@example.com", 2, ["Headline", "Headline"])
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert index.update(tmp_path) == {"issues": 1, "pages": 0, "annotations": 1}
+    assert index.pages("Headline", min_count=2) == [str(issue_dir / "page_02.jpeg")]
+
+    path.unlink()
+    (issue_dir / "page_01.jpeg").unlink()
+    index.update(tmp_path)
+    assert index.pages() == []
+    assert index.annotator_counts(issue_dir) == {}
+
+
+def test_stale_index_falls_back_to_the_annotation_files(tmp_path, monkeypatch):
+    monkeypatch.setenv("LP_ANNOTATION_INDEX", str(tmp_path / "index.sqlite3"))
+    issue_dir = tmp_path / "1994" / "lamasca-1994-01-12"
+    issue_dir.mkdir(parents=True)
+    Image.new("L", (20, 30)).save(issue_dir / "page_01.jpeg")
+    write_annotation(issue_dir, "a@example.com", 1, ["Headline"])
+    (issue_dir / "annotations" / "a@example.com" / "notes.txt").write_text("ignored")
+    update_index(tmp_path / "index.sqlite3", tmp_path)
+
+    index = open_annotation_index()
+    assert index.annotator_counts(issue_dir) == {"a@example.com": 1}
+    assert len(index.page_annotation(issue_dir / "page_01.jpeg")[0]) == 1
+
+    # Written by `projects fetch` without updating the index
+    write_annotation(issue_dir, "a@example.com", 1, ["Headline", "Text"])
+    write_annotation(issue_dir, "b@example.com", 1, ["Text"])
+    assert index.page_annotation(issue_dir / "page_01.jpeg") is None
+    assert index.annotator_counts(issue_dir) is None
+    _, to_fetch, annotators = get_local_annotations_info(
+        str(tmp_path / "1994"), "lamasca-1994-01-12", 3
+    )
+    assert (to_fetch, dict(annotators)) == (1, {"a@example.com": 1, "b@example.com": 1})
+
+    assert update_indexed_issues([issue_dir]) == 2
+    assert index.annotator_counts(issue_dir) == {"a@example.com": 1, "b@example.com": 1}
+    assert len(index.page_annotation(issue_dir / "page_01.jpeg")[0]) == 2
+    index.close()
+
+
+def test_directories_not_named_after_an_issue_are_skipped(tmp_path, caplog):
+    issue_dir = tmp_path / "1994" / "lamasca-1994-01-12"
+    scans_dir = tmp_path / "scans"
+    for directory in (issue_dir, scans_dir):
+        directory.mkdir(parents=True)
+        Image.new("L", (20, 30)).save(directory / "page_01.jpeg")
+        write_annotation(directory, "a@example.com", 1, ["Text"])
+
+    index = AnnotationIndex(tmp_path / "index.sqlite3")
+    assert index.update(tmp_path) == {"issues": 1, "pages": 1, "annotations": 1}
+    assert index.pages() == [str(issue_dir / "page_01.jpeg")]
+    assert f"Skipping {scans_dir}" in caplog.text
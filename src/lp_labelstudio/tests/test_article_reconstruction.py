@@ -0,0 +1,118 @@
+import random
+from collections import defaultdict
+import pytest
+from lp_labelstudio.article_reconstruction import ArticleReconstructor
+
+LABELS = ["Headline", "SubHeadline", "Text", "Photograph", "Author"]
+
+
+def make_reconstructor(count: int, extent: float, seed: int) -> ArticleReconstructor:
+    """A reconstructor with `count` random zones spread over `extent` units"""
+    rng = random.Random(seed)
+    reconstructor = ArticleReconstructor()
+    for i in range(count):
+        reconstructor.add_zone(
+            {
+                "id": f"zone{i}",
+                "value": {
+                    "x": rng.uniform(0, extent),
+                    # Repeated coordinates exercise ties in the sort
+                    "y": rng.choice([rng.uniform(0, extent), 10.0]),
+                    "width": rng.uniform(1, 30),
+                    "height": rng.uniform(1, 10),
+                    "labels": [rng.choice(LABELS)],
+                },
+            }
+        )
+    return reconstructor
+
+
+def all_pairs_graph(reconstructor: ArticleReconstructor):
+    """Graph and debug weights computed by evaluating every pair of zones"""
+    zones = sorted(reconstructor.zones, key=lambda z: z.y)
+    graph = defaultdict(list)
+    for i, zone1 in enumerate(zones):
+        for zone2 in zones[i + 1 :]:
+            weight = reconstructor._calculate_edge_weight(zone1, zone2)
+            if weight > 0:
+                graph[zone1.id].append((zone2.id, weight))
+    return dict(graph), {zone.id: zone.debug_weights for zone in zones}
+
+
+@pytest.mark.parametrize("count,extent", [(0, 100), (1, 100), (60, 100), (300, 1000)])
+@pytest.mark.parametrize("seed", [0, 1])
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_build_graph_matches_all_pairs(count, extent, seed, vectorized):
+    expected_graph, expected_debug = all_pairs_graph(
+        make_reconstructor(count, extent, seed)
+    )
+
+    reconstructor = make_reconstructor(count, extent, seed)
+    reconstructor.build_graph(vectorized=vectorized)
+
+    assert dict(reconstructor.graph) == expected_graph
+    assert {
+        zone.id: zone.debug_weights for zone in reconstructor.zones
+    } == expected_debug
+
+
+def test_vectorized_graph_across_blocks():
+    reconstructor = make_reconstructor(700, 100, 2)
+    reconstructor.build_graph()
+    vectorized = make_reconstructor(700, 100, 2)
+    vectorized.build_graph(vectorized=True, debug=False)
+
+    assert dict(vectorized.graph) == dict(reconstructor.graph)
+    assert all(zone.debug_weights is None for zone in vectorized.zones)
+
+
+def list_traversal_articles(reconstructor: ArticleReconstructor):
+    """Articles as ids, grouped by scanning a list for the strongest connection"""
+    articles = []
+    visited = set()
+    for headline in [z for z in reconstructor.zones if z.label == "Headline"]:
+        if headline.id in visited:
+            continue
+        article = [headline.id]
+        visited.add(headline.id)
+        stack = list(reconstructor.graph[headline.id])
+        while stack:
+            zone_id, weight = max(stack, key=lambda x: x[1])
+            stack.remove((zone_id, weight))
+            if zone_id not in visited:
+                article.append(zone_id)
+                visited.add(zone_id)
+                stack.extend(reconstructor.graph[zone_id])
+        articles.append(article)
+    return articles
+
+
+@pytest.mark.parametrize("count,extent", [(60, 100), (150, 200)])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_reconstruct_articles_matches_list_traversal(count, extent, seed):
+    reconstructor = make_reconstructor(count, extent, seed)
+    reconstructor.build_graph(vectorized=True, debug=False)
+
+    articles = [[zone.id for zone in a] for a in reconstructor.reconstruct_articles()]
+
+    assert articles == list_traversal_articles(reconstructor)
+
+
+def test_reconstruct_articles_ties_follow_insertion_order():
+    reconstructor = make_reconstructor(0, 100, 0)
+    for i, label in enumerate(["Headline", "Text", "Text", "Text", "Text"]):
+        reconstructor.add_zone(
+            {
+                "id": f"z{i}",
+                "value": {"x": 0, "y": i, "width": 1, "height": 1, "labels": [label]},
+            }
+        )
+    reconstructor.build_graph(debug=False)
+    reconstructor.graph.clear()
+    reconstructor.graph["z0"] = [("z3", 0.5), ("z1", 0.5), ("z2", 0.9)]
+    reconstructor.graph["z2"] = [("z4", 0.5), ("z1", 0.5)]
+
+    articles = [[zone.id for zone in a] for a in reconstructor.reconstruct_articles()]
+
+    assert articles == [["z0", "z2", "z3", "z1", "z4"]]
+    assert articles == list_traversal_articles(reconstructor)
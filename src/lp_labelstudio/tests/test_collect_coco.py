@@ -0,0 +1,51 @@
+import gzip
+import json
+from lp_labelstudio.collect_coco import collect_coco, collect_coco_dict
+from lp_labelstudio.constants import NEWSPAPER_CATEGORIES
+
+
+def write_manifest(path, labels_per_page):
+    manifest = []
+    for i, labels in enumerate(labels_per_page):
+        item = {"data": {"ocr": f"https://example.com/page_{i + 1:02d}.jpeg"}}
+        if labels is not None:
+            item["annotations"] = [
+                {
+                    "result": [
+                        {
+                            "original_width": 3000,
+                            "original_height": 4500,
+                            "value": {
+                                "x": 10,
+                                "y": 20 + j,
+                                "width": 30,
+                                "height": 5,
+                                "labels": [label],
+                            },
+                        }
+                        for j, label in enumerate(labels)
+                    ]
+                }
+            ]
+        manifest.append(item)
+    path.write_text(json.dumps(manifest))
+    return str(path)
+
+
+def test_streamed_output_matches_the_in_memory_data(tmp_path):
+    categories = [category.copy() for category in NEWSPAPER_CATEGORIES]
+    manifests = [
+        write_manifest(tmp_path / "a.json", [["Headline", "Text"], None]),
+        write_manifest(tmp_path / "b.json", [["Unknown label"], ["Text"]]),
+    ]
+    collect_coco(manifests, str(tmp_path / "coco.json.gz"))
+    with gzip.open(tmp_path / "coco.json.gz", "rt") as f:
+        streamed = json.load(f)
+    expected = collect_coco_dict(manifests)
+
+    assert len(streamed["images"]) == 3
+    assert [a["image_id"] for a in streamed["annotations"]] == [0, 0, 1, 2]
+    assert streamed["categories"][-1]["name"] == "Unknown label"
+    for key in ("images", "annotations", "categories"):
+        assert streamed[key] == expected[key]
+    assert NEWSPAPER_CATEGORIES == categories
@@ -0,0 +1,57 @@
+import pytest
+from click.testing import CliRunner
+from PIL import Image
+from lp_labelstudio.derivatives import Derivative, generate_derivatives
+
+
+def test_derivatives_are_generated_once(tmp_path):
+    source, output = tmp_path / "pages", tmp_path / "derivatives"
+    issue_dir = source / "lamasca-1994-01-12"
+    issue_dir.mkdir(parents=True)
+    Image.new("L", (2000, 3000), 200).save(issue_dir / "page_01.jpeg")
+    args = [
+        str(source),
+        str(output),
+        "--derivative",
+        "preview=1000:jpeg",
+        "--derivative",
+        "master=full:tiff",
+        "--workers",
+        "1",
+    ]
+
+    result = CliRunner().invoke(generate_derivatives, args)
+    assert result.exit_code == 0, result.output
+    assert "Wrote 2 derivatives" in result.output
+    with Image.open(output / "preview" / "lamasca-1994-01-12" / "page_01.jpeg") as img:
+        assert img.size == (1000, 1500)
+    with Image.open(output / "master" / "lamasca-1994-01-12" / "page_01.tif") as img:
+        assert img.size == (2000, 3000)
+
+    result = CliRunner().invoke(generate_derivatives, args)
+    assert "Wrote 0 derivatives" in result.output
+
+
+@pytest.mark.parametrize(
+    "spec",
+    [
+        "preview",
+        "preview=1000",
+        "preview=1000:gif",
+        "preview=0:jpeg",
+        "preview=-10:jpeg",
+        "preview=big:jpeg",
+    ],
+)
+def test_invalid_derivatives(spec):
+    with pytest.raises(ValueError):
+        Derivative.parse(spec)
+
+
+def test_invalid_derivative_option(tmp_path):
+    result = CliRunner().invoke(
+        generate_derivatives,
+        [str(tmp_path), str(tmp_path / "out"), "--derivative", "thumb=0:jpeg"],
+    )
+    assert result.exit_code == 2
+    assert "the width must be a positive number of pixels" in result.output
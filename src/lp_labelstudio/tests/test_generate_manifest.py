@@ -0,0 +1,59 @@
+import json
+import os
+from lp_labelstudio.generate_manifest import generate_labelstudio_manifest
+
+
+def test_manifests_are_only_rewritten_when_inputs_change(tmp_path):
+    issue_dir = tmp_path / "lamasca-1994-01-12"
+    (issue_dir / "annotations" / "annotator@example.com").mkdir(parents=True)
+    for page in ("page_01.jpeg", "page_02.jpeg"):
+        (issue_dir / page).write_bytes(b"")
+    annotation_path = (
+        issue_dir / "annotations" / "annotator@example.com" / "page01.json"
+    )
+    annotation = {"task": {"data": {"pageNumber": 1}}, "result": [], "completed_by": 1}
+    annotation_path.write_text(json.dumps(annotation))
+
+    (issue,) = generate_labelstudio_manifest([str(issue_dir)], workers=2)
+    assert (issue.pages, issue.annotations, issue.written) == (2, 1, True)
+    manifest = json.loads((issue_dir / "manifest.json").read_text())
+    assert [page["id"] for page in manifest] == [
+        "lamasca-1994-01-12-page_01",
+        "lamasca-1994-01-12-page_02",
+    ]
+    assert manifest[0]["annotations"] == [
+        {"task": {"data": {"pageNumber": 1}}, "result": []}
+    ]
+
+    (issue,) = generate_labelstudio_manifest([str(issue_dir)])
+    assert (issue.pages, issue.annotations, issue.written) == (2, 1, False)
+
+    stat = annotation_path.stat()
+    os.utime(annotation_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    (issue,) = generate_labelstudio_manifest([str(issue_dir)])
+    assert issue.written
+
+
+def test_directories_not_named_after_an_issue_still_get_a_manifest(tmp_path):
+    scans_dir = tmp_path / "scans"
+    scans_dir.mkdir()
+    (scans_dir / "page_01.jpeg").write_bytes(b"")
+
+    (issue,) = generate_labelstudio_manifest([str(scans_dir)])
+    assert (issue.pages, issue.written) == (1, True)
+
+
+def test_manifests_are_rewritten_when_the_issue_path_changes(tmp_path, monkeypatch):
+    issue_dir = tmp_path / "lamasca-1994-01-12"
+    issue_dir.mkdir()
+    (issue_dir / "page_01.jpeg").write_bytes(b"")
+
+    (issue,) = generate_labelstudio_manifest([str(issue_dir)])
+    assert issue.written
+    monkeypatch.chdir(tmp_path)
+    (issue,) = generate_labelstudio_manifest(["lamasca-1994-01-12"])
+    assert issue.written
+    manifest = json.loads((issue_dir / "manifest.json").read_text())
+    assert manifest[0]["data"]["ocr"] == "lamasca-1994-01-12/page_01.jpeg"
+    (issue,) = generate_labelstudio_manifest(["lamasca-1994-01-12"])
+    assert not issue.written
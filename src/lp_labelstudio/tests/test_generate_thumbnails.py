@@ -0,0 +1,90 @@
+import json
+import click
+import pytest
+from PIL import Image
+from lp_labelstudio.generate_thumbnails import (
+    INDEX_FILENAME,
+    generate_thumbnails,
+)
+
+
+def write_issue(issue_dir, filenames):
+    issue_dir.mkdir(parents=True, exist_ok=True)
+    manifest = [
+        {"data": {"ocr": f"https://example.com/{filename}", "pageNumber": i + 1}}
+        for i, filename in enumerate(filenames)
+    ]
+    (issue_dir / "manifest.json").write_text(json.dumps(manifest))
+
+
+def test_thumbnails_are_incremental_and_failures_do_not_abort(tmp_path, capsys):
+    source, destination = tmp_path / "pages", tmp_path / "thumbnails"
+    issue_dir = source / "lamasca-1994-01-12"
+    write_issue(issue_dir, ["page_01.jpeg", "page_02.jpeg"])
+    Image.new("L", (2000, 3000), 200).save(issue_dir / "page_01.jpeg")
+    (issue_dir / "page_02.jpeg").write_bytes(b"not a jpeg")
+
+    with pytest.raises(click.ClickException, match="1 thumbnails could not"):
+        generate_thumbnails(str(source), str(destination), workers=1)
+    thumbnail = destination / "lamasca-1994-01-12" / "page_01.jpeg"
+    with Image.open(thumbnail) as img:
+        assert img.size == (1000, 1500)
+    index = json.loads((destination / INDEX_FILENAME).read_text())
+    assert list(index) == ["lamasca-1994-01-12/page_01.jpeg"]
+
+    Image.new("L", (2000, 3000), 100).save(issue_dir / "page_02.jpeg")
+    capsys.readouterr()
+    generate_thumbnails(str(source), str(destination), workers=1)
+    assert (
+        "1 thumbnails to generate, 1 up to date, 0 to remove" in capsys.readouterr().out
+    )
+
+    write_issue(issue_dir, ["page_02.jpeg"])
+    generate_thumbnails(str(source), str(destination), workers=1, dry_run=True)
+    assert "Would remove lamasca-1994-01-12/page_01.jpeg" in capsys.readouterr().out
+    assert thumbnail.exists()
+    generate_thumbnails(str(source), str(destination), workers=1, force=True)
+    assert "1 thumbnails to generate, 0 up to date, 1 to remove" in (
+        capsys.readouterr().out
+    )
+    assert not thumbnail.exists()
+
+
+def test_sidecar_overlays_only_rewrite_the_svg(tmp_path, capsys):
+    source, destination = tmp_path / "pages", tmp_path / "thumbnails"
+    issue_dir = source / "lamasca-1994-01-12"
+    write_issue(issue_dir, ["page_01.jpeg"])
+    Image.new("L", (2000, 3000), 200).save(issue_dir / "page_01.jpeg")
+
+    def annotate(results):
+        manifest = json.loads((issue_dir / "manifest.json").read_text())
+        manifest[0]["annotations"] = [{"result": results}]
+        (issue_dir / "manifest.json").write_text(json.dumps(manifest))
+
+    def zone(zone_id, label, y):
+        return {
+            "id": zone_id,
+            "value": {"x": 10, "y": y, "width": 20, "height": 5, "labels": [label]},
+        }
+
+    annotate([zone("h1", "Headline", 10)])
+    generate_thumbnails(str(source), str(destination), workers=1, overlays="sidecar")
+    thumbnail = destination / "lamasca-1994-01-12" / "page_01.jpeg"
+    svg = destination / "lamasca-1994-01-12" / "page_01.overlay.svg"
+    rendered_at = thumbnail.stat().st_mtime_ns
+    assert 'viewBox="0 0 1000 1500"' in svg.read_text()
+    assert svg.read_text().count("<rect") == 2
+
+    annotate([zone("h1", "Headline", 10), zone("t1", "Text", 20)])
+    capsys.readouterr()
+    generate_thumbnails(
+        str(source), str(destination), workers=1, overlays="sidecar", dry_run=True
+    )
+    assert "Would update the overlay of" in capsys.readouterr().out
+    generate_thumbnails(str(source), str(destination), workers=1, overlays="sidecar")
+    assert thumbnail.stat().st_mtime_ns == rendered_at
+    assert svg.read_text().count("<line") == 1
+    assert svg.read_text().count("<rect") == 3
+
+    generate_thumbnails(str(source), str(destination), workers=1)
+    assert not svg.exists()
@@ -0,0 +1,224 @@
+import json
+import threading
+import pytest
+from PIL import Image, ImageDraw
+from lp_labelstudio import image_processing
+from lp_labelstudio.cli import save_annotations
+from lp_labelstudio.image_processing import (
+    BLOCK_OCR_CONFIG,
+    detect_batch,
+    process_images_batched,
+    process_images_pipelined,
+    process_single_image,
+)
+from lp_labelstudio.ocr import OCR_ENGINES
+
+# Blocks detected on every page: (label, coordinates)
+LAYOUT = [
+    ("Headline", (0, 0, 100, 20)),
+    ("Photograph", (0, 20, 100, 70)),
+    ("Text", (0, 70, 100, 100)),
+]
+
+
+class Block:
+    """Stands in for a layoutparser TextBlock"""
+
+    def __init__(self, label, coordinates):
+        self.type = label
+        self.coordinates = coordinates
+        self.block = self
+
+
+class LayoutModel:
+    """Stands in for Detectron2LayoutModel: every page has the blocks of LAYOUT"""
+
+    def __init__(self):
+        self.batches = []
+
+    def detect(self, image):
+        return [Block(label, coordinates) for label, coordinates in LAYOUT]
+
+    def detect_batch(self, model, images):
+        self.batches.append(len(images))
+        return [self.detect(image) for image in images]
+
+
+class ColourReader:
+    """
+    Stands in for PaddleOCR: the text of a block is the colour of its first pixel.
+    Fails on blocks of the colour `failing`.
+    """
+
+    def __init__(self, failing=None):
+        self.read = []
+        self.failing = failing
+        self.lock = threading.Lock()
+
+    def ocr(self, array, cls=False):
+        text = ",".join(map(str, array[0, 0]))
+        with self.lock:
+            self.read.append(text)
+        if text == self.failing:
+            raise RuntimeError(f"Cannot read {text}")
+        return [[[[[0, 0], [1, 0], [1, 1], [0, 1]], (text, 0.9)]]]
+
+
+@pytest.fixture
+def reader(monkeypatch):
+    """A reader shared by the block OCR engines of all the pipeline workers"""
+    reader = ColourReader()
+    for instance in range(4):
+        key = (tuple(sorted(BLOCK_OCR_CONFIG.items())), instance)
+        monkeypatch.setitem(OCR_ENGINES, key, reader)
+    return reader
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = LayoutModel()
+    monkeypatch.setattr(image_processing, "detect_batch", model.detect_batch)
+    return model
+
+
+def make_pages(directory, count):
+    """Pages whose blocks are filled with (page number, block number, 0)"""
+    directory.mkdir()
+    paths = []
+    for page in range(1, count + 1):
+        image = Image.new("RGB", (100, 100))
+        draw = ImageDraw.Draw(image)
+        for number, (_, (x1, y1, x2, y2)) in enumerate(LAYOUT):
+            draw.rectangle((x1, y1, x2 - 1, y2 - 1), fill=(page, number, 0))
+        path = directory / f"page_{page:02d}.png"
+        image.save(path)
+        paths.append(str(path))
+    return paths
+
+
+def test_all_modes_write_the_same_annotations_in_page_order(tmp_path, model, reader):
+    modes = {
+        "single": lambda paths: (
+            (path, None, process_single_image(path, model, use_cache=False))
+            for path in paths
+        ),
+        "batched": lambda paths: process_images_batched(
+            paths, model, 3, use_cache=False
+        ),
+        "pipelined": lambda paths: process_images_pipelined(
+            paths, model, 2, 3, use_cache=False
+        ),
+        "pipelined-unbatched": lambda paths: process_images_pipelined(
+            paths, model, 1, 2, use_cache=False
+        ),
+    }
+    outputs = {}
+    for mode, process in modes.items():
+        paths = make_pages(tmp_path / mode, 5)
+        results = list(process(paths))
+        assert [path for path, _, _ in results] == paths
+        assert [error for _, error, _ in results] == [None] * 5
+        for path, _, layout in results:
+            save_annotations(path, layout)
+        outputs[mode] = [
+            (tmp_path / mode / f"page_{page:02d}_annotations.json").read_text()
+            for page in range(1, 6)
+        ]
+
+    assert model.batches == [3, 2, 2, 2]
+    for mode in modes:
+        assert outputs[mode] == outputs["single"], mode
+    texts = [
+        element["value"]["text"]
+        for element in json.loads(outputs["single"][1])["predictions"][0]
+        if element["type"] == "textarea"
+    ]
+    assert texts == [["2,0,0"], ["2,2,0"]]
+
+
+def test_only_blocks_with_ocr_labels_are_transcribed(tmp_path, model, reader):
+    paths = make_pages(tmp_path / "pages", 2)
+    for process in (
+        lambda: [
+            (path, None, process_single_image(path, model, use_cache=False))
+            for path in paths
+        ],
+        lambda: process_images_batched(paths, model, 2, use_cache=False),
+        lambda: process_images_pipelined(paths, model, 2, 2, use_cache=False),
+    ):
+        reader.read.clear()
+        for _, _, layout in process():
+            labels = {
+                element["id"]: element["value"]["labels"][0]
+                for element in layout
+                if element["type"] == "labels"
+            }
+            transcribed = [
+                labels[element["id"]]
+                for element in layout
+                if element["type"] == "textarea"
+            ]
+            assert transcribed == ["Headline", "Text"]
+        assert sorted(reader.read) == ["1,0,0", "1,2,0", "2,0,0", "2,2,0"]
+
+    reader.read.clear()
+    list(process_images_pipelined(paths, model, 2, 2, ocr_labels=None, use_cache=False))
+    assert len(reader.read) == 6
+
+
+def test_failing_pages_do_not_block_the_pipeline(tmp_path, model, reader):
+    paths = make_pages(tmp_path / "pages", 5)
+    reader.failing = "2,2,0"
+    with open(paths[2], "wb") as f:
+        f.write(b"not an image")
+    expected = {
+        path: process_single_image(path, model, use_cache=False)
+        for path in (paths[0], paths[3], paths[4])
+    }
+
+    results = list(process_images_pipelined(paths, model, 2, 2, use_cache=False))
+    assert [path for path, _, _ in results] == paths
+    assert results[1][1] == "Cannot read 2,2,0"
+    assert "cannot identify image file" in results[2][1]
+    for path, error, layout in results:
+        if path in expected:
+            assert (error, layout) == (None, expected[path])
+        else:
+            assert layout is None
+
+
+def test_a_batch_is_detected_in_a_single_forward_pass():
+    torch = pytest.importorskip("torch")
+
+    class Transform:
+        def apply_image(self, array):
+            return array
+
+    class Predictor:
+        input_format = "BGR"
+
+        def __init__(self):
+            self.aug = self
+            self.calls = []
+            self.model = self.forward
+
+        def get_transform(self, array):
+            return Transform()
+
+        def forward(self, inputs):
+            self.calls.append(inputs)
+            return [int(item["image"][0, 0, 0]) for item in inputs]
+
+    class Model:
+        def __init__(self):
+            self.model = Predictor()
+
+        def gather_output(self, output):
+            return f"layout {output}"
+
+    model = Model()
+    images = [Image.new("RGB", (30, 20), (value, 0, 0)) for value in (5, 7)]
+    assert detect_batch(model, images) == ["layout 5", "layout 7"]
+    (inputs,) = model.model.calls
+    assert [(item["height"], item["width"]) for item in inputs] == [(20, 30)] * 2
+    assert inputs[0]["image"].shape == torch.Size([3, 20, 30])
@@ -0,0 +1,113 @@
+import numpy as np
+from PIL import Image, ImageDraw
+from lp_labelstudio import ocr
+from lp_labelstudio.ocr import (
+    OCR_CONFIG,
+    OCR_ENGINES,
+    ocr_box,
+    ocr_boxes,
+    open_page,
+    scale_region,
+)
+
+
+class ColourReader:
+    """
+    Stands in for PaddleOCR, reading arrays as BGR like it does:
+    the text of a box is the RGB colour of its first pixel.
+    """
+
+    def read(self, array):
+        blue, green, red = array[0, 0]
+        return f"{red},{green},{blue}"
+
+    def ocr(self, array, cls=False, rec=True):
+        return [[[[[0, 0], [1, 0], [1, 1], [0, 1]], (self.read(array), 0.9)]]]
+
+    drop_score = 0.5
+
+    def __init__(self):
+        self.recognized = []
+
+    def text_recognizer(self, crops):
+        self.recognized.append(len(crops))
+        return [(self.read(crop), 0.9) for crop in crops], 0.0
+
+
+def test_batched_and_single_box_results_agree(monkeypatch):
+    monkeypatch.setitem(
+        OCR_ENGINES, (tuple(sorted(OCR_CONFIG.items())), 0), ColourReader()
+    )
+    for mode, colour in (("RGB", (200, 30, 10)), ("L", 120)):
+        page = Image.new(mode, (1000, 1000), colour)
+        box = (100, 100, 800, 50)
+        single = ocr_box(page, box, use_cache=False)
+        (batched,) = ocr_boxes(page, [box], detect=[False], use_cache=False)
+        assert single == batched
+        expected = "200,30,10" if mode == "RGB" else "120,120,120"
+        assert single == [([100, 100, 900, 150], (expected, 0.9))]
+
+
+def test_lines_of_all_boxes_are_recognized_together(monkeypatch):
+    reader = ColourReader()
+    monkeypatch.setitem(OCR_ENGINES, (tuple(sorted(OCR_CONFIG.items())), 0), reader)
+
+    def detect_lines(engine, region):
+        """Two lines per box: the top and bottom halves"""
+        middle = region.shape[0] // 2
+        return [region[:middle], region[middle:]]
+
+    monkeypatch.setattr(ocr, "detect_lines", detect_lines)
+    page = Image.new("RGB", (1000, 1000), (0, 0, 0))
+    draw = ImageDraw.Draw(page)
+    draw.rectangle((0, 0, 399, 199), fill=(10, 20, 30))
+    draw.rectangle((500, 0, 899, 199), fill=(40, 50, 60))
+    draw.rectangle((0, 500, 799, 549), fill=(70, 80, 90))
+    boxes = [(0, 0, 400, 200), (0, 500, 800, 50), (500, 0, 400, 200)]
+
+    results = ocr_boxes(page, boxes, use_cache=False)
+    assert reader.recognized == [5]
+    assert results == [
+        [
+            ([0, 0, 400, 200], ("10,20,30", 0.9)),
+            ([0, 0, 400, 200], ("10,20,30", 0.9)),
+        ],
+        [([0, 500, 800, 550], ("70,80,90", 0.9))],
+        [
+            ([500, 0, 900, 200], ("40,50,60", 0.9)),
+            ([500, 0, 900, 200], ("40,50,60", 0.9)),
+        ],
+    ]
+
+    # Detected lines recognized with a low score are dropped, single lines are kept
+    reader.text_recognizer = lambda crops: ([("low", 0.1)] * len(crops), 0.0)
+    assert ocr_boxes(page, boxes, use_cache=False) == [
+        [],
+        [([0, 500, 800, 550], ("low", 0.1))],
+        [],
+    ]
+
+
+def dark_bounds(img):
+    rows, columns = np.nonzero(np.array(img) < 128)
+    return columns.min(), rows.min(), columns.max(), rows.max()
+
+
+def test_draft_scaled_regions_match_the_full_resolution_page(tmp_path):
+    page = Image.new("L", (2400, 3600), 255)
+    ImageDraw.Draw(page).rectangle((601, 903, 1000, 1100), fill=0)
+    page.save(tmp_path / "page_01.jpeg", dpi=(300, 300), quality=95)
+
+    drafted = open_page(tmp_path / "page_01.jpeg", target_dpi=150)
+    assert drafted.size == (1200, 1800)
+    assert drafted.info["original_size"] == (2400, 3600)
+    full = Image.open(tmp_path / "page_01.jpeg")
+
+    for box in [(501, 803, 801, 401), (600, 900, 400, 200), (0, 0, 2400, 3600)]:
+        from_draft = scale_region(drafted, box, 150)
+        from_full = scale_region(full, box, 150)
+        assert from_draft.size == from_full.size
+        assert all(
+            abs(a - b) <= 1
+            for a, b in zip(dark_bounds(from_draft), dark_bounds(from_full))
+        )
@@ -0,0 +1,113 @@
+import itertools
+import sqlite3
+import threading
+import pytest
+from types import SimpleNamespace
+from PIL import Image
+from lp_labelstudio import ocr_cache
+from lp_labelstudio.ocr_cache import (
+    OCRResultCache,
+    cache_key,
+    get_ocr_cache,
+    image_hash,
+)
+
+
+def last_used(path):
+    with sqlite3.connect(path) as db:
+        return dict(db.execute("SELECT key, last_used FROM ocr_results"))
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    """A clock ticking once per reading, so access times are ordered"""
+    ticks = itertools.count(1)
+    monkeypatch.setattr(ocr_cache, "time", SimpleNamespace(time=lambda: next(ticks)))
+
+
+def test_hit_and_miss(tmp_path):
+    cache = OCRResultCache(tmp_path / "ocr.sqlite3")
+    assert cache.get("missing") is None
+    cache.put("key", [[[1, 2, 3, 4], ["text", 0.9]]])
+    assert cache.get("key") == [[[1, 2, 3, 4], ["text", 0.9]]]
+
+    # Access times of hits are only written with the next write
+    inserted = last_used(tmp_path / "ocr.sqlite3")["key"]
+    cache.get("key")
+    assert last_used(tmp_path / "ocr.sqlite3")["key"] == inserted
+    cache.close()
+    assert last_used(tmp_path / "ocr.sqlite3")["key"] > inserted
+
+
+def test_least_recently_used_results_are_evicted(tmp_path):
+    cache = OCRResultCache(tmp_path / "ocr.sqlite3", max_bytes=250)
+    for key in ("a", "b", "c"):
+        cache.put(key, "x" * 100)
+    cache.get("a")
+    cache.evict()
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+    cache.close()
+
+
+def test_keys_depend_on_the_image_box_and_engine(monkeypatch):
+    page = Image.new("L", (100, 100))
+    key = cache_key(page, (1, 2, 3, 4), 150, {"lang": "it"}, "ocr_box")
+    assert key == cache_key(page, (1, 2, 3, 4), 150, {"lang": "it"}, "ocr_box")
+    assert key != cache_key(page, (1, 2, 3, 5), 150, {"lang": "it"}, "ocr_box")
+    assert key != cache_key(page, (1, 2, 3, 4), 150, {"lang": "en"}, "ocr_box")
+    assert key != cache_key(
+        Image.new("L", (100, 100), 255), (1, 2, 3, 4), 150, {"lang": "it"}, "ocr_box"
+    )
+    monkeypatch.setattr(ocr_cache, "paddleocr_version", lambda: "99.0")
+    assert key != cache_key(page, (1, 2, 3, 4), 150, {"lang": "it"}, "ocr_box")
+
+
+def test_location_can_be_overridden(tmp_path, monkeypatch):
+    monkeypatch.setenv("LP_OCR_CACHE", str(tmp_path / "custom.sqlite3"))
+    monkeypatch.setattr(ocr_cache, "CACHE", {})
+    cache = get_ocr_cache()
+    assert get_ocr_cache() is cache
+    cache.put("key", "value")
+    cache.close()
+    assert last_used(tmp_path / "custom.sqlite3").keys() == {"key"}
+
+
+def test_images_in_memory_are_hashed_once(monkeypatch):
+    page = Image.new("L", (100, 100))
+    calls = []
+    monkeypatch.setattr(page, "tobytes", lambda: calls.append(1) or b"page")
+    for box in ((1, 2, 3, 4), (5, 6, 7, 8)):
+        cache_key(page, box, 150, {"lang": "it"}, "ocr_box")
+    assert len(calls) == 1
+    # Images derived from the page are hashed on their own
+    assert image_hash(Image.new("L", (100, 100)).crop((0, 0, 50, 50))) != (
+        image_hash(page)
+    )
+
+
+def test_concurrent_first_use_opens_a_single_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("LP_OCR_CACHE", str(tmp_path / "ocr.sqlite3"))
+    monkeypatch.setattr(ocr_cache, "CACHE", {})
+    opened = []
+
+    class SlowCache(OCRResultCache):
+        def __init__(self, *args):
+            opened.append(self)
+            threading.Event().wait(0.05)
+            super().__init__(*args)
+
+    monkeypatch.setattr(ocr_cache, "OCRResultCache", SlowCache)
+    caches = []
+    threads = [
+        threading.Thread(target=lambda: caches.append(get_ocr_cache()))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(opened) == 1
+    assert all(cache is opened[0] for cache in caches)
+    opened[0].close()
@@ -0,0 +1,125 @@
+import json
+import xml.etree.ElementTree as ET
+from click.testing import CliRunner
+from PIL import Image
+from lp_labelstudio.alto_generator import ALTO_NAMESPACE
+from lp_labelstudio.oni_batch import build_oni_batch
+
+METS = "{http://www.loc.gov/METS/}"
+NDNP = "{http://www.loc.gov/ndnp}"
+ALTO = f"{{{ALTO_NAMESPACE}}}"
+
+
+def write_transcription(image_path, text):
+    annotations = {
+        "predictions": [
+            [
+                {
+                    "type": "textarea",
+                    "value": {"x": 10, "y": 20, "width": 50, "height": 5, "text": text},
+                }
+            ]
+        ]
+    }
+    image_path.with_name(f"{image_path.stem}_annotations.json").write_text(
+        json.dumps(annotations)
+    )
+
+
+def build(issue_dirs, output_dir):
+    args = [*map(str, issue_dirs), "--output-dir", str(output_dir), "--workers", "1"]
+    return CliRunner().invoke(build_oni_batch, args)
+
+
+def test_batch_structure_and_incremental_rebuild(tmp_path):
+    issue_dir = tmp_path / "1994" / "lamasca-1994-01-12"
+    issue_dir.mkdir(parents=True)
+    for page in (1, 2):
+        image_path = issue_dir / f"page_{page:02d}.jpeg"
+        Image.new("L", (200, 300), 255).save(image_path)
+        write_transcription(image_path, ["Prima riga", f"pagina {page}"])
+    output_dir = tmp_path / "batches"
+
+    result = build([issue_dir], output_dir)
+    assert result.exit_code == 0, result.output
+    assert "Encoded 2 pages, 0 were up to date" in result.output
+
+    data_dir = output_dir / "batch_lamasca_1994_ver01" / "data"
+    issue_folder = data_dir / "sn00000001" / "001" / "1994011201"
+    assert sorted(path.name for path in issue_folder.iterdir()) == [
+        "0001.jp2",
+        "0001.tif",
+        "0001.xml",
+        "0002.jp2",
+        "0002.tif",
+        "0002.xml",
+        "1994011201.xml",
+    ]
+
+    batch = ET.parse(data_dir / "batch.xml").getroot()
+    assert batch.get("name") == "batch_lamasca_1994_ver01"
+    assert batch.get("awardYear") == "1994"
+    issues = batch.findall(f"{NDNP}issue")
+    assert [(issue.get("issueDate"), issue.text) for issue in issues] == [
+        ("1994-01-12", "./sn00000001/001/1994011201/1994011201.xml")
+    ]
+
+    mets = ET.parse(issue_folder / "1994011201.xml").getroot()
+    pages = mets.findall(f"{METS}structMap/{METS}div/{METS}div")
+    assert [page.get("DMDID") for page in pages] == ["pageModsBib1", "pageModsBib2"]
+    assert [fptr.get("FILEID") for fptr in pages[1]] == [
+        "serviceFile2",
+        "masterFile2",
+        "ocrFile2",
+    ]
+    assert [
+        location.get("{http://www.w3.org/1999/xlink}href")
+        for location in mets.iter(f"{METS}FLocat")
+    ] == [
+        "./0001.jp2",
+        "./0001.tif",
+        "./0001.xml",
+        "./0002.jp2",
+        "./0002.tif",
+        "./0002.xml",
+    ]
+    assert [
+        element.text for element in mets.iter("{http://www.loc.gov/mix/}ImageWidth")
+    ] == ["200"] * 4
+
+    alto = ET.parse(issue_folder / "0002.xml").getroot()
+    page = alto.find(f"{ALTO}Layout/{ALTO}Page")
+    assert (page.get("WIDTH"), page.get("HEIGHT")) == ("200.0", "300.0")
+    strings = [string.get("CONTENT") for string in alto.iter(f"{ALTO}String")]
+    assert strings == ["Prima riga pagina 2"]
+
+    mtimes = {path: path.stat().st_mtime_ns for path in issue_folder.glob("000*")}
+    result = build([issue_dir], output_dir)
+    assert result.exit_code == 0, result.output
+    assert "Encoded 0 pages, 2 were up to date" in result.output
+    assert {path: path.stat().st_mtime_ns for path in mtimes} == mtimes
+
+
+def test_issues_without_pages_are_left_out(tmp_path):
+    issue_dir = tmp_path / "lamasca-1994-01-12"
+    empty_dir = tmp_path / "lamasca-1994-01-19"
+    for directory in (issue_dir, empty_dir):
+        directory.mkdir()
+    Image.new("L", (200, 300), 255).save(issue_dir / "page_01.jpeg")
+
+    result = build([issue_dir, empty_dir], tmp_path / "batches")
+    assert result.exit_code == 0, result.output
+
+    data_dir = tmp_path / "batches" / "batch_lamasca_1994_ver01" / "data"
+    batch = ET.parse(data_dir / "batch.xml").getroot()
+    assert [issue.get("issueDate") for issue in batch] == ["1994-01-12"]
+    assert not (data_dir / "sn00000001" / "001" / "1994011901").exists()
+
+
+def test_issue_directories_must_be_named_after_their_date(tmp_path):
+    issue_dir = tmp_path / "scans"
+    issue_dir.mkdir()
+
+    result = build([issue_dir], tmp_path / "batches")
+    assert result.exit_code == 1
+    assert "scans is not an issue directory named lamasca-YYYY-MM-DD" in result.output
@@ -0,0 +1,61 @@
+import json
+from click.testing import CliRunner
+from lp_labelstudio.reconstruct_articles import (
+    ARTICLES_FILENAME,
+    reconstruct_articles,
+)
+
+
+def result(zone_id, label, x, y, width=20, height=5):
+    return {
+        "id": zone_id,
+        "type": "labels",
+        "value": {"x": x, "y": y, "width": width, "height": height, "labels": [label]},
+    }
+
+
+def write_issue(issue_dir, pages):
+    issue_dir.mkdir(parents=True)
+    manifest = [
+        {
+            "data": {"pageNumber": page_number},
+            "annotations": [{"result": results}] if results else [],
+        }
+        for page_number, results in pages.items()
+    ]
+    (issue_dir / "manifest.json").write_text(json.dumps(manifest))
+
+
+def run(source_folder):
+    result = CliRunner().invoke(
+        reconstruct_articles, [str(source_folder), "--workers", "1"]
+    )
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def test_reconstruct_articles_writes_and_skips_unchanged_pages(tmp_path):
+    issue_dir = tmp_path / "1994" / "lamasca-1994-01-12"
+    write_issue(
+        issue_dir,
+        {
+            1: [
+                result("h1", "Headline", 10, 10),
+                result("t1", "Text", 10, 20),
+                result("d1", "Date", 80, 2),
+            ],
+            2: [],
+        },
+    )
+
+    assert "of 1 pages in 1 issues" in run(tmp_path)
+    data = json.loads((issue_dir / ARTICLES_FILENAME).read_text())
+    assert list(data["pages"]) == ["1"]
+    assert data["pages"]["1"]["articles"] == [
+        [
+            {"id": "h1", "label": "Headline", "bbox": [10, 10, 20, 5]},
+            {"id": "t1", "label": "Text", "bbox": [10, 20, 20, 5]},
+        ]
+    ]
+
+    assert "of 0 pages in 0 issues" in run(tmp_path)
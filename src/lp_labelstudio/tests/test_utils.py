@@ -0,0 +1,30 @@
+import math
+import pytest
+from lp_labelstudio.utils import atomic_output, run_tasks
+
+
+@pytest.mark.parametrize("workers, chunksize", [(1, 1), (2, 1), (2, 3)])
+def test_run_tasks_reports_every_task(workers, chunksize):
+    consumed = []
+
+    def tasks():
+        for task in (4, -1, 9, 16, 25, 36, 49):
+            consumed.append(task)
+            yield task
+
+    outcomes = {
+        task: (error, result)
+        for task, error, result in run_tasks(math.sqrt, tasks(), workers, chunksize)
+    }
+    assert consumed == [4, -1, 9, 16, 25, 36, 49]
+    assert outcomes.pop(-1) == ("math domain error", None)
+    assert outcomes == {task: (None, math.sqrt(task)) for task in consumed if task > 0}
+
+
+def test_atomic_output_leaves_no_partial_file(tmp_path):
+    path = tmp_path / "page_01.tif"
+    with pytest.raises(RuntimeError):
+        with atomic_output(path) as tmp:
+            tmp.write_text("partial")
+            raise RuntimeError("interrupted")
+    assert list(tmp_path.iterdir()) == []
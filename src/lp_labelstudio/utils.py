@@ -0,0 +1,95 @@
+"""
+Helpers shared by the commands that process pages in bulk: writing output files
+atomically, telling whether an output is up to date, and running page tasks in a pool
+of processes.
+"""
+
+import os
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+def is_up_to_date(output: Path, source: Path) -> bool:
+    """Tell whether `output` exists and is newer than `source` (if `source` exists)"""
+    if not output.exists():
+        return False
+    return not source.exists() or output.stat().st_mtime >= source.stat().st_mtime
+
+
+@contextmanager
+def atomic_output(path: Path) -> Iterator[Path]:
+    """
+    Yield a temporary path to write to, moved to `path` when done, so that interrupted
+    runs never leave truncated files that look up to date.
+    """
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def write_atomically(path: Path, text: str) -> None:
+    """Write a text file so that readers never see it half written"""
+    with atomic_output(path) as tmp_path:
+        tmp_path.write_text(text)
+
+
+def run_tasks(
+    function: Callable[[T], Any],
+    tasks: Iterable[T],
+    workers: int,
+    chunksize: int = 1,
+) -> Iterator[Tuple[T, Optional[str], Any]]:
+    """
+    Call `function` on every task and yield (task, error message, result) as they
+    complete. A task that raises is reported with its error message and a None result,
+    without stopping the others.
+
+    With more than one worker, tasks are sent to a pool of processes `chunksize` at
+    a time, with at most two chunks per worker in flight: `tasks` can be a generator,
+    which is only consumed as workers become free. `function` and the tasks must be
+    picklable.
+    """
+    if workers == 1:
+        for task in tasks:
+            yield (task, *call_task(function, task))
+        return
+    iterator = iter(tasks)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = {}
+        while True:
+            chunk = list(islice(iterator, chunksize))
+            if chunk:
+                future = executor.submit(call_tasks, function, chunk)
+                in_flight[future] = chunk
+                if len(in_flight) < 2 * workers:
+                    continue
+            if not in_flight:
+                return
+            done, _ = wait(
+                in_flight, return_when=FIRST_COMPLETED if chunk else ALL_COMPLETED
+            )
+            for future in done:
+                for task, outcome in zip(in_flight.pop(future), future.result()):
+                    yield (task, *outcome)
+
+
+def call_tasks(
+    function: Callable[[T], Any], tasks: List[T]
+) -> List[Tuple[Optional[str], Any]]:
+    return [call_task(function, task) for task in tasks]
+
+
+def call_task(function: Callable[[T], Any], task: T) -> Tuple[Optional[str], Any]:
+    try:
+        return None, function(task)
+    except Exception as e:
+        return str(e), None
@@ -22,8 +22,10 @@ trap error_handler ERR
 aria2c -d /tmp -c https://newspapers.codemyriad.io/lamasca-pages/1994/coco-all.json
 
 # Extract and transform URLs
-grep "https://eu2.contabostorage.com/55b89d240dba4119bef0d60e8402458a:newspapers" /tmp/coco-all.json | \
-    sed -e 's/.*"file_name": "//;s/".*//;s|https://eu2.contabostorage.com/55b89d240dba4119bef0d60e8402458a:newspapers|https://newspapers.codemyriad.io|' | \
+# (the COCO file is compact JSON on a single line, so read the file names with python)
+python3 -c 'import json, sys; print("\n".join(image["file_name"] for image in json.load(sys.stdin)["images"]))' < /tmp/coco-all.json | \
+    grep "https://eu2.contabostorage.com/55b89d240dba4119bef0d60e8402458a:newspapers" | \
+    sed -e 's|https://eu2.contabostorage.com/55b89d240dba4119bef0d60e8402458a:newspapers|https://newspapers.codemyriad.io|' | \
     sort > /tmp/urls.txt
 
 # Prepare directories
@@ -65,7 +67,7 @@ done
 
 # Prepare local COCO JSON
 cp /tmp/coco-all.json /tmp/coco-local.json
-sed -i -e 's|https://eu2.contabostorage.com/55b89d240dba4119bef0d60e8402458a:|/tmp/|' /tmp/coco-local.json
+sed -i -e 's|https://eu2.contabostorage.com/55b89d240dba4119bef0d60e8402458a:|/tmp/|g' /tmp/coco-local.json
 
 # Download base model
 aria2c -d /training/base-model https://newspapers.codemyriad.io/lamasca-training/base-model/model_final.pth
@@ -2,7 +2,16 @@
 
 lp-labelstudio labelstudio-api projects fetch
 lp-labelstudio generate-labelstudio-manifest /tmp/newspapers/lamasca-pages/1994/lamasca-*
-rm -r /tmp/thumbnails /tmp/sigal-thumbnails/
-lp-labelstudio generate-thumbnails /tmp/newspapers/lamasca-pages/1994/ /tmp/thumbnails
+lp-labelstudio generate-thumbnails --overlays sidecar /tmp/newspapers/lamasca-pages/1994/ /tmp/thumbnails
+
+# The colorbox theme, with the script showing the overlays (see sigal.conf.py)
+SIGAL_THEMES=$(python -c 'import os, sigal; print(os.path.join(os.path.dirname(sigal.__file__), "themes"))')
+rm -rf /tmp/sigal-theme
+cp -r "$SIGAL_THEMES/colorbox" /tmp/sigal-theme
+mv /tmp/sigal-theme/templates/album.html /tmp/sigal-theme/templates/colorbox_album.html
+cp -r sigal-theme/. /tmp/sigal-theme/
+
 sigal build -c sigal.conf.py /tmp/thumbnails/ /tmp/sigal-thumbnails
+# Sigal only copies images: the overlays go next to the pages they belong to
+rsync -r --include='*/' --include='*.overlay.svg' --exclude='*' /tmp/thumbnails/ /tmp/sigal-thumbnails/
 rsync -r --inplace -v /tmp/sigal-thumbnails/* /tmp/newspapers/lamasca-preview/